@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+    Imports for benchmarks package
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+    Storage backends benchmark, compares write, increment
+    and read throughput of each backend
+    usage: python -m benchmarks.backends [operations]
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from sys import argv
+from shutil import rmtree
+from benchmarks.common import prepare_home, measure, report
+
+home = prepare_home()
+from kio import BACKENDS, create_storage
+
+
+def throughput(backend, count):
+    """
+    measures operations of a backend, syncing after each one
+    as monitor loops do
+    :param backend: backend name
+    :param count: number of operations
+    :return: list of operation and average latency
+    """
+
+    with create_storage({"storage.backend": backend}) as storage:
+        put = storage.put
+        inc = storage.inc
+        get = storage.get
+        sync = storage.sync
+
+        def put_sync(i):
+            put("put%s" % (i % 10), i)
+            sync()
+
+        def inc_sync(i):
+            inc("inc%s" % (i % 10))
+            sync()
+
+        return (
+            ("%s put latency (us/op)" % backend, "%.1f" % measure(put_sync, count)),
+            ("%s inc latency (us/op)" % backend, "%.1f" % measure(inc_sync, count)),
+            ("%s get latency (us/op)" % backend, "%.1f" % measure(lambda i: get("put%s" % (i % 10)), count))
+        )
+
+
+def main():
+    """
+    runs benchmark
+    """
+
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    try:
+        rows = []
+        for backend in sorted(BACKENDS):
+            rows.extend(throughput(backend, count))
+
+        report("storage backends (%s operations)" % count, rows)
+    finally:
+        rmtree(home)
+
+
+if __name__ == "__main__":
+    main()
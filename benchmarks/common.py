@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+    Common functions for benchmarks
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from json import load, dump
+from os import environ, getpid, makedirs
+from os.path import join, dirname, abspath
+from tempfile import mkdtemp
+from time import perf_counter
+
+
+def prepare_home(**overrides):
+    """
+    creates a temporary keeper home with default configuration,
+    must be called before importing keeper packages
+    :param overrides: configuration values to override
+    :return: keeper home path
+    """
+
+    with open(join(dirname(dirname(abspath(__file__))), "config", "keeper.json")) as default:
+        config = load(default)
+
+    # debug logging would dominate measurements
+    config["debug"] = False
+    config.update(overrides)
+    home = mkdtemp(prefix="keeper-benchmark-")
+    config_path = join(home, "config")
+    makedirs(config_path)
+    with open(join(config_path, "keeper.json"), "w") as keeper:
+        dump(config, keeper)
+
+    environ["KEEPER_HOME"] = home
+
+    return home
+
+
+def rss(pid=None):
+    """
+    reads resident memory of a process
+    :param pid: process id, current process when not given
+    :return: resident memory in kB, 0 when not available
+    """
+
+    try:
+        with open("/proc/%s/status" % (pid or getpid())) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+
+    return 0
+
+
+def pss(pid=None):
+    """
+    reads proportional memory of a process, pages shared with other
+    processes are split between them
+    :param pid: process id, current process when not given
+    :return: proportional memory in kB, 0 when not available
+    """
+
+    try:
+        with open("/proc/%s/smaps_rollup" % (pid or getpid())) as smaps:
+            for line in smaps:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+
+    return 0
+
+
+def measure(func, count):
+    """
+    calls a function count times
+    :param func: function receiving the iteration number
+    :param count: number of calls
+    :return: average latency in microseconds
+    """
+
+    start = perf_counter()
+    for i in range(count):
+        func(i)
+
+    return (perf_counter() - start) * 1000000 / count
+
+
+def report(title, rows):
+    """
+    prints a result table
+    :param title: table title
+    :param rows: list of (name, value) tuples
+    """
+
+    print(title)
+    for name, value in rows:
+        print("  %-40s %s" % (name, value))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+    Process launch benchmark, compares time taken by a launched
+    process to import monitor modules with each launch mode
+    usage: python -m benchmarks.launch [launches]
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from importlib import import_module
+from multiprocessing import Pipe, get_all_start_methods, current_process
+from sys import argv
+from shutil import rmtree
+from time import time
+from benchmarks.common import prepare_home, report
+
+# spawned processes import this module again, keeper home is inherited
+if current_process().name == "MainProcess":
+    home = prepare_home()
+
+from core import load_config
+from runtime.manager import MODULES, launch_context
+
+
+def probe(connection):
+    """
+    imports monitor modules and loads configuration like a
+    launched process does, then sends time it was ready
+    :param connection: pipe connection
+    """
+
+    for module in MODULES.values():
+        import_module(module)
+
+    load_config()
+    connection.send(time())
+    connection.close()
+
+
+def launch(mode, count):
+    """
+    launches processes one at a time
+    :param mode: launch mode
+    :param count: number of launches
+    :return: list of launch time in milliseconds
+    """
+
+    context = launch_context(mode)
+    times = []
+    for i in range(count):
+        receiver, sender = Pipe(False)
+        process = context.Process(target=probe, args=(sender,))
+        started = time()
+        process.start()
+        ready = receiver.recv()
+        process.join()
+        receiver.close()
+        times.append((ready - started) * 1000)
+
+    return times
+
+
+def main():
+    """
+    runs benchmark
+    """
+
+    count = int(argv[1]) if len(argv) > 1 else 20
+    try:
+        rows = []
+        for mode in ("spawn", "fork", "forkserver"):
+            if mode not in get_all_start_methods():
+                continue
+
+            times = launch(mode, count + 1)
+            # first fork server launch also starts the server
+            rows.append(("%s first launch (ms)" % mode, "%.1f" % times[0]))
+            rows.append(("%s launch (ms)" % mode, "%.1f" % (sum(times[1:]) / count)))
+
+        report("launch to ready (%s launches)" % count, rows)
+    finally:
+        rmtree(home)
+
+
+if __name__ == "__main__":
+    main()
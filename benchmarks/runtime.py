@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    Runtime benchmark, compares memory and cpu used by keeper
+    with monitors running as processes or as threads
+    usage: python -m benchmarks.runtime [seconds] [broker] [port]
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import environ, listdir, sysconf
+from os.path import join, dirname, abspath
+from shutil import rmtree
+from signal import SIGTERM
+from subprocess import Popen, DEVNULL
+from sys import argv, executable
+from time import sleep
+from benchmarks.common import prepare_home, rss, pss, report
+
+KEEPER = join(dirname(dirname(abspath(__file__))), "keeper.py")
+MODES = ("fork", "forkserver", "thread")
+# seconds keeper runs before being measured
+WARM_UP = 5
+
+
+def tree(pid):
+    """
+    return a process and all of its descendants
+    :param pid: root process id
+    :return: list of process ids
+    """
+
+    children = {}
+    for entry in listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as stat:
+                    ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+            except Exception:
+                continue
+
+            children.setdefault(ppid, []).append(int(entry))
+
+    pids = [pid]
+    for parent in pids:
+        pids.extend(children.get(parent, ()))
+
+    return pids
+
+
+def cpu_time(pids):
+    """
+    sums user and system time of processes
+    :param pids: process ids
+    :return: cpu seconds
+    """
+
+    ticks = 0
+    for pid in pids:
+        try:
+            with open("/proc/%s/stat" % pid) as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+                ticks += int(fields[11]) + int(fields[12])
+        except Exception:
+            pass
+
+    return ticks / sysconf("SC_CLK_TCK")
+
+
+def run(mode, seconds, broker, port):
+    """
+    runs keeper in a launch mode and measures its processes
+    :param mode: launch mode
+    :param seconds: seconds measuring cpu
+    :param broker: mqtt broker
+    :param port: mqtt port
+    :return: list of measure and value
+    """
+
+    home = prepare_home(**{"process.launch.mode": mode, "mqtt.broker": broker, "mqtt.port": port})
+    keeper = Popen([executable, KEEPER], env=dict(environ, KEEPER_HOME=home), stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        sleep(WARM_UP)
+        pids = tree(keeper.pid)
+        started = cpu_time(pids)
+        sleep(seconds)
+        used = cpu_time(pids) - started
+
+        return (
+            ("%s processes" % mode, len(pids)),
+            ("%s rss (kB)" % mode, sum(rss(pid) for pid in pids)),
+            ("%s pss (kB)" % mode, sum(pss(pid) for pid in pids)),
+            ("%s cpu (%%)" % mode, "%.2f" % (used * 100 / seconds))
+        )
+    finally:
+        keeper.send_signal(SIGTERM)
+        try:
+            keeper.wait(30)
+        except Exception:
+            keeper.kill()
+
+        rmtree(home)
+
+
+def main():
+    """
+    runs benchmark
+    """
+
+    seconds = int(argv[1]) if len(argv) > 1 else 30
+    broker = argv[2] if len(argv) > 2 else "127.0.0.1"
+    port = int(argv[3]) if len(argv) > 3 else 1883
+    rows = []
+    for mode in MODES:
+        rows.extend(run(mode, seconds, broker, port))
+
+    report("keeper runtime (%s seconds)" % seconds, rows)
+
+
+if __name__ == "__main__":
+    main()
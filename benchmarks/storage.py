@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    Storage benchmark, compares writes serialized through a
+    multiprocessing manager lock with sqlite native concurrency
+    and write latency of each durability profile
+    usage: python -m benchmarks.storage [writes]
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from sys import argv
+from shutil import rmtree
+from benchmarks.common import prepare_home, rss, measure, report
+
+home = prepare_home()
+from multiprocessing import Manager
+from sqlite3 import connect
+from kio import Storage
+
+LEGACY_INSERT = "insert or ignore into keystore(value, key) values(?, ?)"
+LEGACY_UPDATE = "update keystore set value = ? where changes() = 0 and key = ?"
+
+
+def legacy(storage_path, count):
+    """
+    writes using a manager lock and two statements per transaction
+    :param storage_path: database path
+    :param count: number of writes
+    :return: average latency and resident memory of manager process
+    """
+
+    manager = Manager()
+    # noinspection PyProtectedMember
+    manager_rss = rss(manager._process.pid)
+    lock = manager.Lock()
+    conn = connect(storage_path)
+    conn.execute("pragma journal_mode=wal")
+
+    def put(i):
+        binds = (str(i), "legacy%s" % (i % 10))
+        with lock:
+            conn.execute("begin")
+            conn.execute(LEGACY_INSERT, binds)
+            conn.execute(LEGACY_UPDATE, binds)
+            conn.commit()
+
+    try:
+        return measure(put, count), manager_rss
+    finally:
+        conn.close()
+        manager.shutdown()
+
+
+def native(count):
+    """
+    writes using storage upsert and sqlite locking
+    :param count: number of writes
+    :return: average latency
+    """
+
+    with Storage({}) as storage:
+        put = storage.put
+
+        return measure(lambda i: put("native%s" % (i % 10), i), count)
+
+
+def profiles(count):
+    """
+    writes using each durability profile
+    :param count: number of writes
+    :return: list of profile and average latency
+    """
+
+    result = []
+    for profile in sorted(Storage.PROFILES):
+        with Storage({"storage.profile": profile}) as storage:
+            put = storage.put
+            result.append(
+                ("%s profile latency (us/write)" % profile,
+                 "%.1f" % measure(lambda i: put("%s%s" % (profile, i % 10), i), count)))
+
+    return result
+
+
+def main():
+    """
+    runs benchmark
+    """
+
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    try:
+        base_rss = rss()
+        native_latency = native(count)
+        legacy_latency, manager_rss = legacy(Storage({}).storage_path, count)
+        report("storage writes (%s writes)" % count, (
+            ("manager lock latency (us/write)", "%.1f" % legacy_latency),
+            ("sqlite native latency (us/write)", "%.1f" % native_latency),
+            ("keeper process rss (kB)", base_rss),
+            ("manager lock server rss (kB)", manager_rss)
+        ))
+        report("durability profiles (%s writes)" % count, profiles(count))
+    finally:
+        rmtree(home)
+
+
+if __name__ == "__main__":
+    main()
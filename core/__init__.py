@@ -8,4 +8,5 @@
 from .logger import Logger
 from .common import load_config
 from .common import exec_command
+from .backoff import Backoff
 from .constants import *
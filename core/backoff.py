@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides reconnect delays with exponential backoff and
+    decorrelated jitter
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from random import uniform
+from time import time
+
+
+class Backoff(object):
+    """
+    Each delay is picked between base delay and three times the
+    previous delay, up to a cap, so processes reconnecting together
+    spread their attempts
+    """
+
+    def __init__(self, base=1, cap=60):
+        """
+        initializes backoff
+        :param base: minimum delay in seconds
+        :param cap: maximum delay in seconds
+        """
+
+        self.base = base
+        self.cap = max(cap, base)
+        self.delay = 0
+        self.attempts = 0
+        self.started = None
+        # attempts and seconds taken by last reconnection
+        self.last_attempts = 0
+        self.last_elapsed = 0
+
+    def next(self):
+        """
+        return seconds to wait before next attempt
+        :return: delay in seconds
+        """
+
+        if self.started is None:
+            self.started = time()
+
+        self.attempts += 1
+        self.delay = min(self.cap, uniform(self.base, max(self.delay, self.base) * 3))
+
+        return self.delay
+
+    def elapsed(self):
+        """
+        return seconds since first delayed attempt
+        :return: elapsed seconds
+        """
+
+        return 0 if self.started is None else time() - self.started
+
+    def reset(self):
+        """
+        resets delays once connected, next attempt is not delayed
+        """
+
+        self.last_attempts = self.attempts
+        self.last_elapsed = self.elapsed()
+        self.delay = 0
+        self.attempts = 0
+        self.started = None
@@ -6,20 +6,32 @@
 """
 
 from json import load
-from os import devnull
+from os import devnull, stat
 from os.path import join
 from subprocess import call
 from core.constants import KEEPER_HOME, IS_NT
 
+# parsed configuration and the file version it was parsed from
+parsed_config = None
+
 
 def load_config():
     """
-    loads configuration from json file
+    loads configuration from json file, file is only parsed again
+    when changed
     :return: returns a configuration dict
     """
 
-    with open(join(KEEPER_HOME, "config", "keeper.json")) as config:
-        return load(config)
+    global parsed_config
+    path = join(KEEPER_HOME, "config", "keeper.json")
+    stats = stat(path)
+    version = (stats.st_mtime_ns, stats.st_size)
+    if parsed_config is None or parsed_config[0] != version:
+        with open(path) as config:
+            parsed_config = version, load(config)
+
+    # callers are free to change their copy
+    return dict(parsed_config[1])
 
 
 def exec_command(command):
@@ -24,6 +24,12 @@ CONNECTOR_MQTT_RESTARTS = "kpMQTTRestarts"
 CONNECTOR_MQTT_RESTARTS_ICON = "mdi:restart"
 CONNECTOR_LAST_MQTT_RESTART = "kpLastMqttRestart"
 CONNECTOR_LAST_MQTT_RESTART_ICON = "mdi:calendar-clock"
+CONNECTOR_RECONNECT_TIME = "kpMQTTReconnectTime"
+CONNECTOR_RECONNECT_TIME_ICON = "mdi:timer-sand"
+CONNECTOR_RECONNECT_ATTEMPTS = "kpMQTTReconnectAttempts"
+CONNECTOR_RECONNECT_ATTEMPTS_ICON = "mdi:counter"
+CONNECTOR_LOOP_LATENCY = "kpConnectorLoopLatency"
+CONNECTOR_LOOP_LATENCY_ICON = "mdi:timer"
 HEARTBEATER_STATUS = "kpHeartbeaterStatus"
 HEARTBEATER_STATUS_ICON = "mdi:heart-pulse"
 HEARTBEATER_MISSED_HEARTBEAT = "kpMissedHeartbeats"
@@ -38,6 +44,21 @@ HEARTBEATER_LAST_SYSTEM_RESTART = "kpLastSystemRestart"
 HEARTBEATER_LAST_SYSTEM_RESTART_ICON = "mdi:calendar-clock"
 HEARTBEATER_LAST_HEARTBEAT = "kpLastHeartbeat"
 HEARTBEATER_LAST_HEARTBEAT_ICON = "mdi:calendar-clock"
+HEARTBEATER_LOOP_LATENCY = "kpHeartbeaterLoopLatency"
+HEARTBEATER_LOOP_LATENCY_ICON = "mdi:timer"
 STATE_TOPIC = "homeassistant/sensor/%s/state"
 CONFIG_TOPIC = "homeassistant/sensor/%s/config"
 CONFIG_PAYLOAD = "{\"name\": \"%s\", \"state_topic\": \"" + STATE_TOPIC + "\", \"icon\": \"%s\"}"
+# availability of the sensors of an mqtt client, offline is published by broker
+# as last will when client connection drops
+AVAILABILITY_TOPIC = "homeassistant/sensor/%s/availability"
+AVAILABILITY_CONFIG = ", \"availability_topic\": \"%s\"}"
+AVAILABILITY_ONLINE = "online"
+AVAILABILITY_OFFLINE = "offline"
+# json state mode publishes every metric of a monitor in a single document
+DOCUMENT_NAME = "keeper%s"
+DOCUMENT_CONFIG_PAYLOAD = "{\"name\": \"%s\", \"state_topic\": \"" + STATE_TOPIC + \
+                          "\", \"value_template\": \"{{ value_json.%s }}\", \"json_attributes_topic\": \"" + \
+                          STATE_TOPIC + "\", \"icon\": \"%s\"}"
+# storage key of the fingerprint of a published discovery config
+DISCOVERY_FINGERPRINT = "discovery.%s"
@@ -6,6 +6,7 @@
 """
 from logging import getLevelName, INFO, WARN, ERROR, DEBUG
 from multiprocessing import current_process
+from threading import current_thread, main_thread
 from time import strftime
 
 from core.common import load_config
@@ -22,7 +23,10 @@ class Logger(object):
         partially initializes format
         """
 
-        self.format = "%s " + current_process().name + "-keeper[%s]: %s"
+        # monitors running as threads are named after their thread
+        thread = current_thread()
+        name = current_process().name if thread is main_thread() else thread.name
+        self.format = "%s " + name + "-keeper[%s]: %s"
         self.is_debug = bool(load_config()["debug"])
 
     def info(self, message):
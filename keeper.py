@@ -5,17 +5,58 @@
     :license: MIT, see LICENSE for more details.
 """
 
-from sys import exit
+from sys import exit, argv
 from signal import signal, SIGTERM
 
 from runtime import manager
 
+USAGE = "usage: keeper [export <file> | import <file>]"
+
+
+def transfer(command, path):
+    """
+    exports storage to a file or imports it from a file, files
+    ending with .gz are compressed
+    :param command: export or import
+    :param path: file path
+    :return: exit code
+    """
+
+    from core import load_config, Logger
+    from kio import create_storage, History, export_storage, import_storage, open_stream
+
+    config = load_config()
+    logger = Logger()
+    try:
+        with create_storage(config) as storage, History(storage, config):
+            if command == "export":
+                with open_stream(path, "w") as stream:
+                    result = export_storage(storage, stream)
+            else:
+                with open_stream(path, "r") as stream:
+                    result = import_storage(storage, stream)
+    except Exception as ex:
+        logger.error("%s of %s failed: %s" % (command, path, ex))
+        return 1
+
+    for table, rows in result.items():
+        logger.info("%s %s rows of %s" % (command + "ed", rows, table))
+
+    return 0
+
 
 def main():
     """
     main
     """
 
+    if len(argv) > 1:
+        if len(argv) != 3 or argv[1] not in ("export", "import"):
+            print(USAGE)
+            return 2
+
+        return transfer(argv[1], argv[2])
+
     signal(SIGTERM, manager.handle_signal)
     try:
         manager.start()
@@ -27,5 +68,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
-    exit(0)
+    exit(main() or 0)
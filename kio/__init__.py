@@ -5,4 +5,12 @@
     :license: MIT, see LICENSE for more details.
 """
 
+from .base import BaseStorage, Snapshot
 from .storage import Storage
+from .memory import MemoryStorage
+from .log import LogStorage
+from .backends import BACKENDS, create_storage
+from .history import History, discard
+from .board import Board
+from .transfer import export_storage, import_storage, open_stream
+from .spool import Spool
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides storage backend selection
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from core import Logger, load_config
+from kio.storage import Storage
+from kio.memory import MemoryStorage
+from kio.log import LogStorage
+
+BACKENDS = {
+    "sqlite": Storage,
+    "memory": MemoryStorage,
+    "log": LogStorage
+}
+
+
+def create_storage(config=None):
+    """
+    creates storage object for configured backend
+    :param config: keeper configuration dict, loaded from file when not given
+    :return: storage object
+    """
+
+    if config is None:
+        config = load_config()
+
+    backend = config.get("storage.backend", "sqlite")
+    if backend not in BACKENDS:
+        Logger().warning("unknown storage backend %s, using sqlite backend" % backend)
+        backend = "sqlite"
+
+    return BACKENDS[backend](config)
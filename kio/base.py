@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides the interface shared by storage backends
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from abc import ABC, abstractmethod
+from core import Logger
+
+
+class BaseStorage(ABC):
+    """
+    Common methods for accessing storage, backends implement
+    multi key operations and snapshots
+    """
+
+    NUMBER_TYPE = (int, float)
+    # whether backend provides sql access through conn and transaction
+    SUPPORTS_SQL = False
+
+    def __init__(self):
+        """
+        initializes storage object
+        """
+
+        self.logger = Logger()
+
+    def __enter__(self):
+        """
+        entering context
+        :return: Storage object
+        """
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    def __exit__(self, type, value, traceback):
+        """
+        writes pending data when exiting context
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        try:
+            self.flush()
+        except Exception as ex:
+            self.logger.error("failed to flush storage: %s" % ex)
+
+    def put(self, key, value):
+        """
+        inserts/updates a value for a given key
+        :param key: Key
+        :param value: Value
+        :return: initial value
+        """
+
+        self.put_many({key: value})
+
+        return value
+
+    @abstractmethod
+    def put_many(self, values):
+        """
+        inserts/updates several keys
+        :param values: dict of keys and values
+        :return: initial values
+        """
+
+    @abstractmethod
+    def inc(self, key, value=0, inc_value=1):
+        """
+        atomically increments the stored value for a given key
+        :param key: Key
+        :param value: initial value used when key is not stored yet
+        :param inc_value: units to increment, default 1
+        :return: returns value already incremented
+        """
+
+    @abstractmethod
+    def inc_many(self, values):
+        """
+        atomically increments several keys
+        :param values: dict of keys and units to increment
+        :return: dict of keys and values already incremented
+        """
+
+    def get(self, key):
+        """
+        return the key value
+        :param key: key
+        :return: key value
+        """
+
+        return self.get_many((key,))[key]
+
+    @abstractmethod
+    def get_many(self, keys):
+        """
+        return values for several keys
+        :param keys: keys
+        :return: dict of keys and values, None for keys not stored
+        """
+
+    def get_int(self, key):
+        """
+        return the key value as int value
+        :param key: key
+        :return: key value
+        """
+
+        result = self.get(key)
+
+        return int(result) if result else 0
+
+    def get_float(self, key):
+        """
+        return the key value as float value
+        :param key: key
+        :return: key value
+        """
+
+        result = self.get(key)
+
+        return float(result) if result else 0
+
+    @abstractmethod
+    def snapshot(self):
+        """
+        loads all stored keys
+        :return: snapshot with all keys and values
+        """
+
+    def sync(self):
+        """
+        called once per loop tick
+        """
+
+        pass
+
+    def flush(self):
+        """
+        writes pending data
+        """
+
+        pass
+
+
+class Snapshot(dict):
+    """
+    In memory copy of stored keys and values
+    """
+
+    def get_int(self, key):
+        """
+        return the key value as int value
+        :param key: key
+        :return: key value
+        """
+
+        result = self.get(key)
+
+        return int(result) if result else 0
+
+    def get_float(self, key):
+        """
+        return the key value as float value
+        :param key: key
+        :return: key value
+        """
+
+        result = self.get(key)
+
+        return float(result) if result else 0
+
+
+def encode(values):
+    """
+    converts numeric values into strings
+    :param values: dict of keys and values
+    :return: dict of keys and stored values
+    """
+
+    number_type = BaseStorage.NUMBER_TYPE
+
+    return {key: str(value) if isinstance(value, number_type) else value for key, value in values.items()}
+
+
+def to_number(value):
+    """
+    converts a stored value into a number
+    :param value: stored value
+    :return: int or float value
+    """
+
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides a board of live process status and counters shared
+    between keeper processes through a memory mapped file
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from mmap import mmap
+from os import makedirs, getpid
+from os.path import join, isdir
+from struct import Struct
+from time import time
+from zlib import crc32
+from core import KEEPER_HOME, Logger, STATUS_RUNNING, STATUS_NOT_RUNNING, HEARTBEATER_MISSED_HEARTBEAT, \
+    HEARTBEATER_HA_RESTARTS, HEARTBEATER_SYSTEM_RESTARTS, CONNECTOR_FAILED_CONNECTIONS, CONNECTOR_MQTT_RESTARTS
+
+# counters held by each process slot, in slot order
+SLOTS = (
+    ("manager", ("checks", "launches", "hangs", "quarantines")),
+    ("heartbeater", ("heartbeats", "misses", "attempts", HEARTBEATER_MISSED_HEARTBEAT, HEARTBEATER_HA_RESTARTS,
+                     HEARTBEATER_SYSTEM_RESTARTS, "published", "saved", "latency", "ready")),
+    ("connector", ("connected", "attempts", CONNECTOR_FAILED_CONNECTIONS, CONNECTOR_MQTT_RESTARTS, "retries",
+                   "published", "saved", "latency", "ready"))
+)
+STATUSES = (None, STATUS_NOT_RUNNING, "Launching", "Launched", STATUS_RUNNING, "Quarantined")
+MAX_COUNTERS = 12
+# status record is written by manager: sequence, status index and pid
+STATUS_RECORD = Struct("<IIi4x")
+# counters record is written by slot owner: sequence, update time and counters
+COUNTERS_RECORD = Struct("<I4xd%dq" % MAX_COUNTERS)
+SLOT_SIZE = STATUS_RECORD.size + COUNTERS_RECORD.size
+BOARD_SIZE = SLOT_SIZE * len(SLOTS)
+SEQUENCE = Struct("<I")
+# reads attempted before a record is considered abandoned by a writer that died mid write
+READ_RETRIES = 10000
+
+
+class Board(object):
+    """
+    Fixed layout of process slots. Each record has a single writer
+    which updates it lock free, readers retry while a write is in
+    progress
+    """
+
+    def __init__(self, path=None):
+        """
+        initializes board
+        :param path: board file, by default within shared memory
+        """
+
+        self.logger = Logger()
+        self.path = path or board_path()
+        self.offsets = {name: i * SLOT_SIZE for i, (name, counters) in enumerate(SLOTS)}
+        self.counter_names = dict(SLOTS)
+        self.buffer = None
+        # last consistent copy of each record read
+        self.records = {}
+
+    def __enter__(self):
+        """
+        maps board file when entering context
+        :return: Board object
+        """
+
+        self.logger.debug("mapping board %s", self.path)
+        with open(self.path, "a+b") as board:
+            if board.seek(0, 2) < BOARD_SIZE:
+                board.truncate(BOARD_SIZE)
+
+            self.buffer = mmap(board.fileno(), BOARD_SIZE)
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    def __exit__(self, type, value, traceback):
+        """
+        unmaps board when exiting context
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        try:
+            self.buffer.close()
+        except Exception:
+            pass
+
+        self.buffer = None
+
+    def clear(self):
+        """
+        resets every slot, used by manager on start
+        """
+
+        self.buffer[:] = bytes(BOARD_SIZE)
+
+    def set_status(self, name, status, pid=None):
+        """
+        updates process status, called only by manager
+        :param name: process name
+        :param status: process status
+        :param pid: process id, default current process
+        """
+
+        self._write(STATUS_RECORD, self.offsets[name], STATUSES.index(status), getpid() if pid is None else pid)
+
+    def status(self, name):
+        """
+        return process status
+        :param name: process name
+        :return: tuple of status and pid
+        """
+
+        status, pid = self._read(STATUS_RECORD, self.offsets[name])
+
+        return STATUSES[status], pid
+
+    def update(self, name, values):
+        """
+        updates all counters of a process, called only by the process
+        owning the slot
+        :param name: process name
+        :param values: dict of counter names and int values
+        """
+
+        counters = [int(values.get(counter, 0)) for counter in self.counter_names[name]]
+        counters.extend([0] * (MAX_COUNTERS - len(counters)))
+        self._write(COUNTERS_RECORD, self.offsets[name] + STATUS_RECORD.size, time(), *counters)
+
+    def counters(self, name):
+        """
+        return process counters
+        :param name: process name
+        :return: tuple of last update time and dict of counter names and values
+        """
+
+        record = self._read(COUNTERS_RECORD, self.offsets[name] + STATUS_RECORD.size)
+
+        return record[0], dict(zip(self.counter_names[name], record[1:]))
+
+    def _write(self, record, offset, *values):
+        """
+        writes a record, sequence is odd while write is in progress.
+        A writer dying mid write leaves an odd sequence, which is
+        kept odd by the next write
+        :param record: record struct
+        :param offset: record offset
+        :param values: record values after sequence
+        """
+
+        buffer = self.buffer
+        sequence = ((SEQUENCE.unpack_from(buffer, offset)[0] + 1) | 1) & 0xffffffff
+        SEQUENCE.pack_into(buffer, offset, sequence)
+        record.pack_into(buffer, offset, sequence, *values)
+        SEQUENCE.pack_into(buffer, offset, (sequence + 1) & 0xffffffff)
+
+    def _read(self, record, offset):
+        """
+        reads a consistent copy of a record, last consistent copy is
+        returned when a write does not complete
+        :param record: record struct
+        :param offset: record offset
+        :return: record values after sequence
+        """
+
+        buffer = self.buffer
+        unpack_from = record.unpack_from
+        for i in range(READ_RETRIES):
+            values = unpack_from(buffer, offset)
+            sequence = values[0]
+            if not sequence & 1 and SEQUENCE.unpack_from(buffer, offset)[0] == sequence:
+                self.records[offset] = values[1:]
+
+                return values[1:]
+
+        self.logger.debug("record at %s is being written for too long", offset)
+
+        return self.records.get(offset) or record.unpack(bytes(record.size))[1:]
+
+
+def board_path():
+    """
+    return board file path, within shared memory when available
+    so updates never reach disk
+    :return: board path
+    """
+
+    if isdir("/dev/shm"):
+        return join("/dev/shm", "keeper-%08x.board" % (crc32(KEEPER_HOME.encode("utf-8")) & 0xffffffff))
+
+    storage_path = join(KEEPER_HOME, "storage")
+    makedirs(storage_path, exist_ok=True)
+
+    return join(storage_path, "keeper.board")
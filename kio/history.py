@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides an append only time series of monitor events
+    with minute and hour rollups
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from time import time
+from core import Logger
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+
+class History(object):
+    """
+    Records metric events and keeps them within retention bounds
+    """
+
+    # base statements
+    CREATE_STATEMENTS = (
+        "create table if not exists history(metric text, ts integer, value real)",
+        "create index if not exists history_metric_ts on history(metric, ts)",
+        "create table if not exists history_minute(metric text, ts integer, count integer, total real, "
+        "minimum real, maximum real, primary key(metric, ts)) without rowid",
+        "create table if not exists history_hour(metric text, ts integer, count integer, total real, "
+        "minimum real, maximum real, primary key(metric, ts)) without rowid",
+        "create table if not exists history_rollup(name text primary key, ts integer)"
+    )
+    INSERT_STATEMENT = "insert into history(metric, ts, value) values(?, ?, ?)"
+    ROLLUP_STATEMENT = "insert into %s(metric, ts, count, total, minimum, maximum) " \
+                       "select metric, ts / %d * %d as bucket, %s, %s, min(%s), max(%s) from %s " \
+                       "where ts >= ? and ts < ? group by metric, bucket " \
+                       "on conflict(metric, ts) do update set count = count + excluded.count, " \
+                       "total = total + excluded.total, minimum = min(minimum, excluded.minimum), " \
+                       "maximum = max(maximum, excluded.maximum)"
+    MINUTE_ROLLUP = ROLLUP_STATEMENT % ("history_minute", MINUTE, MINUTE, "count(*)", "sum(value)", "value", "value",
+                                        "history")
+    HOUR_ROLLUP = ROLLUP_STATEMENT % ("history_hour", HOUR, HOUR, "sum(count)", "sum(total)", "minimum", "maximum",
+                                      "history_minute")
+    SELECT_ROLLUP = "select ts from history_rollup where name = ?"
+    UPSERT_ROLLUP = "insert into history_rollup(name, ts) values(?, ?) on conflict(name) do update set ts = excluded.ts"
+    PRUNE_STATEMENT = "delete from %s where ts < ?"
+    CAP_STATEMENT = "delete from history where rowid <= (select max(rowid) from history) - ?"
+    RAW_RANGE = "select ts, 1, value, value, value from history where metric = ? and ts >= ? and ts < ? order by ts"
+    ROLLUP_RANGE = "select ts, count, total, minimum, maximum from %s where metric = ? and ts >= ? and ts < ? " \
+                   "order by ts"
+    COMPACT_INTERVAL = 60
+
+    def __init__(self, storage, config):
+        """
+        initializes history tables using storage connection, history
+        is disabled when storage backend has no sql support
+        :param storage: storage, must be within its context
+        :param config: keeper configuration dict
+        """
+
+        self.logger = Logger()
+        self.storage = storage
+        self.raw_retention = config.get("history.retention.raw", 7) * DAY
+        self.minute_retention = config.get("history.retention.minute", 30) * DAY
+        self.hour_retention = config.get("history.retention.hour", 365) * DAY
+        self.max_rows = config.get("history.max.rows", 100000)
+        # events are stored by every process on its own loop, minutes
+        # are only rolled up when late events are no longer expected
+        self.rollup_delay = config.get("history.rollup.delay", 300)
+        self.pending = []
+        self.compacted_at = 0
+        self.enabled = storage.SUPPORTS_SQL
+        if not self.enabled:
+            self.logger.debug("history is not supported by storage backend")
+            return
+
+        self.logger.debug("creating history tables")
+        with storage.transaction(storage.conn) as cursor:
+            for statement in History.CREATE_STATEMENTS:
+                cursor.execute(statement)
+
+    def __enter__(self):
+        """
+        entering context
+        :return: History object
+        """
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    def __exit__(self, type, value, traceback):
+        """
+        writes pending events when exiting context
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        try:
+            self.flush()
+        except Exception as ex:
+            self.logger.error("failed to store history: %s" % ex)
+
+    def record(self, metric, value=1, ts=None):
+        """
+        records a metric event, written on next flush
+        :param metric: metric identification
+        :param value: event value, default 1
+        :param ts: event epoch seconds, default now
+        """
+
+        if self.enabled:
+            self.pending.append((metric, int(time() if ts is None else ts), value))
+
+    def sync(self):
+        """
+        called once per loop tick, writes pending events and
+        compacts history when compact interval has elapsed
+        """
+
+        self.flush()
+        if self.enabled and time() - self.compacted_at >= History.COMPACT_INTERVAL:
+            self.compact()
+
+    def flush(self):
+        """
+        writes all pending events in a single transaction
+        """
+
+        pending = self.pending
+        if not pending:
+            return
+
+        self.pending = []
+        self.logger.debug("storing %s history events", len(pending))
+        storage = self.storage
+        with storage.transaction(storage.conn) as cursor:
+            cursor.executemany(History.INSERT_STATEMENT, pending)
+
+    def compact(self, now=None):
+        """
+        rolls complete minutes and hours older than rollup delay up
+        and prunes rows outside retention bounds
+        :param now: epoch seconds, default now
+        """
+
+        now = int(time() if now is None else now)
+        self.compacted_at = time()
+        storage = self.storage
+        settled = now - self.rollup_delay
+        self.logger.debug("compacting history")
+        with storage.transaction(storage.conn) as cursor:
+            self._rollup(cursor, "minute", History.MINUTE_ROLLUP, settled // MINUTE * MINUTE)
+            self._rollup(cursor, "hour", History.HOUR_ROLLUP, settled // HOUR * HOUR)
+            cursor.execute(History.PRUNE_STATEMENT % "history", (now - self.raw_retention,))
+            cursor.execute(History.PRUNE_STATEMENT % "history_minute", (now - self.minute_retention,))
+            cursor.execute(History.PRUNE_STATEMENT % "history_hour", (now - self.hour_retention,))
+            cursor.execute(History.CAP_STATEMENT, (self.max_rows,))
+
+    def range(self, metric, start, end=None, resolution=None):
+        """
+        return metric events between two timestamps, resolution is
+        chosen from retention bounds when not given
+        :param metric: metric identification
+        :param start: start epoch seconds, inclusive
+        :param end: end epoch seconds, exclusive, default now
+        :param resolution: raw, minute or hour
+        :return: list of (ts, count, total, minimum, maximum) tuples
+        """
+
+        if not self.enabled:
+            return []
+
+        now = time()
+        if end is None:
+            end = now + 1
+
+        if resolution is None:
+            if start >= now - self.raw_retention:
+                resolution = "raw"
+            elif start >= now - self.minute_retention:
+                resolution = "minute"
+            else:
+                resolution = "hour"
+
+        statement = History.RAW_RANGE if resolution == "raw" else History.ROLLUP_RANGE % ("history_" + resolution)
+
+        return self.storage.conn.cursor().execute(statement, (metric, int(start), int(end))).fetchall()
+
+    @staticmethod
+    def _rollup(cursor, name, statement, cutoff):
+        """
+        aggregates rows between last rollup and cutoff
+        :param cursor: transaction cursor
+        :param name: rollup name
+        :param statement: rollup statement
+        :param cutoff: end of last complete bucket
+        """
+
+        result = cursor.execute(History.SELECT_ROLLUP, (name,)).fetchone()
+        start = result[0] if result else 0
+        if start >= cutoff:
+            return
+
+        cursor.execute(statement, (start, cutoff))
+        cursor.execute(History.UPSERT_ROLLUP, (name, cutoff))
+
+
+# noinspection PyUnusedLocal
+def discard(metric, value=1, ts=None):
+    """
+    records nothing, used when history is not available
+    :param metric: metric identification
+    :param value: event value
+    :param ts: event epoch seconds
+    """
+
+    pass
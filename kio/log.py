@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides log structured storage backend, every write is
+    appended to a file which is periodically compacted
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from contextlib import contextmanager
+from json import dumps, loads
+from os import makedirs, fsync, fstat, stat, replace
+from os.path import join
+from core import KEEPER_HOME, load_config
+from kio.memory import MemoryStorage
+
+try:
+    from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+except ImportError:
+    # processes are not synchronized without fcntl
+    flock = None
+
+
+class LogStorage(MemoryStorage):
+    """
+    Holds keys and values in memory, backed by an append only log
+    """
+
+    # log is compacted when it holds this many records per stored key
+    COMPACT_RATIO = 4
+
+    def __init__(self, config=None):
+        """
+        initializes storage object
+        :param config: keeper configuration dict, loaded from file when not given
+        """
+
+        if config is None:
+            config = load_config()
+
+        super(LogStorage, self).__init__(config)
+        storage_path = join(KEEPER_HOME, "storage")
+        makedirs(storage_path, exist_ok=True)
+
+        self.log_path = join(storage_path, "keeper.log")
+        self.compact_records = config.get("storage.log.compact", 1000)
+        self.log = None
+        self.lock_file = None
+        self.inode = None
+        self.offset = 0
+        self.records = 0
+        self.unsynced = False
+
+    def __enter__(self):
+        """
+        opens log when entering context
+        :return: LogStorage object
+        """
+
+        self.logger.debug("opening storage log %s", self.log_path)
+        self.lock_file = open(self.log_path + ".lock", "a")
+        with self.lock():
+            self.refresh()
+            # no write is in progress while holding lock, an incomplete
+            # record was left by a process that ended while appending it
+            if self.log.seek(0, 2) > self.offset:
+                self.logger.warning("discarding incomplete record from storage log %s" % self.log_path)
+                self.log.truncate(self.offset)
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    def __exit__(self, type, value, traceback):
+        """
+        closes log when exiting context
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        super(LogStorage, self).__exit__(type, value, traceback)
+        try:
+            self.logger.debug("closing storage log %s", self.log_path)
+            self.log.close()
+            self.lock_file.close()
+        except Exception:
+            pass
+
+        self.log = None
+        self.lock_file = None
+
+    @contextmanager
+    def lock(self, exclusive=True):
+        """
+        context holding log lock, shared between processes
+        :param exclusive: whether lock is exclusive or shared
+        """
+
+        if flock is None:
+            yield
+            return
+
+        lock_file = self.lock_file
+        flock(lock_file, LOCK_EX if exclusive else LOCK_SH)
+        try:
+            yield
+        finally:
+            flock(lock_file, LOCK_UN)
+
+    def refresh(self):
+        """
+        replays records appended by other processes, reloading
+        the whole log when it was compacted
+        """
+
+        try:
+            inode = stat(self.log_path).st_ino
+        except OSError:
+            inode = None
+
+        if self.log is None or inode != self.inode:
+            self.reopen()
+
+        log = self.log
+        log.seek(self.offset)
+        chunk = log.read()
+        # only complete records are replayed
+        end = chunk.rfind(b"\n") + 1
+        if not end:
+            return
+
+        data = self.data
+        lines = chunk[:end].splitlines()
+        for line in lines:
+            try:
+                key, value = loads(line.decode("utf-8"))
+            except ValueError:
+                self.logger.warning("skipping invalid record from storage log %s" % self.log_path)
+                continue
+
+            data[key] = value
+
+        self.offset += end
+        self.records += len(lines)
+
+    def reopen(self):
+        """
+        opens log from start
+        """
+
+        if self.log is not None:
+            self.log.close()
+
+        self.logger.debug("loading storage log %s", self.log_path)
+        self.log = open(self.log_path, "a+b")
+        self.inode = fstat(self.log.fileno()).st_ino
+        self.offset = 0
+        self.records = 0
+        self.data = {}
+
+    def store(self, values):
+        """
+        appends values to log, must be called holding exclusive lock
+        after refreshing
+        :param values: dict of keys and stored values
+        """
+
+        if not values:
+            return
+
+        chunk = "".join(dumps(item) + "\n" for item in values.items()).encode("utf-8")
+        log = self.log
+        log.write(chunk)
+        log.flush()
+        self.offset += len(chunk)
+        self.records += len(values)
+        self.data.update(values)
+        self.unsynced = True
+
+    def sync(self):
+        """
+        called once per loop tick, syncs log to disk and
+        compacts it when most records are outdated
+        """
+
+        self.flush()
+        if self.records > self.compact_records and self.records > LogStorage.COMPACT_RATIO * len(self.data):
+            self.compact()
+
+    def flush(self):
+        """
+        syncs appended records to disk
+        """
+
+        if self.unsynced:
+            self.unsynced = False
+            fsync(self.log.fileno())
+
+    def compact(self):
+        """
+        rewrites log with a single record per key
+        """
+
+        with self.lock():
+            self.refresh()
+            self.logger.debug("compacting storage log %s with %s records", self.log_path, self.records)
+            compact_path = self.log_path + ".compact"
+            with open(compact_path, "wb") as compact:
+                compact.write("".join(dumps(item) + "\n" for item in self.data.items()).encode("utf-8"))
+                compact.flush()
+                fsync(compact.fileno())
+
+            replace(compact_path, self.log_path)
+            data = self.data
+            self.reopen()
+            self.data = data
+            self.offset = self.log.seek(0, 2)
+            self.records = len(data)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides in memory storage backend, values are lost when
+    process ends. Intended for tests and ephemeral containers
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from contextlib import contextmanager
+from kio.base import BaseStorage, Snapshot, encode, to_number
+
+
+class MemoryStorage(BaseStorage):
+    """
+    Holds keys and values in a dict
+    """
+
+    # noinspection PyUnusedLocal
+    def __init__(self, config=None):
+        """
+        initializes storage object
+        :param config: keeper configuration dict
+        """
+
+        super(MemoryStorage, self).__init__()
+        self.data = {}
+
+    def put_many(self, values):
+        """
+        inserts/updates several keys
+        :param values: dict of keys and values
+        :return: initial values
+        """
+
+        binds = encode(values)
+        self.logger.debug("storing values for keys %s", ", ".join(binds))
+        with self.lock():
+            self.refresh()
+            self.store(binds)
+
+        return values
+
+    def inc(self, key, value=0, inc_value=1):
+        """
+        atomically increments the stored value for a given key
+        :param key: Key
+        :param value: initial value used when key is not stored yet
+        :param inc_value: units to increment, default 1
+        :return: returns value already incremented
+        """
+
+        self.logger.debug("incrementing key %s by %s", key, inc_value)
+        with self.lock():
+            self.refresh()
+            result = self.data.get(key)
+            result = (to_number(result) if result else value) + inc_value
+            self.store({key: str(result)})
+
+        return result
+
+    def inc_many(self, values):
+        """
+        atomically increments several keys
+        :param values: dict of keys and units to increment
+        :return: dict of keys and values already incremented
+        """
+
+        self.logger.debug("incrementing keys %s", ", ".join(values))
+        with self.lock():
+            self.refresh()
+            data = self.data
+            result = {key: (to_number(data[key]) if data.get(key) else 0) + inc_value for key, inc_value in
+                      values.items()}
+            self.store(encode(result))
+
+        return result
+
+    def get_many(self, keys):
+        """
+        return values for several keys
+        :param keys: keys
+        :return: dict of keys and values, None for keys not stored
+        """
+
+        with self.lock(False):
+            self.refresh()
+
+        data = self.data
+
+        return {key: data.get(key) for key in keys}
+
+    def snapshot(self):
+        """
+        loads all stored keys
+        :return: snapshot with all keys and values
+        """
+
+        with self.lock(False):
+            self.refresh()
+
+        return Snapshot(self.data)
+
+    # noinspection PyUnusedLocal
+    @contextmanager
+    def lock(self, exclusive=True):
+        """
+        context holding storage lock, memory storage
+        is only accessed by its owner
+        :param exclusive: whether lock is exclusive or shared
+        """
+
+        yield
+
+    def refresh(self):
+        """
+        loads changes made by other storage objects
+        """
+
+        pass
+
+    def store(self, values):
+        """
+        stores values, must be called holding exclusive lock
+        :param values: dict of keys and stored values
+        """
+
+        self.data.update(values)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides a spool file holding states not yet delivered to
+    broker, so they survive a process restart
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from json import dumps, loads
+from os import makedirs, fsync, replace, remove
+from os.path import join
+from core import KEEPER_HOME, Logger
+
+
+class Spool(object):
+    """
+    Spool file of a process. The whole list is rewritten on save
+    so file always holds a consistent list
+    """
+
+    def __init__(self, name, path=None):
+        """
+        initializes spool
+        :param name: process name
+        :param path: spool file, by default within storage directory
+        """
+
+        self.logger = Logger()
+        if path is None:
+            storage_path = join(KEEPER_HOME, "storage")
+            makedirs(storage_path, exist_ok=True)
+
+            path = join(storage_path, "%s.spool" % name)
+
+        self.path = path
+        # last saved entries, unchanged entries are not written again
+        self.saved = []
+
+    def load(self):
+        """
+        reads spooled entries
+        :return: list of entries
+        """
+
+        try:
+            with open(self.path, "rb") as spool:
+                entries = [tuple(entry) for entry in loads(spool.read().decode("utf-8"))]
+        except FileNotFoundError:
+            entries = []
+        except ValueError as ex:
+            self.logger.warning("discarding invalid spool %s: %s" % (self.path, ex))
+            entries = []
+
+        self.saved = entries
+
+        return entries
+
+    def save(self, entries):
+        """
+        replaces spooled entries, spool file is removed when
+        there are no entries
+        :param entries: list of entries
+        """
+
+        entries = [tuple(entry) for entry in entries]
+        if entries == self.saved:
+            return
+
+        if not entries:
+            try:
+                remove(self.path)
+            except FileNotFoundError:
+                pass
+
+            self.saved = entries
+            return
+
+        self.logger.debug("spooling %s entries to %s", len(entries), self.path)
+        spool_path = self.path + ".tmp"
+        with open(spool_path, "wb") as spool:
+            spool.write(dumps(entries).encode("utf-8"))
+            spool.flush()
+            fsync(spool.fileno())
+
+        replace(spool_path, self.path)
+        self.saved = entries
@@ -1,54 +1,122 @@
 # -*- coding: utf-8 -*-
 """
-    Provides base access to backend storage
+    Provides sqlite storage backend
     :copyright: © 2018 by Nuno Gonçalves
     :license: MIT, see LICENSE for more details.
 """
 
-from sqlite3 import connect
+from sqlite3 import connect, sqlite_version_info
 from contextlib import contextmanager
-from multiprocessing import Manager
 from os import makedirs
-from os.path import join, exists
-from core import KEEPER_HOME, Logger
+from os.path import join
+from time import time
+from core import KEEPER_HOME, Logger, load_config
+from kio.base import BaseStorage, Snapshot, encode, to_number
 
-# this should be instantiate by keeper manager
-# and used by runtime managers
-lock = Manager().Lock()
 
-
-class Storage(object):
+class Storage(BaseStorage):
     """
-    Holds connection and basic methods for accessing storage
+    Holds connection and basic methods for accessing sqlite storage
     """
 
     # base statements
-    INSERT_STATEMENT = "insert or ignore into keystore(value, key) values(?, ?)"
-    UPDATE_STATEMENT = "update keystore set value = ? where changes() = 0 and key = ?"
+    UPSERT_STATEMENT = "insert into keystore(key, value) values(?, ?) " \
+                       "on conflict(key) do update set value = excluded.value"
+    INC_STATEMENT = "insert into keystore(key, value) values(?, ?) " \
+                    "on conflict(key) do update set value = value + ?"
     SELECT_STATEMENT = "select value from keystore where key = ?"
+    # multi key statements, values placeholders are filled per call
+    UPSERT_MANY_STATEMENT = "insert into keystore(key, value) values %s " \
+                            "on conflict(key) do update set value = excluded.value"
+    INC_MANY_STATEMENT = "insert into keystore(key, value) values %s " \
+                         "on conflict(key) do update set value = value + excluded.value"
+    # returns incremented values without reading them back, sqlite 3.35 or newer
+    RETURNING_VALUE = " returning value"
+    RETURNING_KEY_VALUE = " returning key, value"
+    SELECT_MANY_STATEMENT = "select key, value from keystore where key in (%s)"
     GET_ALL = "select key, value from keystore"
     GET_KEYS = "select key from keystore"
-    NUMBER_TYPE = (int, float)
+    SUPPORTS_SQL = True
+    # durability profiles, pragmas applied to every connection and number of
+    # idle seconds after writing before running a wal checkpoint. wal is
+    # still checkpointed once it holds wal_autocheckpoint pages, bounding
+    # its size when storage is never idle
+    PROFILES = {
+        "safe": {
+            "pragmas": (("synchronous", "full"),),
+            "checkpoint.idle": None
+        },
+        "balanced": {
+            "pragmas": (("synchronous", "normal"), ("cache_size", -1024)),
+            "checkpoint.idle": 30
+        },
+        "fast": {
+            "pragmas": (("synchronous", "normal"), ("wal_autocheckpoint", 10000), ("cache_size", -2048),
+                        ("mmap_size", 4194304), ("temp_store", "memory")),
+            "checkpoint.idle": 300
+        }
+    }
 
-    def __init__(self):
+    def __init__(self, config=None):
         """
         initializes storage object
+        :param config: keeper configuration dict, loaded from file when not given
         """
 
-        self.logger = Logger()
+        if config is None:
+            config = load_config()
+
+        super(Storage, self).__init__()
         # creates storage directory if not present
         storage_path = join(KEEPER_HOME, "storage")
-        if not exists(storage_path):
-            self.logger.debug("creating directory %s for storage", storage_path)
-            makedirs(storage_path)
+        # processes may start together, directory may be created by any of them
+        makedirs(storage_path, exist_ok=True)
+        # concurrent access between processes relies on sqlite wal and busy timeout
+        self.busy_timeout = config.get("storage.busy.timeout", 5000)
+        profile = config.get("storage.profile", "safe")
+        if profile not in Storage.PROFILES:
+            self.logger.warning("unknown storage profile %s, using safe profile" % profile)
+            profile = "safe"
+
+        self.profile = Storage.PROFILES[profile]
+        # older sqlite versions read incremented values back in the same transaction
+        self.returning = sqlite_version_info >= (3, 35)
+        if not self.returning:
+            self.logger.debug("sqlite %s does not support returning clause", ".".join(map(str, sqlite_version_info)))
+
+        self.written_at = 0
+        self.checkpointed_at = 0
+        # transactions rolled back because of errors
+        self.rollbacks = 0
         # create database and kv table
         storage_path = join(storage_path, "keeper.db")
+        self.storage_path = storage_path
         self.logger.debug("creating initial key value in %s storage", storage_path)
-        with lock, self.transaction(connect(storage_path)) as cursor:
-            cursor.execute("create table if not exists keystore(key text primary key, value text)")
+        conn = self.connect()
+        try:
+            with self.transaction(conn) as cursor:
+                cursor.execute("create table if not exists keystore(key text primary key, value text)")
+        finally:
+            conn.close()
 
-        self.storage_path = storage_path
         self.conn = None
+        # write behind keeps pending writes in memory until next flush
+        self.write_behind = bool(config.get("storage.write.behind", False))
+        self.flush_interval = config.get("storage.flush.interval", 0)
+        self.pending = {}
+        # pending increments of keys, initial value and units added on next flush
+        self.increments = {}
+        self.flushed_at = time()
+        # read through cache of raw and decoded values, invalidated
+        # when another connection changes the database
+        if config.get("storage.cache", False):
+            self.cache = {}
+            self.decoded = {}
+        else:
+            self.cache = None
+            self.decoded = None
+
+        self.data_version = None
 
     def __enter__(self):
         """
@@ -57,9 +125,9 @@ class Storage(object):
         """
 
         self.logger.debug("creating storage connection for %s", self.storage_path)
-        conn = connect(self.storage_path)
-        conn.execute("pragma journal_mode=wal")
-        self.conn = conn
+        self.conn = self.connect()
+        if self.cache is not None:
+            self.data_version = self.conn.execute("pragma data_version").fetchone()[0]
 
         return self
 
@@ -73,6 +141,10 @@ class Storage(object):
         """
 
         try:
+            self.flush()
+            if self.profile["checkpoint.idle"] is not None:
+                self.checkpoint()
+
             self.logger.debug("closing storage connection of %s", self.storage_path)
             self.conn.close()
         except Exception:
@@ -92,32 +164,93 @@ class Storage(object):
         # converts numeric type into string
         if isinstance(value, Storage.NUMBER_TYPE):
             value = str(value)
-        # upsert statement
-        binds = (value, key)
-        self.logger.debug("storing value %s for key %s", value, key)
-        with lock, self.transaction(self.conn) as cursor:
-            cursor.execute(Storage.INSERT_STATEMENT, binds)
-            cursor.execute(Storage.UPDATE_STATEMENT, binds)
+        self._write(key, value)
 
         return initial_value
 
-    def inc(self, key, value, inc_value=1):
+    def put_many(self, values):
+        """
+        inserts/updates several keys in a single statement
+        :param values: dict of keys and values
+        :return: initial values
+        """
+
+        binds = encode(values)
+        if not binds:
+            return values
+
+        self._forget(binds)
+        if self.write_behind:
+            self.logger.debug("deferring values for keys %s", ", ".join(binds))
+            self.pending.update(binds)
+            for key in binds:
+                self.increments.pop(key, None)
+
+            return values
+
+        self.logger.debug("storing values for keys %s", ", ".join(binds))
+        with self.transaction(self.conn) as cursor:
+            cursor.execute(Storage.UPSERT_MANY_STATEMENT % placeholders(len(binds)), flatten(binds))
+
+        return values
+
+    def inc(self, key, value=0, inc_value=1):
         """
-        increments a value for a given key
+        atomically increments the stored value for a given key.
+        When write behind is enabled the increment is applied on next
+        flush and value returned is only known to this process
         :param key: Key
-        :param value: Value
+        :param value: initial value used when key is not stored yet
         :param inc_value: units to increment, default 1
-        :return: returns value already incremented
+        :return: returns value already incremented, None when increment failed
         """
 
-        value += inc_value
-        binds = (value, key)
         self.logger.debug("incrementing key %s by %s", key, inc_value)
-        with lock, self.transaction(self.conn) as cursor:
-            cursor.execute(Storage.INSERT_STATEMENT, binds)
-            cursor.execute(Storage.UPDATE_STATEMENT, binds)
+        if self.write_behind:
+            return self._defer_inc(key, value, inc_value)
+
+        result = None
+        self._forget((key,))
+        with self.transaction(self.conn) as cursor:
+            result = self._increment(cursor, key, value, inc_value)
+
+        if result is None:
+            return None
+
+        if self.cache is not None:
+            self.cache[key] = result
+
+        return to_number(result)
+
+    def inc_many(self, values):
+        """
+        atomically increments several keys in a single statement
+        :param values: dict of keys and units to increment
+        :return: dict of keys and values already incremented, empty when increment failed
+        """
+
+        if not values:
+            return {}
+
+        self.logger.debug("incrementing keys %s", ", ".join(values))
+        if self.write_behind:
+            return {key: self._defer_inc(key, 0, inc_value) for key, inc_value in values.items()}
+
+        rows = []
+        self._forget(values)
+        with self.transaction(self.conn) as cursor:
+            statement = Storage.INC_MANY_STATEMENT % placeholders(len(values))
+            if self.returning:
+                rows = cursor.execute(statement + Storage.RETURNING_KEY_VALUE, flatten(values)).fetchall()
+            else:
+                cursor.execute(statement, flatten(values))
+                rows = cursor.execute(Storage.SELECT_MANY_STATEMENT % ", ".join("?" * len(values)),
+                                      list(values)).fetchall()
+
+        if self.cache is not None:
+            self.cache.update(rows)
 
-        return value
+        return {key: to_number(value) for key, value in rows}
 
     def get(self, key):
         """
@@ -126,11 +259,62 @@ class Storage(object):
         :return: key value
         """
 
+        # pending writes are the most recent values
+        if key in self.pending:
+            return self.pending[key]
+
+        cache = self.cache
+        if cache is not None and key in cache:
+            return cache[key]
+
         result = self.conn.cursor().execute(Storage.SELECT_STATEMENT, (key,)).fetchone()
         result = result[0] if result else None
+        if cache is not None:
+            cache[key] = result
+
+        return result
+
+    def get_many(self, keys):
+        """
+        return values for several keys in a single statement
+        :param keys: keys
+        :return: dict of keys and values, None for keys not stored
+        """
+
+        keys = list(keys)
+        result = dict.fromkeys(keys)
+        # pending writes are the most recent values
+        pending = self.pending
+        cache = self.cache if self.cache is not None else {}
+        missing = [key for key in keys if key not in pending and key not in cache]
+        if missing:
+            statement = Storage.SELECT_MANY_STATEMENT % ", ".join("?" * len(missing))
+            rows = dict.fromkeys(missing)
+            rows.update(self.conn.cursor().execute(statement, missing).fetchall())
+            result.update(rows)
+            if self.cache is not None:
+                self.cache.update(rows)
+
+        result.update((key, cache[key]) for key in keys if key in cache)
+        result.update((key, pending[key]) for key in keys if key in pending)
 
         return result
 
+    def snapshot(self):
+        """
+        loads all stored keys with a single query
+        :return: snapshot with all keys and values
+        """
+
+        self.logger.debug("loading storage snapshot")
+        snapshot = Snapshot(self.conn.cursor().execute(Storage.GET_ALL).fetchall())
+        if self.cache is not None:
+            self.cache.update(snapshot)
+
+        snapshot.update(self.pending)
+
+        return snapshot
+
     def get_int(self, key):
         """
         return the key value as int value
@@ -138,9 +322,7 @@ class Storage(object):
         :return: key value
         """
 
-        result = self.get(key)
-
-        return int(result) if result else 0
+        return self._decode(key, int)
 
     def get_float(self, key):
         """
@@ -149,9 +331,188 @@ class Storage(object):
         :return: key value
         """
 
+        return self._decode(key, float)
+
+    def sync(self):
+        """
+        called once per loop tick, flushes pending writes
+        when flush interval has elapsed and validates cache
+        """
+
+        if self.pending and time() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+        if self.cache is not None:
+            self.validate()
+
+        # checkpoints wal when storage is quiet
+        idle = self.profile["checkpoint.idle"]
+        if idle is not None and self.written_at > self.checkpointed_at and time() - self.written_at >= idle:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        moves wal content into database without blocking other connections
+        """
+
+        self.logger.debug("checkpointing storage wal")
+        self.checkpointed_at = time()
+        self.conn.execute("pragma wal_checkpoint(passive)")
+
+    def validate(self):
+        """
+        clears cache when database was changed by another connection
+        """
+
+        data_version = self.conn.execute("pragma data_version").fetchone()[0]
+        if data_version != self.data_version:
+            self.logger.debug("storage changed by another connection, clearing cache")
+            self.data_version = data_version
+            self.cache.clear()
+            self.decoded.clear()
+
+    def flush(self):
+        """
+        writes all pending writes in a single transaction, pending
+        writes are kept for next flush when transaction fails
+        """
+
+        self.flushed_at = time()
+        pending = self.pending
+        if not pending:
+            return
+
+        increments = self.increments
+        self.pending = {}
+        self.increments = {}
+        rollbacks = self.rollbacks
+        self.logger.debug("flushing %s pending writes", len(pending))
+        with self.transaction(self.conn) as cursor:
+            cursor.executemany(Storage.UPSERT_STATEMENT,
+                               [item for item in pending.items() if item[0] not in increments])
+            # increments are added to stored values, other processes may have changed them
+            for key, (value, inc_value) in increments.items():
+                self._increment(cursor, key, value, inc_value)
+
+        if self.rollbacks != rollbacks:
+            self.logger.warning("unable to flush %s pending writes, retrying on next flush" % len(pending))
+            pending.update(self.pending)
+            increments.update(self.increments)
+            self.pending = pending
+            self.increments = increments
+
+    def _write(self, key, value):
+        """
+        stores a value, either immediately or on next flush
+        when write behind is enabled
+        :param key: Key
+        :param value: Value
+        """
+
+        self._forget((key,))
+        if self.write_behind:
+            self.logger.debug("deferring value %s for key %s", value, key)
+            self.pending[key] = value
+            self.increments.pop(key, None)
+            return
+
+        self.logger.debug("storing value %s for key %s", value, key)
+        with self.transaction(self.conn) as cursor:
+            cursor.execute(Storage.UPSERT_STATEMENT, (key, value))
+
+    def _increment(self, cursor, key, value, inc_value):
+        """
+        increments a stored value within a transaction
+        :param cursor: transaction cursor
+        :param key: Key
+        :param value: initial value used when key is not stored yet
+        :param inc_value: units to increment
+        :return: stored value already incremented
+        """
+
+        binds = (key, str(value + inc_value), inc_value)
+        if self.returning:
+            return cursor.execute(Storage.INC_STATEMENT + Storage.RETURNING_VALUE, binds).fetchone()[0]
+
+        cursor.execute(Storage.INC_STATEMENT, binds)
+
+        return cursor.execute(Storage.SELECT_STATEMENT, (key,)).fetchone()[0]
+
+    def _defer_inc(self, key, value, inc_value):
+        """
+        increments a value on next flush, a value written since last
+        flush is incremented instead
+        :param key: Key
+        :param value: initial value used when key is not stored yet
+        :param inc_value: units to increment
+        :return: value already incremented, as known by this process
+        """
+
         result = self.get(key)
+        if key not in self.pending or key in self.increments:
+            initial, units = self.increments.get(key, (value, 0))
+            self.increments[key] = (initial, units + inc_value)
+
+        result = (to_number(result) if result else value) + inc_value
+        self._forget((key,))
+        self.pending[key] = str(result)
+
+        return result
 
-        return float(result) if result else 0
+    def _decode(self, key, kind):
+        """
+        return the key value decoded to a given type, cached
+        when cache is enabled
+        :param key: key
+        :param kind: int or float
+        :return: key value
+        """
+
+        decoded = self.decoded
+        if decoded is not None and key not in self.pending:
+            result = decoded.get((key, kind))
+            if result is None:
+                result = self.get(key)
+                result = kind(result) if result else 0
+                decoded[(key, kind)] = result
+
+            return result
+
+        result = self.get(key)
+
+        return kind(result) if result else 0
+
+    def _forget(self, keys):
+        """
+        removes keys from cache before writing them
+        :param keys: keys
+        """
+
+        if self.cache is None:
+            return
+
+        cache = self.cache
+        decoded = self.decoded
+        for key in keys:
+            cache.pop(key, None)
+            decoded.pop((key, int), None)
+            decoded.pop((key, float), None)
+
+    def connect(self):
+        """
+        opens a new connection in wal mode, waiting up to busy timeout
+        when other processes are holding the database lock
+        :return: connection
+        """
+
+        # timeout sets sqlite busy timeout and transactions
+        # are explicitly handled by transaction context
+        conn = connect(self.storage_path, timeout=self.busy_timeout / 1000.0, isolation_level=None)
+        conn.execute("pragma journal_mode=wal")
+        for pragma in self.profile["pragmas"]:
+            conn.execute("pragma %s=%s" % pragma)
+
+        return conn
 
     @contextmanager
     def transaction(self, conn):
@@ -161,13 +522,50 @@ class Storage(object):
         """
 
         self.logger.debug("beginning transaction")
-        conn.execute("begin")
         try:
+            try:
+                # takes write lock upfront so concurrent writers wait on busy
+                # timeout instead of failing on lock upgrade
+                conn.execute("begin immediate")
+            except Exception as ex:
+                # lock is still held by another process, statements wait for
+                # it once more and transaction is rolled back when they fail
+                self.logger.warning("unable to lock storage: %s" % ex)
+                conn.execute("begin")
+
             yield conn.cursor()
+            conn.commit()
         except Exception as ex:
             self.logger.debug("transaction rolled back")
             Logger().error("unable to complete transaction: %s" % ex)
-            conn.rollback()
+            self.rollbacks += 1
+            if conn.in_transaction:
+                conn.rollback()
         else:
             self.logger.debug("transaction committed")
-            conn.commit()
+            self.written_at = time()
+
+
+def placeholders(count):
+    """
+    builds values placeholders for multi row statements
+    :param count: number of rows
+    :return: placeholders
+    """
+
+    return ", ".join(("(?, ?)",) * count)
+
+
+def flatten(values):
+    """
+    flattens a dict into a list of binds
+    :param values: dict of keys and values
+    :return: binds
+    """
+
+    binds = []
+    for item in values.items():
+        binds.extend(item)
+
+    return binds
+
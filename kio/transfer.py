@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides streaming export and import of stored keys and
+    history as json lines, read in chunks so memory is bounded
+    and storage is never locked for the whole operation
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from gzip import open as gzip_open
+from json import dumps, loads
+from core import Logger
+
+FORMAT = "keeper-export"
+VERSION = 1
+# exported tables: name, columns and primary key used to read chunks
+TABLES = (
+    ("keystore", ("key", "value"), ("key",)),
+    ("history", ("metric", "ts", "value"), ("rowid",)),
+    ("history_minute", ("metric", "ts", "count", "total", "minimum", "maximum"), ("metric", "ts")),
+    ("history_hour", ("metric", "ts", "count", "total", "minimum", "maximum"), ("metric", "ts")),
+    ("history_rollup", ("name", "ts"), ("name",))
+)
+COLUMNS = {table: columns for table, columns, key in TABLES}
+FIRST_CHUNK = "select %s from %s order by %s limit ?"
+NEXT_CHUNK = "select %s from %s where (%s) > (%s) order by %s limit ?"
+TABLE_EXISTS = "select 1 from sqlite_master where type = 'table' and name = ?"
+# events already stored are skipped, importing the same export twice keeps a single copy
+INSERT_STATEMENT = "insert into history(metric, ts, value) select ?1, ?2, ?3 where not exists " \
+                   "(select 1 from history where metric = ?1 and ts = ?2 and value = ?3)"
+REPLACE_STATEMENT = "insert or replace into %s(%s) values(%s)"
+CHUNK_SIZE = 1000
+
+
+def open_stream(path, mode):
+    """
+    opens an export file, gzip compressed when path ends with .gz
+    :param path: file path
+    :param mode: r or w
+    :return: text stream
+    """
+
+    if path.endswith(".gz"):
+        return gzip_open(path, mode + "t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+def export_storage(storage, stream, chunk_size=CHUNK_SIZE):
+    """
+    writes stored keys and history tables to a stream. each chunk
+    is read in its own short read transaction
+    :param storage: storage, must be within its context
+    :param stream: text stream
+    :param chunk_size: rows read per query
+    :return: dict of tables and exported rows
+    """
+
+    logger = Logger()
+    write = stream.write
+    write(dumps({"format": FORMAT, "version": VERSION}) + "\n")
+    result = {}
+    if not storage.SUPPORTS_SQL:
+        storage.flush()
+        write(dumps({"table": "keystore", "columns": ["key", "value"]}) + "\n")
+        rows = storage.snapshot().items()
+        for row in rows:
+            write(dumps(row, separators=(",", ":")) + "\n")
+
+        result["keystore"] = len(rows)
+        return result
+
+    # pending writes are part of the export
+    storage.flush()
+    cursor = storage.conn.cursor()
+    for table, columns, key in TABLES:
+        if not cursor.execute(TABLE_EXISTS, (table,)).fetchone():
+            continue
+
+        logger.debug("exporting table %s", table)
+        write(dumps({"table": table, "columns": columns}) + "\n")
+        selected = ", ".join(key + columns)
+        order = ", ".join(key)
+        next_chunk = NEXT_CHUNK % (selected, table, order, ", ".join("?" * len(key)), order)
+        rows = cursor.execute(FIRST_CHUNK % (selected, table, order), (chunk_size,)).fetchall()
+        count = 0
+        while rows:
+            for row in rows:
+                write(dumps(row[len(key):], separators=(",", ":")) + "\n")
+
+            count += len(rows)
+            rows = cursor.execute(next_chunk, rows[-1][:len(key)] + (chunk_size,)).fetchall()
+
+        result[table] = count
+
+    return result
+
+
+def import_storage(storage, stream, chunk_size=CHUNK_SIZE):
+    """
+    reads stored keys and history tables from a stream, writing
+    each chunk in its own transaction. history is skipped when
+    storage has no sql support
+    :param storage: storage, must be within its context
+    :param stream: text stream
+    :param chunk_size: rows written per transaction
+    :return: dict of tables and imported rows
+    """
+
+    logger = Logger()
+    header = loads(stream.readline() or "{}")
+    if header.get("format") != FORMAT or header.get("version", VERSION + 1) > VERSION:
+        raise ValueError("unsupported export format %s" % header)
+
+    result = {}
+    table = None
+    chunk = []
+    for line in stream:
+        record = loads(line)
+        if isinstance(record, list):
+            if table is None:
+                continue
+
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                _write_chunk(storage, table, chunk)
+                result[table] += len(chunk)
+                chunk = []
+
+            continue
+
+        if table is not None:
+            _write_chunk(storage, table, chunk)
+            result[table] += len(chunk)
+            chunk = []
+
+        table = record.get("table")
+        if COLUMNS.get(table) != tuple(record.get("columns", ())) or (
+                table != "keystore" and not storage.SUPPORTS_SQL):
+            logger.warning("skipping table %s" % table)
+            table = None
+            continue
+
+        logger.debug("importing table %s", table)
+        result[table] = 0
+
+    if table is not None:
+        _write_chunk(storage, table, chunk)
+        result[table] += len(chunk)
+
+    return result
+
+
+def _write_chunk(storage, table, rows):
+    """
+    writes rows of a table in a single transaction
+    :param storage: storage
+    :param table: table name
+    :param rows: list of rows
+    """
+
+    if not rows:
+        return
+
+    if table == "keystore":
+        storage.put_many(dict(rows))
+        storage.flush()
+        return
+
+    if table == "history":
+        statement = INSERT_STATEMENT
+    else:
+        columns = COLUMNS[table]
+        statement = REPLACE_STATEMENT % (table, ", ".join(columns), ", ".join("?" * len(columns)))
+
+    conn = storage.conn
+    conn.execute("begin immediate")
+    try:
+        conn.executemany(statement, rows)
+    except Exception:
+        conn.rollback()
+        raise
+
+    conn.commit()
@@ -6,3 +6,8 @@
 """
 
 from .mqtt import MqttClient
+from .async_mqtt import AsyncMqttClient
+from .multiplexer import Multiplexer, Channel
+from .outbox import Outbox
+from .publisher import Publisher
+from .discovery import Discovery
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides asyncio access to mqtt, paho socket is driven by
+    the event loop readers and writers
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from asyncio import get_event_loop, Event, Queue, sleep, wait_for, TimeoutError as WaitTimeout
+from paho.mqtt.client import Client, MQTT_ERR_SUCCESS, error_string
+from core import Logger, STATE_TOPIC, CONFIG_TOPIC, AVAILABILITY_TOPIC, AVAILABILITY_ONLINE, AVAILABILITY_OFFLINE
+from network.discovery import config_payload
+
+
+class AsyncMqttClient(object):
+    """
+    Holds connection and awaitable methods for accessing mqtt
+    """
+
+    KEEPALIVE = 30
+
+    def __init__(self, client_id, config):
+        """
+        initialize mqtt client, event loop is bound on connect
+        :param client_id: client id
+        :param config: keeper configuration
+        """
+
+        self.logger = Logger()
+        user = config.get("mqtt.user")
+        pwd = config.get("mqtt.pass")
+        client = Client(client_id=client_id)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        client.on_publish = self._on_acknowledge
+        client.on_subscribe = self._on_subscribe
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.enable_logger(self.logger)
+        if user and pwd:
+            client.username_pw_set(user, pwd)
+
+        # broker marks sensors unavailable when connection drops
+        self.availability_topic = None
+        if config.get("mqtt.availability", True):
+            self.availability_topic = AVAILABILITY_TOPIC % client_id
+            client.will_set(self.availability_topic, AVAILABILITY_OFFLINE, 1, True)
+
+        client.connect_async(config["mqtt.broker"], config["mqtt.port"], AsyncMqttClient.KEEPALIVE)
+        self.client = client
+        self.loop = None
+        self.connected = None
+        self.rc = None
+        self.messages = None
+        self.misc = None
+        # futures waiting for broker acknowledge, by message id
+        self.acknowledges = {}
+
+    async def __aenter__(self):
+        """
+        entering context
+        :return: AsyncMqttClient object
+        """
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    async def __aexit__(self, type, value, traceback):
+        """
+        disconnects client and closes its socket when exiting context
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        try:
+            # clean disconnects do not trigger last will
+            if self.availability_topic and self.is_connected():
+                self.client.publish(self.availability_topic, AVAILABILITY_OFFLINE, 1, True)
+
+            self.logger.debug("disconnecting mqtt client")
+            self.client.disconnect()
+        except Exception:
+            pass
+
+        if self.loop is None:
+            return
+
+        self.misc.cancel()
+        sock = self.client.socket()
+        if sock is not None:
+            self.loop.remove_reader(sock.fileno())
+            self.loop.remove_writer(sock.fileno())
+            # socket is left open when disconnect could not be written
+            sock.close()
+
+        for future in self.acknowledges.values():
+            future.cancel()
+
+        self.acknowledges = {}
+
+    def _bind(self):
+        """
+        binds client to running event loop
+        """
+
+        if self.loop is not None:
+            return
+
+        self.loop = get_event_loop()
+        self.connected = Event()
+        self.messages = Queue()
+        self.misc = self.loop.create_task(self._loop_misc())
+
+    # noinspection PyProtectedMember
+    async def connect(self, timeout=None):
+        """
+        connects to broker, socket is opened in an executor so
+        event loop is never blocked
+        :param timeout: seconds to wait for broker acknowledge, default forever
+        :raise: ConnectionError when broker refuses the connection, asyncio
+        TimeoutError when it does not answer in time
+        """
+
+        self._bind()
+        client = self.client
+        self.logger.info("connecting to %s:%s" % (client._host, client._port))
+        self.connected.clear()
+        await self.loop.run_in_executor(None, client.reconnect)
+        await wait_for(self.connected.wait(), timeout)
+        if self.rc:
+            raise ConnectionError("connection refused with code %s" % self.rc)
+
+    def is_connected(self):
+        """
+        return whether client is connected
+        :return: True when connected
+        """
+
+        return bool(self.connected and self.connected.is_set() and not self.rc)
+
+    async def register(self, metric, icon, payload=None):
+        """
+        register a new metric using mqtt discovery
+        :param metric: metric identification
+        :param icon: metric icon
+        :param payload: discovery config, by default state is read from metric topic
+        """
+
+        self.logger.debug("registering metrics %s", metric)
+        await self._publish(CONFIG_TOPIC % metric,
+                            payload or config_payload(metric, icon, availability_topic=self.availability_topic))
+
+    async def publish_state(self, metric, state):
+        """
+        publish state to mqtt
+        :param metric: metric identification
+        :param state: state value
+        """
+
+        self.logger.debug("updating metric %s with state %s", metric, state)
+        await self._publish(STATE_TOPIC % metric, state)
+
+    async def subscribe(self, topic):
+        """
+        subscribes a topic, received messages are available
+        through async iteration
+        :param topic: topic
+        """
+
+        self.logger.debug("subscribing topic %s", topic)
+        rc, mid = self.client.subscribe(topic)
+        await self._acknowledge(rc, mid)
+
+    def __aiter__(self):
+        """
+        iterates received messages
+        :return: AsyncMqttClient object
+        """
+
+        return self
+
+    async def __anext__(self):
+        """
+        waits for next received message
+        :return: message
+        """
+
+        return await self.messages.get()
+
+    async def next_message(self, timeout=None):
+        """
+        waits for next received message
+        :param timeout: seconds to wait, default forever
+        :return: message or None when timeout elapses
+        """
+
+        try:
+            return await wait_for(self.messages.get(), timeout)
+        except WaitTimeout:
+            return None
+
+    async def _publish(self, topic, payload):
+        """
+        publishes a retained message, waiting for broker acknowledge
+        :param topic: topic
+        :param payload: payload
+        """
+
+        info = self.client.publish(topic, payload, 1, True)
+        await self._acknowledge(info.rc, info.mid)
+
+    async def _acknowledge(self, rc, mid):
+        """
+        waits for broker acknowledge of a message
+        :param rc: paho result code
+        :param mid: message id
+        """
+
+        if rc != MQTT_ERR_SUCCESS:
+            raise ConnectionError(error_string(rc))
+
+        future = self.acknowledges.get(mid)
+        if future is None:
+            future = self.acknowledges[mid] = self.loop.create_future()
+
+        try:
+            await future
+        finally:
+            self.acknowledges.pop(mid, None)
+
+    async def _loop_misc(self):
+        """
+        keeps connection alive and retries unacknowledged messages
+        """
+
+        loop_misc = self.client.loop_misc
+        while 1:
+            loop_misc()
+            await sleep(1)
+
+    # noinspection PyUnusedLocal
+    def _on_connect(self, client, userdata, flags, rc):
+        """
+        wakes up connect
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param flags: flags
+        :param rc: rc code
+        """
+
+        self.logger.info("connected to %s:%s" % (client._host, client._port))
+        self.rc = rc
+        if not rc and self.availability_topic:
+            client.publish(self.availability_topic, AVAILABILITY_ONLINE, 1, True)
+
+        self.connected.set()
+
+    # noinspection PyUnusedLocal
+    def _on_disconnect(self, client, userdata, rc):
+        """
+        clears connected state
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param rc: rc code
+        """
+
+        self.logger.info("disconnected from %s:%s" % (client._host, client._port))
+        self.connected.clear()
+
+    # noinspection PyUnusedLocal
+    def _on_message(self, client, userdata, message):
+        """
+        queues received message
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param message: message received
+        """
+
+        self.messages.put_nowait(message)
+
+    # noinspection PyUnusedLocal
+    def _on_acknowledge(self, client, userdata, mid):
+        """
+        resolves future waiting for a message acknowledge
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param mid: message id
+        """
+
+        future = self.acknowledges.get(mid)
+        if future is None:
+            future = self.acknowledges[mid] = self.loop.create_future()
+
+        if not future.done():
+            future.set_result(mid)
+
+    # noinspection PyUnusedLocal
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        """
+        resolves future waiting for a subscription acknowledge
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param mid: message id
+        :param granted_qos: granted qos
+        """
+
+        self._on_acknowledge(client, userdata, mid)
+
+    # socket callbacks may run in connect executor, event loop
+    # readers and writers are always changed in loop thread
+
+    # noinspection PyUnusedLocal
+    def _on_socket_open(self, client, userdata, sock):
+        """
+        reads socket when data arrives
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        self.loop.call_soon_threadsafe(self.loop.add_reader, sock.fileno(), client.loop_read)
+
+    # noinspection PyUnusedLocal
+    def _on_socket_close(self, client, userdata, sock):
+        """
+        stops reading socket
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        # socket is closed after this call, its descriptor is still valid
+        self.loop.call_soon_threadsafe(self.loop.remove_reader, sock.fileno())
+
+    # noinspection PyUnusedLocal
+    def _on_socket_register_write(self, client, userdata, sock):
+        """
+        writes socket when it is writable
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    # noinspection PyUnusedLocal
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """
+        stops writing socket
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock.fileno())
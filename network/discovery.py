@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides mqtt discovery registration, configs already retained
+    by broker are not published again
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from hashlib import sha1
+from time import time
+from core import Logger, CONFIG_TOPIC, CONFIG_PAYLOAD, DOCUMENT_NAME, DOCUMENT_CONFIG_PAYLOAD, AVAILABILITY_CONFIG, \
+    DISCOVERY_FINGERPRINT
+
+
+class Discovery(object):
+    """
+    Registers metrics through mqtt client. A fingerprint of each
+    config acknowledged by broker is stored and configs with the same
+    fingerprint are skipped until refresh interval elapses
+    """
+
+    def __init__(self, mqtt_client, storage, config, name=None):
+        """
+        initializes discovery
+        :param mqtt_client: mqtt client or channel
+        :param storage: storage holding fingerprints
+        :param config: keeper configuration
+        :param name: monitor name, states are read from its json document
+        when json state mode is enabled
+        """
+
+        self.logger = Logger()
+        self.mqtt_client = mqtt_client
+        self.get = storage.get
+        self.put = storage.put
+        # unchanged configs are published again after this many seconds
+        # in case broker lost its retained messages
+        self.refresh = config.get("mqtt.discovery.refresh", 86400)
+        self.document = DOCUMENT_NAME % name if name and config.get("mqtt.state.json") else None
+        self.availability_topic = getattr(mqtt_client, "availability_topic", None)
+        # fingerprints and deliveries of configs not yet acknowledged by broker
+        self.pending = {}
+        self.registered = 0
+        self.skipped = 0
+
+    def register(self, metric, icon):
+        """
+        register a new metric using mqtt discovery, unless its
+        config was already published
+        :param metric: metric identification
+        :param icon: metric icon
+        """
+
+        key = DISCOVERY_FINGERPRINT % metric
+        payload = config_payload(metric, icon, self.document, self.availability_topic)
+        fingerprint = config_fingerprint(metric, payload)
+        now = int(time())
+        stored = (self.get(key) or "").split(" ")
+        if stored[0] == fingerprint and (not self.refresh or now - int(stored[1]) < self.refresh):
+            self.logger.debug("discovery config of %s is unchanged", metric)
+            self.skipped += 1
+            return
+
+        self.pending[key] = ("%s %s" % (fingerprint, now), self.mqtt_client.register(metric, icon, payload))
+        self.registered += 1
+        self.flush()
+
+    def flush(self):
+        """
+        stores fingerprints of configs acknowledged by broker, configs
+        never acknowledged are published again on next registration
+        """
+
+        pending = self.pending
+        for key, (fingerprint, delivery) in list(pending.items()):
+            try:
+                if delivery is not None and not delivery.is_published():
+                    continue
+
+                self.put(key, fingerprint)
+            except (RuntimeError, ValueError) as ex:
+                # config was not queued or client was not connected when publishing it
+                self.logger.warning("discovery config was not published: %s" % ex)
+
+            del pending[key]
+
+
+def config_payload(metric, icon, document=None, availability_topic=None):
+    """
+    return discovery config of a metric
+    :param metric: metric identification
+    :param icon: metric icon
+    :param document: name of json document holding metric state, if any
+    :param availability_topic: topic of sensor availability, if any
+    :return: discovery config
+    """
+
+    if document:
+        payload = DOCUMENT_CONFIG_PAYLOAD % (metric, document, metric, document, icon)
+    else:
+        payload = CONFIG_PAYLOAD % (metric, metric, icon)
+
+    if availability_topic:
+        payload = payload[:-1] + AVAILABILITY_CONFIG % availability_topic
+
+    return payload
+
+
+def config_fingerprint(metric, payload):
+    """
+    return fingerprint of a metric discovery config
+    :param metric: metric identification
+    :param payload: discovery config
+    :return: fingerprint
+    """
+
+    config = "%s\n%s" % (CONFIG_TOPIC % metric, payload)
+
+    return sha1(config.encode("utf-8")).hexdigest()[:16]
@@ -6,9 +6,12 @@
 """
 
 from datetime import datetime, timedelta
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from socket import socketpair
 from time import sleep
 from paho.mqtt.client import Client
-from core import Logger, STATE_TOPIC, CONFIG_TOPIC, CONFIG_PAYLOAD
+from core import Logger, Backoff, STATE_TOPIC, CONFIG_TOPIC, CONFIG_PAYLOAD, AVAILABILITY_TOPIC, AVAILABILITY_ONLINE, \
+    AVAILABILITY_OFFLINE
 
 
 class MqttClient(object):
@@ -16,6 +19,8 @@ class MqttClient(object):
     Holds connection and basic methods for accessing mqtt
     """
 
+    KEEPALIVE = 30
+
     def __init__(self, client_id, config, wait=True):
         """
         initialize mqtt client
@@ -27,7 +32,9 @@ class MqttClient(object):
         self.logger = Logger()
         user = config.get("mqtt.user")
         pwd = config.get("mqtt.pass")
-        client = Client(client_id=client_id)
+        # persistent sessions keep subscriptions and queue qos 1 messages
+        # on broker while disconnected, client id must be stable
+        client = Client(client_id=client_id, clean_session=not config.get("mqtt.persistent.session", False))
         client.on_connect = self._on_connect
         client.on_disconnect = self._on_disconnect
         client.on_message = self._on_message
@@ -35,11 +42,33 @@ class MqttClient(object):
         if user and pwd:
             client.username_pw_set(user, pwd)
 
-        client.connect_async(config["mqtt.broker"], config["mqtt.port"], 30)
+        # broker marks sensors unavailable when connection drops
+        self.availability_topic = None
+        if config.get("mqtt.availability", True):
+            self.availability_topic = AVAILABILITY_TOPIC % client_id
+            client.will_set(self.availability_topic, AVAILABILITY_OFFLINE, 1, True)
+
+        client.connect_async(config["mqtt.broker"], config["mqtt.port"], MqttClient.KEEPALIVE)
         self.client = client
         self.connected = False
         self.manager = None
         self.wait = wait
+        # failed attempts are delayed, first attempt after a disconnect is not
+        self.backoff = Backoff(config.get("mqtt.reconnect.delay", 1), config.get("mqtt.reconnect.max.delay", 60))
+        # event loop selects client socket and a wakeup socket used
+        # to interrupt blocking waits
+        self.event_loop = bool(config.get("mqtt.event.loop", False))
+        self.selector = None
+        if self.event_loop:
+            self.selector = DefaultSelector()
+            self.wakeup_read, self.wakeup_write = socketpair()
+            self.wakeup_read.setblocking(False)
+            self.wakeup_write.setblocking(False)
+            self.selector.register(self.wakeup_read, EVENT_READ)
+            client.on_socket_open = self._on_socket_open
+            client.on_socket_close = self._on_socket_close
+            client.on_socket_register_write = self._on_socket_register_write
+            client.on_socket_unregister_write = self._on_socket_unregister_write
 
     def __enter__(self):
         """
@@ -59,11 +88,20 @@ class MqttClient(object):
         """
 
         try:
+            # clean disconnects do not trigger last will
+            if self.availability_topic and self.connected:
+                self.client.publish(self.availability_topic, AVAILABILITY_OFFLINE, 1, True)
+
             self.logger.debug("disconnecting mqtt client")
             self.client.disconnect()
         except Exception:
             pass
 
+        if self.selector:
+            self.selector.close()
+            self.wakeup_read.close()
+            self.wakeup_write.close()
+
         self.client = None
 
     def set_manager(self, manager):
@@ -107,6 +145,10 @@ class MqttClient(object):
 
         self.logger.info("connected to %s:%s" % (client._host, client._port))
         self.connected = rc == 0
+        if self.connected:
+            self.backoff.reset()
+            if self.availability_topic:
+                client.publish(self.availability_topic, AVAILABILITY_ONLINE, 1, True)
         # call custom on connect methods if any defined
         try:
             self.logger.debug("calling custom on_connect")
@@ -132,6 +174,59 @@ class MqttClient(object):
             if not isinstance(ex, (TypeError, AttributeError)):
                 self.logger.error("failed to execute custom on_message: %s" % ex)
 
+    # noinspection PyUnusedLocal
+    def _on_socket_open(self, client, userdata, sock):
+        """
+        starts selecting client socket for reading
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        self.selector.register(sock, EVENT_READ)
+
+    # noinspection PyUnusedLocal
+    def _on_socket_close(self, client, userdata, sock):
+        """
+        stops selecting client socket
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    # noinspection PyUnusedLocal
+    def _on_socket_register_write(self, client, userdata, sock):
+        """
+        selects client socket for writing while there is data to send
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        try:
+            self.selector.modify(sock, EVENT_READ | EVENT_WRITE)
+        except (KeyError, ValueError):
+            pass
+
+    # noinspection PyUnusedLocal
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """
+        stops selecting client socket for writing
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param sock: client socket
+        """
+
+        try:
+            self.selector.modify(sock, EVENT_READ)
+        except (KeyError, ValueError):
+            pass
+
     def connection_status(self):
         """
         Returns a connection status code.
@@ -140,7 +235,12 @@ class MqttClient(object):
         """
 
         try:
-            if self.client.loop() > 0:
+            if self.event_loop:
+                # processes ready events without blocking
+                self.process_events(0)
+                if self.client.socket() is None:
+                    return 0
+            elif self.client.loop() > 0:
                 return 0
 
             if not self.connected:
@@ -172,8 +272,9 @@ class MqttClient(object):
                 except Exception as ex:
                     self.logger.debug("failed to connect mqtt: %s", ex)
 
-            self.logger.debug("waiting 1 second for connection")
-            sleep(1)
+                status = connection_status()
+
+            self.pause(status, None if timeout == -1 else (limit - now()).total_seconds())
             status = connection_status()
 
     # noinspection PyProtectedMember
@@ -210,32 +311,112 @@ class MqttClient(object):
             if not wait:
                 return status
 
-            sleep(1)
+            self.pause(status)
+            status = connection_status()
 
         return status
 
-    def register(self, metric, icon):
+    def pause(self, status, timeout=None):
+        """
+        waits before next connection attempt. a refused connection
+        waits for next backoff delay while a connection in progress
+        waits for broker answer
+        :param status: connection status
+        :param timeout: maximum seconds to wait, default no limit
+        """
+
+        if status == 2:
+            return
+
+        # call custom on wait methods if any defined
+        try:
+            self.manager.on_wait()
+        except Exception as ex:
+            if not isinstance(ex, (TypeError, AttributeError)):
+                self.logger.error("failed to execute custom on_wait: %s" % ex)
+
+        if status == 1:
+            self.process_events(1 if timeout is None else max(min(timeout, 1), 0))
+            return
+
+        delay = self.backoff.next()
+        if timeout is not None:
+            delay = max(min(delay, timeout), 0)
+
+        self.logger.debug("waiting %.1f seconds before reconnecting", delay)
+        sleep(delay)
+
+    def register(self, metric, icon, payload=None):
         """
         register a new metric using mqtt discovery
         :param metric: metric identification
         :param icon: metric icon
+        :param payload: discovery config, by default state is read from metric topic
+        :return: message info, published once broker acknowledges it
         """
 
         self.logger.debug("registering metrics %s", metric)
-        self.client.publish(CONFIG_TOPIC % metric, CONFIG_PAYLOAD % (metric, metric, icon), 1, True)
+        return self.client.publish(CONFIG_TOPIC % metric, payload or CONFIG_PAYLOAD % (metric, metric, icon), 1, True)
 
     def publish_state(self, metric, state):
         """
         publish state to mqtt
         :param metric: metric identification
         :param state: state value
+        :return: message info, published once broker acknowledges it
         """
 
         self.logger.debug("updating metric %s with state %s", metric, state)
-        self.client.publish(STATE_TOPIC % metric, state, 1, True)
+        return self.client.publish(STATE_TOPIC % metric, state, 1, True)
 
     def loop(self):
         """
         calls mqtt client loop
         """
         self.client.loop()
+
+    def process_events(self, timeout):
+        """
+        blocks until network events arrive or timeout elapses. in event
+        loop mode callbacks run as soon as data arrives, otherwise
+        client loop is called and remaining time is slept, up to 1 second
+        :param timeout: maximum seconds to wait
+        """
+
+        if not self.event_loop:
+            self.client.loop(0)
+            sleep(min(timeout, 1))
+            return
+
+        client = self.client
+        # wakes up in time to keep connection alive
+        events = self.selector.select(max(min(timeout, MqttClient.KEEPALIVE / 3), 0))
+        for key, mask in events:
+            if key.fileobj is self.wakeup_read:
+                try:
+                    while self.wakeup_read.recv(64):
+                        pass
+                except OSError:
+                    pass
+
+                continue
+
+            if mask & EVENT_READ:
+                client.loop_read()
+
+            if mask & EVENT_WRITE:
+                client.loop_write()
+
+        client.loop_misc()
+
+    def interrupt(self):
+        """
+        interrupts a blocking process_events, safe to call from
+        signal handlers and other threads
+        """
+
+        if self.event_loop:
+            try:
+                self.wakeup_write.send(b"\0")
+            except OSError:
+                pass
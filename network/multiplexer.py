@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides a single mqtt connection shared by several monitors,
+    messages are routed to monitors by topic filter
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from collections import deque
+from queue import Queue, Empty
+from threading import Thread, Condition
+from time import sleep, time
+from paho.mqtt.client import topic_matches_sub
+from core import Logger
+from network.mqtt import MqttClient
+
+
+class Multiplexer(object):
+    """
+    Owns one mqtt client driven by a network thread. Monitors use
+    channels, callbacks are delivered in the monitor thread and
+    publishes are executed by the network thread
+    """
+
+    def __init__(self, client_id, config):
+        """
+        initializes multiplexer
+        :param client_id: client id of shared connection
+        :param config: keeper configuration
+        """
+
+        self.logger = Logger()
+        config = dict(config)
+        # network thread needs to be interrupted when there is something to publish
+        config["mqtt.event.loop"] = True
+        self.mqtt_client = MqttClient(client_id, config, False)
+        self.mqtt_client.set_manager(self)
+        self.channels = []
+        self.calls = deque()
+        self.condition = Condition()
+        self.connections = 0
+        self.connected = False
+        # filters subscribed on broker and requested qos by filter
+        self.subscribed = set()
+        self.qos = {}
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        """
+        starts network thread when entering context
+        :return: Multiplexer object
+        """
+
+        self.running = True
+        self.thread = Thread(target=self.run, name="mqtt")
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    def __exit__(self, type, value, traceback):
+        """
+        stops network thread and disconnects when exiting context,
+        pending publishes are sent before disconnecting
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        self.running = False
+        self.mqtt_client.interrupt()
+        self.thread.join(10)
+        self.mqtt_client.__exit__(type, value, traceback)
+
+    def channel(self):
+        """
+        creates a channel for a monitor
+        :return: channel
+        """
+
+        channel = Channel(self)
+        self.call(self._add_channel, channel)
+
+        return channel
+
+    def call(self, func, *args):
+        """
+        executes a function in network thread
+        :param func: function
+        :param args: function arguments
+        """
+
+        self.calls.append((func, args))
+        self.mqtt_client.interrupt()
+
+    def subscribe(self, channel, topic, qos=0):
+        """
+        routes a topic to a channel, subscribing it on broker
+        :param channel: channel
+        :param topic: topic filter
+        :param qos: subscription qos
+        """
+
+        self.call(self._add_topic, channel, topic, qos)
+
+    def wait_connection(self, channel, timeout=None):
+        """
+        blocks until channel is notified of shared connection
+        :param channel: channel
+        :param timeout: seconds to wait, default forever
+        :return: True when connected
+        """
+
+        with self.condition:
+            return self.condition.wait_for(lambda: channel.connected or channel.interrupted, timeout) and \
+                channel.connected
+
+    def run(self):
+        """
+        network thread, only thread using mqtt client
+        """
+
+        mqtt_client = self.mqtt_client
+        calls = self.calls
+        retry_at = 0
+        while self.running:
+            try:
+                # checking status consumes interruptions, calls queued
+                # until then are executed before blocking
+                status = mqtt_client.connection_status()
+                while calls:
+                    func, args = calls.popleft()
+                    func(*args)
+
+                if status == 0:
+                    # single reconnect for every channel, failed attempts
+                    # wait for backoff delay while still running calls
+                    if time() < retry_at:
+                        mqtt_client.process_events(retry_at - time())
+                    elif mqtt_client.reconnect() == 0:
+                        retry_at = time() + mqtt_client.backoff.next()
+                else:
+                    # waits for broker acknowledge or network events
+                    mqtt_client.process_events(1 if status == 1 else MqttClient.KEEPALIVE)
+            except Exception as ex:
+                self.logger.error("mqtt network loop failed: %s" % ex)
+                sleep(1)
+
+        # sends pending publishes before leaving
+        try:
+            while calls:
+                func, args = calls.popleft()
+                func(*args)
+
+            mqtt_client.process_events(0)
+        except Exception as ex:
+            self.logger.warning("unable to send pending messages: %s" % ex)
+
+    def _add_channel(self, channel):
+        """
+        adds a channel, notifying it when already connected
+        :param channel: channel
+        """
+
+        self.channels.append(channel)
+        if self.connected:
+            self._connect_channel(channel, None, {}, 0)
+            self._notify()
+
+    def _remove_channel(self, channel):
+        """
+        removes a closed channel and subscriptions only it needed
+        :param channel: channel
+        """
+
+        try:
+            self.channels.remove(channel)
+        except ValueError:
+            return
+
+        self._subscribe()
+
+    def _add_topic(self, channel, topic, qos):
+        """
+        adds a topic to a channel and updates broker subscriptions
+        :param channel: channel
+        :param topic: topic filter
+        :param qos: subscription qos
+        """
+
+        channel.topics.add(topic)
+        self.qos[topic] = max(qos, self.qos.get(topic, 0))
+        self._subscribe()
+
+    @staticmethod
+    def _connect_channel(channel, userdata, flags, rc):
+        """
+        notifies a channel of shared connection
+        :param channel: channel
+        :param userdata: userdata dict
+        :param flags: flags
+        :param rc: rc code
+        """
+
+        channel.dispatch("on_connect", channel, userdata, flags, rc)
+        channel.connected = rc == 0
+
+    def _subscribe(self):
+        """
+        subscribes channel filters not covered by other filters, broker
+        would deliver a message once per overlapping subscription
+        """
+
+        if not self.mqtt_client.connected:
+            return
+
+        topics = set()
+        for channel in self.channels:
+            topics.update(channel.topics)
+
+        # filter is subscribed with highest qos of filters it covers
+        qos = self.qos
+        topics = {(topic, max(qos.get(other, 0) for other in topics if covers(topic, other))) for topic in topics
+                  if not any(other != topic and covers(other, topic) for other in topics)}
+        client = self.mqtt_client.client
+        for topic in {topic for topic, topic_qos in self.subscribed} - {topic for topic, topic_qos in topics}:
+            client.unsubscribe(topic)
+
+        for topic, topic_qos in topics - self.subscribed:
+            client.subscribe(topic, topic_qos)
+
+        self.subscribed = topics
+
+    def _notify(self):
+        """
+        wakes up threads waiting for connection
+        """
+
+        with self.condition:
+            self.condition.notify_all()
+
+    # noinspection PyUnusedLocal
+    def on_connect(self, client, userdata, flags, rc):
+        """
+        subscribes every channel topic and notifies channels
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param flags: flags
+        :param rc: rc code
+        """
+
+        self.connections += 1
+        self.connected = rc == 0
+        # broker keeps subscriptions of a persistent session
+        if not flags.get("session present"):
+            self.subscribed = set()
+
+        self._subscribe()
+        for channel in self.channels:
+            self._connect_channel(channel, userdata, flags, rc)
+
+        self._notify()
+
+    # noinspection PyUnusedLocal
+    def on_disconnect(self, client, userdata, rc):
+        """
+        notifies channels
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param rc: rc code
+        """
+
+        self.connected = False
+        for channel in self.channels:
+            channel.connected = False
+            channel.dispatch("on_disconnect", channel, userdata, rc)
+
+        self._notify()
+
+    # noinspection PyUnusedLocal
+    def on_message(self, client, userdata, message):
+        """
+        routes message to channels subscribing its topic
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param message: message received
+        """
+
+        topic = message.topic
+        for channel in self.channels:
+            for topic_filter in channel.topics:
+                if topic_matches_sub(topic_filter, topic):
+                    channel.dispatch("on_message", channel, userdata, message)
+                    break
+
+    def on_not_connect(self):
+        """
+        notifies channels
+        """
+
+        for channel in self.channels:
+            channel.dispatch("on_not_connect")
+
+
+class Channel(object):
+    """
+    Monitor side of a multiplexer, provides the same methods
+    monitors use from MqttClient
+    """
+
+    def __init__(self, multiplexer):
+        """
+        initializes channel
+        :param multiplexer: multiplexer
+        """
+
+        self.multiplexer = multiplexer
+        self.manager = None
+        # sensors of every channel share connection availability
+        self.availability_topic = multiplexer.mqtt_client.availability_topic
+        # reconnect delays of shared connection
+        self.backoff = multiplexer.mqtt_client.backoff
+        # topics and connection state are only changed by network thread
+        self.topics = set()
+        self.connected = False
+        self.interrupted = False
+        self.events = Queue()
+
+    def __enter__(self):
+        """
+        entering context
+        :return: Channel object
+        """
+
+        return self
+
+    # noinspection PyShadowingBuiltins
+    def __exit__(self, type, value, traceback):
+        """
+        removes channel from multiplexer when exiting context,
+        connection is closed by multiplexer
+        :param type:
+        :param value:
+        :param traceback:
+        """
+
+        self.multiplexer.call(self.multiplexer._remove_channel, self)
+
+    def set_manager(self, manager):
+        """
+        sets associated manager
+        :param manager: manager using channel
+        """
+
+        self.manager = manager
+
+    def dispatch(self, name, *args):
+        """
+        queues a manager callback, executed by process_events
+        :param name: callback name
+        :param args: callback arguments
+        """
+
+        self.events.put((name, args))
+
+    def subscribe(self, topic, qos=0):
+        """
+        subscribes a topic, messages are routed to this channel
+        :param topic: topic filter
+        :param qos: subscription qos
+        """
+
+        self.multiplexer.subscribe(self, topic, qos)
+
+    def register(self, metric, icon, payload=None):
+        """
+        register a new metric using mqtt discovery
+        :param metric: metric identification
+        :param icon: metric icon
+        :param payload: discovery config, by default state is read from metric topic
+        :return: delivery, published once broker acknowledges it
+        """
+
+        delivery = Delivery()
+        self.multiplexer.call(delivery.publish, self.multiplexer.mqtt_client.register, metric, icon, payload)
+
+        return delivery
+
+    def publish_state(self, metric, state):
+        """
+        publish state to mqtt
+        :param metric: metric identification
+        :param state: state value
+        :return: delivery, published once broker acknowledges it
+        """
+
+        delivery = Delivery()
+        self.multiplexer.call(delivery.publish, self.multiplexer.mqtt_client.publish_state, metric, state)
+
+        return delivery
+
+    def connection_status(self):
+        """
+        Returns a connection status code.
+        :return: connection status code. 0 is not connected and 2 for connected
+        """
+
+        return 2 if self.connected else 0
+
+    def wait_connection(self, timeout=-1):
+        """
+        blocks waiting for shared connection, manager is called every
+        second while waiting
+        :param timeout: seconds to wait, -1 waits forever
+        """
+
+        limit = None if timeout == -1 else time() + timeout
+        wait_connection = self.multiplexer.wait_connection
+        while not wait_connection(self, 1 if limit is None else max(min(limit - time(), 1), 0)):
+            if self.interrupted or (limit is not None and time() >= limit):
+                break
+
+            self._execute("on_wait", ())
+
+        self.process_events(0)
+
+    def reconnect(self):
+        """
+        waits for shared connection, reconnection is handled by
+        multiplexer. manager is called while connection is down, like
+        a client pausing between attempts
+        :return: connection status
+        """
+
+        if not self.multiplexer.wait_connection(self, 1) and not self.interrupted:
+            self._execute("on_wait", ())
+
+        self.process_events(0)
+
+        return self.connection_status()
+
+    def loop(self):
+        """
+        executes pending callbacks
+        """
+
+        self.process_events(0)
+
+    def process_events(self, timeout):
+        """
+        blocks until callbacks are delivered or timeout elapses,
+        callbacks are executed in caller thread
+        :param timeout: maximum seconds to wait
+        """
+
+        events = self.events
+        try:
+            event = events.get(timeout=timeout) if timeout > 0 else events.get_nowait()
+            while 1:
+                self._execute(*event)
+                event = events.get_nowait()
+        except Empty:
+            pass
+
+    def interrupt(self):
+        """
+        interrupts a blocking process_events, waits for connection
+        are no longer blocking once channel is interrupted
+        """
+
+        self.interrupted = True
+        self.events.put((None, ()))
+        self.multiplexer._notify()
+
+    def _execute(self, name, args):
+        """
+        executes a manager callback
+        :param name: callback name
+        :param args: callback arguments
+        """
+
+        if name is None:
+            return
+
+        try:
+            getattr(self.manager, name)(*args)
+        except Exception as ex:
+            if not isinstance(ex, (TypeError, AttributeError)):
+                self.multiplexer.logger.error("failed to execute custom %s: %s" % (name, ex))
+
+
+class Delivery(object):
+    """
+    Message published by network thread on behalf of a channel
+    """
+
+    def __init__(self):
+        """
+        initializes delivery
+        """
+
+        self.info = None
+
+    def publish(self, publish, *args):
+        """
+        publishes message, called by network thread
+        :param publish: mqtt client publish method
+        :param args: publish method arguments
+        """
+
+        self.info = publish(*args)
+
+    def is_published(self):
+        """
+        return whether broker acknowledged message
+        :return: True when acknowledged
+        """
+
+        info = self.info
+        return info is not None and info.is_published()
+
+
+def covers(general, specific):
+    """
+    check whether every topic matched by a filter is also
+    matched by another filter
+    :param general: topic filter
+    :param specific: topic filter
+    :return: True when general filter covers specific filter
+    """
+
+    general = general.split("/")
+    specific = specific.split("/")
+    for i, level in enumerate(general):
+        if level == "#":
+            return True
+
+        if i >= len(specific) or specific[i] == "#":
+            return False
+
+        if level != "+" and level != specific[i]:
+            return False
+
+    return len(general) == len(specific)
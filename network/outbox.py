@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides a bounded outbox of states waiting to be published,
+    spilled to disk while broker is unreachable
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+from core import Logger
+
+
+class Outbox(OrderedDict):
+    """
+    States by metric in the order they were first queued. When
+    capacity is reached the oldest state is dropped
+    """
+
+    def __init__(self, capacity=0, spool=None):
+        """
+        initializes outbox, restoring spooled states
+        :param capacity: maximum number of states, 0 is unbounded
+        :param spool: spool holding states across restarts, optional
+        """
+
+        super(Outbox, self).__init__()
+        self.logger = Logger()
+        self.capacity = capacity
+        self.spool = spool
+        self.dropped = 0
+        if spool:
+            for metric, state in spool.load():
+                self.put(metric, state)
+
+            if self:
+                self.logger.info("restored %s undelivered states" % len(self))
+
+    def put(self, metric, state):
+        """
+        queues metric state, replacing a queued state of same metric
+        :param metric: metric identification
+        :param state: state value
+        :return: True when a queued state was replaced
+        """
+
+        replaced = metric in self
+        self[metric] = state
+        if self.capacity and len(self) > self.capacity:
+            oldest = next(iter(self))
+            del self[oldest]
+            self.dropped += 1
+            self.logger.warning("outbox is full, dropping state of %s" % oldest)
+
+        return replaced
+
+    def spill(self, inflight=()):
+        """
+        writes undelivered states to spool
+        :param inflight: states sent but not acknowledged, before queued states
+        """
+
+        if self.spool:
+            self.spool.save(list(inflight) + list(self.items()))
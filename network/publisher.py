@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+    Provides a publish stage in front of mqtt client, states are
+    coalesced per metric and only changed values are published.
+    states are held in an outbox while broker is unreachable
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from json import dumps
+from time import time
+from core import Logger, DOCUMENT_NAME
+from kio import Spool
+from network.outbox import Outbox
+
+
+class Publisher(object):
+    """
+    Keeps latest state of each metric until flushed. States equal
+    to the value already delivered to broker are skipped and metrics
+    with a minimum interval are held until it elapses. In json state
+    mode every metric is published in a single document. States are
+    only published while connected, with a limited number of messages
+    waiting for broker acknowledge
+    """
+
+    def __init__(self, mqtt_client, config, name=None):
+        """
+        initializes publisher
+        :param mqtt_client: mqtt client or channel
+        :param config: keeper configuration
+        :param name: monitor name, used as document name in json state mode
+        and spool name
+        """
+
+        self.logger = Logger()
+        self.mqtt_client = mqtt_client
+        self.interval = config.get("mqtt.publish.interval", 0) or 0
+        self.intervals = config.get("mqtt.publish.intervals") or {}
+        # latest state of each metric waiting for flush, spooled while
+        # disconnected so a restart does not lose them
+        self.pending = Outbox(config.get("mqtt.outbox.size", 100), Spool(name) if name else None)
+        self.inflight = config.get("mqtt.outbox.inflight", 10) or 1
+        # last payload sent by metric and its delivery, broker
+        # acknowledges qos 1 messages even after reconnecting
+        self.sent = {}
+        self.acknowledged = {}
+        self.published_at = {}
+        self.published = 0
+        self.saved = 0
+        # latest state of every metric when publishing a json document
+        self.document_name = DOCUMENT_NAME % name if name and config.get("mqtt.state.json") else None
+        self.document = {}
+        self.changed = False
+
+    def publish_state(self, metric, state):
+        """
+        queues metric state, replacing a state not yet flushed
+        :param metric: metric identification
+        :param state: state value
+        """
+
+        if self.pending.put(metric, state):
+            self.saved += 1
+
+    def flush(self, force=False):
+        """
+        publishes pending states in order. states not published because
+        of minimum interval or flow control are kept for a later flush
+        and spooled while disconnected
+        :param force: whether minimum intervals are ignored
+        """
+
+        self._acknowledge()
+        if not self.mqtt_client.connected:
+            self.pending.spill(self._undelivered())
+            return
+
+        if self.document_name:
+            self._flush_document(force)
+        else:
+            self._flush_states(force)
+
+        # spool is cleared once everything is delivered
+        if not self.pending and not self.sent and not self.changed:
+            self.pending.spill()
+
+    def close(self):
+        """
+        spools undelivered states, called when leaving
+        """
+
+        self._acknowledge()
+        self.pending.spill(self._undelivered())
+
+    def _flush_states(self, force):
+        """
+        publishes pending states, one message per metric
+        :param force: whether minimum intervals are ignored
+        """
+
+        pending = self.pending
+        if not pending:
+            return
+
+        publish_state = self.mqtt_client.publish_state
+        now = time()
+        saved = self.saved
+        for metric in list(pending):
+            if len(self.sent) >= self.inflight:
+                break
+
+            state = pending[metric]
+            # mqtt payloads are strings, 1 and "1" are the same value
+            payload = "" if state is None else str(state)
+            # value broker holds once messages in flight are acknowledged
+            sent = self.sent.get(metric)
+            if payload == (sent[0] if sent else self.acknowledged.get(metric)):
+                del pending[metric]
+                self.saved += 1
+                continue
+
+            if not force and now < self.published_at.get(metric, 0) + self.intervals.get(metric, self.interval):
+                continue
+
+            # state is kept pending when publish fails
+            self.sent[metric] = (payload, publish_state(metric, state))
+            self.published_at[metric] = now
+            self.published += 1
+            del pending[metric]
+
+        if self.saved != saved:
+            self.logger.debug("%s publishes saved, %s published", self.saved, self.published)
+
+    def _flush_document(self, force):
+        """
+        merges pending states into json document and publishes it
+        :param force: whether minimum intervals are ignored
+        """
+
+        pending = self.pending
+        now = time()
+        merged = 0
+        for metric in list(pending):
+            if not force and now < self.published_at.get(metric, 0) + self.intervals.get(metric, self.interval):
+                continue
+
+            self.document[metric] = pending.pop(metric)
+            self.published_at[metric] = now
+            merged += 1
+
+        if merged:
+            self.changed = True
+
+        if not self.changed or len(self.sent) >= self.inflight:
+            return
+
+        name = self.document_name
+        payload = dumps(self.document, sort_keys=True)
+        sent = self.sent.get(name)
+        if payload == (sent[0] if sent else self.acknowledged.get(name)):
+            self.saved += merged
+            self.changed = False
+            return
+
+        # document is published again on next flush when publish fails
+        self.sent[name] = (payload, self.mqtt_client.publish_state(name, payload))
+        self.changed = False
+        self.published += 1
+        # every merged state beyond the first would be a publish of its own
+        self.saved += max(merged - 1, 0)
+        self.logger.debug("%s publishes saved, %s published", self.saved, self.published)
+
+    def next_flush(self, timeout):
+        """
+        return seconds until a pending state can be published
+        :param timeout: maximum seconds
+        :return: seconds to wait before flushing again
+        """
+
+        # acknowledges and connection wake up waits for network events
+        if not self.pending or not self.mqtt_client.connected or len(self.sent) >= self.inflight:
+            return timeout
+
+        now = time()
+        published_at = self.published_at
+        intervals = self.intervals
+        for metric in self.pending:
+            timeout = min(timeout, published_at.get(metric, 0) + intervals.get(metric, self.interval) - now)
+
+        return max(timeout, 0)
+
+    def _acknowledge(self):
+        """
+        moves states acknowledged by broker out of sent states
+        """
+
+        sent = self.sent
+        for metric in [metric for metric, (payload, delivery) in sent.items() if
+                       delivery is None or delivery.is_published()]:
+            self.acknowledged[metric] = sent.pop(metric)[0]
+
+    def _undelivered(self):
+        """
+        return states sent but not yet acknowledged by broker
+        :return: list of metrics and states
+        """
+
+        if self.document_name:
+            # document is restored from its states
+            return list(self.document.items()) if self.sent or self.changed else []
+
+        return [(metric, payload) for metric, (payload, delivery) in self.sent.items()]
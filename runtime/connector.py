@@ -8,16 +8,16 @@
 from datetime import datetime
 from os import getpid
 from signal import signal, SIGTERM, SIGINT
-from time import sleep, strftime
+from time import strftime
 from core import Logger, load_config, exec_command, CONNECTOR_LAST_MQTT_RESTART, TIME_FORMAT, CONNECTOR_STATUS, \
     STATUS_RUNNING, STATUS_NOT_RUNNING, CONNECTOR_CONNECTION_OK, CONNECTOR_CONNECTION_STATUS, \
     CONNECTOR_CONNECTION_NOK, CONNECTOR_MQTT_RESTARTS, CONNECTOR_FAILED_CONNECTIONS, \
     CONNECTOR_MQTT_RESTARTS_ICON, CONNECTOR_CONNECTION_STATUS_ICON, CONNECTOR_FAILED_CONNECTIONS_ICON, \
-    CONNECTOR_STATUS_ICON, CONNECTOR_LAST_MQTT_RESTART_ICON
-from kio import Storage
-from network import MqttClient
-
-running = False
+    CONNECTOR_STATUS_ICON, CONNECTOR_LAST_MQTT_RESTART_ICON, CONNECTOR_RECONNECT_TIME, CONNECTOR_RECONNECT_TIME_ICON, \
+    CONNECTOR_RECONNECT_ATTEMPTS, CONNECTOR_RECONNECT_ATTEMPTS_ICON, CONNECTOR_LOOP_LATENCY, CONNECTOR_LOOP_LATENCY_ICON
+from kio import create_storage, History, Board, discard
+from network import MqttClient, Publisher, Discovery
+from runtime.watchdog import Watchdog
 
 
 class Connector(object):
@@ -25,12 +25,14 @@ class Connector(object):
     Connector logic to restart connections
     """
 
-    def __init__(self, config, storage, mqtt_client):
+    def __init__(self, config, storage, mqtt_client, history=None, board=None):
         """
         initializes connector
         :param config: keeper configuration dict
         :param storage: storage access
         :param mqtt_client: MQTT client
+        :param history: history of events, optional
+        :param board: board shared with manager, optional
         """
 
         self.attempts = 0
@@ -41,15 +43,29 @@ class Connector(object):
         self.started_at = datetime.now()
         self.time_connected = 0
         self.connected_at = None
-        put = storage.put
-        self.mqtt_restarts = put(CONNECTOR_MQTT_RESTARTS, storage.get_int(CONNECTOR_MQTT_RESTARTS))
-        self.failed_connections = put(CONNECTOR_FAILED_CONNECTIONS, storage.get_int(CONNECTOR_FAILED_CONNECTIONS))
-        self.states_queue = []
-        self.put = put
-        self.get = storage.get
+        # initial state is loaded with a single query
+        state = storage.snapshot()
+        self.mqtt_restarts = state.get_int(CONNECTOR_MQTT_RESTARTS)
+        self.failed_connections = state.get_int(CONNECTOR_FAILED_CONNECTIONS)
+        self.state = state
+        self.put = storage.put
+        self.sync = storage.sync
+        self.history = history
+        self.record = history.record if history else discard
+        self.board = board
+        # failed increments return None, last known value is kept
         self.inc = storage.inc
+        # states are coalesced and published on every loop
+        self.publisher = Publisher(mqtt_client, config, "connector")
+        self.publish_state = self.publisher.publish_state
+        # discovery configs are only published when changed
+        self.discovery = Discovery(mqtt_client, storage, config, "connector")
+        # ticks tell manager this process is not stuck
+        self.watchdog = Watchdog(board, "connector", self.counters)
         mqtt_client.set_manager(self)
         self.mqtt_client = mqtt_client
+        # loop runs until monitor is stopped
+        self.running = False
         self.logger = Logger()
 
     def __enter__(self):
@@ -74,10 +90,18 @@ class Connector(object):
 
         self.logger.info("stopping connector[pid=%s]" % getpid())
         try:
-            self.mqtt_client.publish_state(CONNECTOR_STATUS, STATUS_NOT_RUNNING)
+            self.publish_state(CONNECTOR_STATUS, STATUS_NOT_RUNNING)
+            self.publisher.flush(True)
         except Exception as ex:
             self.logger.error("failed to publish connector status: %s" % ex)
 
+        try:
+            self.publisher.close()
+        except Exception as ex:
+            self.logger.error("failed to spool undelivered states: %s" % ex)
+
+        self.logger.info("published %s states, %s publishes saved" % (self.publisher.published, self.publisher.saved))
+
     # noinspection PyUnusedLocal
     def on_connect(self, client, userdata, flags, rc):
         """
@@ -90,26 +114,43 @@ class Connector(object):
         """
 
         self.connected_at = datetime.now()
+        self.record(CONNECTOR_CONNECTION_STATUS, 1)
+        # time and attempts taken by this connection, delayed by backoff
+        backoff = self.mqtt_client.backoff
+        if backoff.last_attempts:
+            self.logger.info("reconnected after %s attempts in %.1f seconds" % (
+                backoff.last_attempts, backoff.last_elapsed))
+            self.record(CONNECTOR_RECONNECT_TIME, backoff.last_elapsed)
+
+        self.publish_state(CONNECTOR_RECONNECT_TIME, round(backoff.last_elapsed, 1))
+        self.publish_state(CONNECTOR_RECONNECT_ATTEMPTS, backoff.last_attempts)
         # first time we are connected we register metrics and
         # send initial values
         if not self.registered:
             self.logger.info("registering metrics")
             try:
-                publish_state = self.mqtt_client.publish_state
-                register = self.mqtt_client.register
+                publish_state = self.publish_state
+                register = self.discovery.register
                 # register all metrics
                 register(CONNECTOR_STATUS, CONNECTOR_STATUS_ICON)
                 register(CONNECTOR_CONNECTION_STATUS, CONNECTOR_CONNECTION_STATUS_ICON)
                 register(CONNECTOR_MQTT_RESTARTS, CONNECTOR_MQTT_RESTARTS_ICON)
                 register(CONNECTOR_FAILED_CONNECTIONS, CONNECTOR_FAILED_CONNECTIONS_ICON)
                 register(CONNECTOR_LAST_MQTT_RESTART, CONNECTOR_LAST_MQTT_RESTART_ICON)
+                register(CONNECTOR_RECONNECT_TIME, CONNECTOR_RECONNECT_TIME_ICON)
+                register(CONNECTOR_RECONNECT_ATTEMPTS, CONNECTOR_RECONNECT_ATTEMPTS_ICON)
+                register(CONNECTOR_LOOP_LATENCY, CONNECTOR_LOOP_LATENCY_ICON)
                 # sends initial values
                 publish_state(CONNECTOR_STATUS, STATUS_RUNNING)
                 publish_state(CONNECTOR_CONNECTION_STATUS, CONNECTOR_CONNECTION_OK)
                 publish_state(CONNECTOR_MQTT_RESTARTS, self.mqtt_restarts)
                 publish_state(CONNECTOR_FAILED_CONNECTIONS, self.failed_connections)
-                publish_state(CONNECTOR_LAST_MQTT_RESTART, self.get(CONNECTOR_LAST_MQTT_RESTART))
+                publish_state(CONNECTOR_LAST_MQTT_RESTART, self.state.get(CONNECTOR_LAST_MQTT_RESTART))
+                self.publisher.flush()
+                self.logger.info("%s discovery configs unchanged" % self.discovery.skipped)
                 self.registered = True
+                # initial state is no longer needed
+                self.state = None
             except Exception as ex:
                 self.logger.error("failed to register initial metrics: %s" % ex)
 
@@ -123,8 +164,11 @@ class Connector(object):
         """
 
         self.was_stable = self.is_stable()
-        self.states_queue.append(
-            (CONNECTOR_CONNECTION_STATUS, CONNECTOR_CONNECTION_OK if self.was_stable else CONNECTOR_CONNECTION_NOK))
+        self.record(CONNECTOR_CONNECTION_STATUS, 0)
+        self.publish_state(
+            CONNECTOR_CONNECTION_STATUS, CONNECTOR_CONNECTION_OK if self.was_stable else CONNECTOR_CONNECTION_NOK)
+        # undelivered states are spooled until broker is back
+        self.publisher.flush()
 
     def is_stable(self, update=True):
         """
@@ -154,56 +198,125 @@ class Connector(object):
             self.logger.warning("max of 3 connection attempts was reached")
             self.logger.warning("restarting mqtt service")
             if exec_command(self.command):
-                append = self.states_queue.append
-                self.mqtt_restarts = self.inc(CONNECTOR_MQTT_RESTARTS, self.mqtt_restarts)
-                append((CONNECTOR_MQTT_RESTARTS, self.mqtt_restarts))
-                append((CONNECTOR_LAST_MQTT_RESTART, self.put(CONNECTOR_LAST_MQTT_RESTART, strftime(TIME_FORMAT))))
+                publish_state = self.publish_state
+                self.mqtt_restarts = self.inc(CONNECTOR_MQTT_RESTARTS) or self.mqtt_restarts
+                publish_state(CONNECTOR_MQTT_RESTARTS, self.mqtt_restarts)
+                self.record(CONNECTOR_MQTT_RESTARTS)
+                publish_state(CONNECTOR_LAST_MQTT_RESTART, self.put(CONNECTOR_LAST_MQTT_RESTART, strftime(TIME_FORMAT)))
+                self.publisher.flush()
                 self.mqtt_client.wait_connection(60)
                 self.attempts = 0
         else:
             self.attempts += 1
-            self.failed_connections = self.inc(CONNECTOR_FAILED_CONNECTIONS, self.failed_connections)
-            self.states_queue.append((CONNECTOR_FAILED_CONNECTIONS, self.failed_connections))
+            self.failed_connections = self.inc(CONNECTOR_FAILED_CONNECTIONS) or self.failed_connections
+            self.publish_state(CONNECTOR_FAILED_CONNECTIONS, self.failed_connections)
+            self.record(CONNECTOR_FAILED_CONNECTIONS)
             self.logger.warning("broker is not responding (%s of 3)" % self.attempts)
-            sleep(10)
+            # next attempt is delayed by mqtt client backoff
+            self.publisher.flush()
+
+        self.persist()
+
+    def counters(self):
+        """
+        return live counters published to board
+        :return: dict of counter names and values
+        """
+
+        return {
+            "connected": self.mqtt_client.connected,
+            "attempts": self.attempts,
+            CONNECTOR_FAILED_CONNECTIONS: self.failed_connections,
+            CONNECTOR_MQTT_RESTARTS: self.mqtt_restarts,
+            "retries": self.mqtt_client.backoff.attempts,
+            "published": self.publisher.published,
+            "saved": self.publisher.saved
+        }
+
+    def on_wait(self):
+        """
+        ticks while waiting for broker, values changed meanwhile are
+        stored as they would be on loop
+        """
+
+        self.tick()
+        self.persist()
+
+    def persist(self):
+        """
+        stores pending values and history events
+        """
+
+        self.sync()
+        if self.history:
+            self.history.sync()
+
+    def tick(self):
+        """
+        ticks watchdog, longest time between ticks is published
+        periodically
+        """
+
+        watchdog = self.watchdog
+        watchdog.tick()
+        latency = watchdog.report()
+        if latency is not None:
+            self.publish_state(CONNECTOR_LOOP_LATENCY, latency)
 
     def loop(self):
         """
-        sleeps 1 second until next validation
+        waits for network events until next validation
         sends metrics if any to send
         """
 
         if not self.was_stable:
             self.was_stable = self.is_stable(False)
-            self.states_queue.append(
-                (CONNECTOR_CONNECTION_STATUS, CONNECTOR_CONNECTION_OK if self.was_stable else CONNECTOR_CONNECTION_NOK))
+            self.publish_state(
+                CONNECTOR_CONNECTION_STATUS, CONNECTOR_CONNECTION_OK if self.was_stable else CONNECTOR_CONNECTION_NOK)
 
-        publish_state = self.mqtt_client.publish_state
         try:
-            for states in self.states_queue:
-                publish_state(states[0], states[1])
-
-            self.states_queue = []
+            self.publisher.flush()
+            self.discovery.flush()
         except Exception as ex:
             self.logger.warning("unable to update metrics: %s" % ex)
 
-        sleep(1)
+        self.tick()
 
+        self.persist()
+
+        # stability is recalculated every second until connection is stable
+        self.mqtt_client.process_events(self.publisher.next_flush(1 if not self.was_stable else MqttClient.KEEPALIVE))
+
+    def stop(self):
+        """
+        ends loop, safe to call from signal handlers and other threads
+        """
 
-def start():
+        self.running = False
+        # wakes up loop blocked on network events
+        self.mqtt_client.interrupt()
+
+
+def start(mqtt_client=None, bind=None):
     """
     starts this manager and calls it's routine
     loop which monitors mqtt connections
+    :param mqtt_client: mqtt client, by default a new connection
+    :param bind: called with function stopping this monitor, by default
+    stopped by process signals
     """
 
     config = load_config()
-    with Storage() as storage, MqttClient("keeperconnector", config) as mqtt_client, Connector(config, storage,
-                                                                                               mqtt_client) as connector:
+    with create_storage(config) as storage, History(storage, config) as history, Board() as board, \
+            mqtt_client or MqttClient("keeperconnector", config) as mqtt_client, \
+            Connector(config, storage, mqtt_client, history, board) as connector:
         del config
+        connector.running = True
+        (bind or bind_signals)(connector.stop)
         try:
             loop(connector, mqtt_client)
         except Exception as ex:
-            if running:
+            if connector.running:
                 raise ex
 
 
@@ -214,28 +327,28 @@ def loop(connector, mqtt_client):
     :param mqtt_client: mqtt client
     """
 
-    global running
-    running = True
-    while running:
+    while connector.running:
         # if we have been disconnected or failed o connect somehow
         # lets try to reconnect mqtt
-        if mqtt_client.connection_status() != 2 and running:
+        if mqtt_client.connection_status() != 2 and connector.running:
             mqtt_client.reconnect()
             continue
 
         connector.loop()
 
 
-# noinspection PyUnusedLocal
-def handle_signal(signum=None, frame=None):
+def bind_signals(stop):
     """
-    interrupts main loop
-    :param signum:
-    :param frame:
+    stops monitor when process is signaled
+    :param stop: function stopping monitor
     """
 
-    global running
-    running = False
+    # noinspection PyUnusedLocal
+    def handle_signal(signum=None, frame=None):
+        stop()
+
+    signal(SIGTERM, handle_signal)
+    signal(SIGINT, handle_signal)
 
 
 def main():
@@ -243,8 +356,6 @@ def main():
     main method which starts the manager
     """
 
-    signal(SIGTERM, handle_signal)
-    signal(SIGINT, handle_signal)
     try:
         start()
     except KeyboardInterrupt:
@@ -15,11 +15,11 @@ from core import exec_command, load_config, Logger, HEARTBEATER_STATUS, STATUS_R
     HEARTBEATER_STATUS_ICON, HEARTBEATER_MISSED_HEARTBEAT, HEARTBEATER_MISSED_HEARTBEAT_ICON, HEARTBEATER_HA_RESTARTS, \
     HEARTBEATER_HA_RESTARTS_ICON, HEARTBEATER_SYSTEM_RESTARTS, HEARTBEATER_SYSTEM_RESTARTS_ICON, \
     HEARTBEATER_LAST_HA_RESTART, TIME_FORMAT, HEARTBEATER_LAST_SYSTEM_RESTART, HEARTBEATER_LAST_HA_RESTART_ICON, \
-    HEARTBEATER_LAST_SYSTEM_RESTART_ICON, HEARTBEATER_LAST_HEARTBEAT, HEARTBEATER_LAST_HEARTBEAT_ICON
-from kio import Storage
-from network import MqttClient
-
-running = False
+    HEARTBEATER_LAST_SYSTEM_RESTART_ICON, HEARTBEATER_LAST_HEARTBEAT, HEARTBEATER_LAST_HEARTBEAT_ICON, \
+    HEARTBEATER_LOOP_LATENCY, HEARTBEATER_LOOP_LATENCY_ICON
+from kio import create_storage, History, Board, discard
+from network import MqttClient, Publisher, Discovery
+from runtime.watchdog import Watchdog
 
 
 class Heartbeater(object):
@@ -27,35 +27,55 @@ class Heartbeater(object):
     Heartbeat that monitors heartbeat messages
     """
 
-    def __init__(self, config, storage, mqtt_client):
+    def __init__(self, config, storage, mqtt_client, history=None, board=None):
         """
         initializes heartbeater
         :param config: keeper configuration dict
         :param storage: storage access
         :param mqtt_client: MQTT client
+        :param history: history of events, optional
+        :param board: board shared with manager, optional
         """
 
         self.attempts = 0
         self.misses = 0
+        self.heartbeats = 0
         self.ha_command = config["ha.restart.command"].split(" ")
         self.sys_command = config["system.restart.command"].split(" ")
+        # failed increments return None, last known value is kept
         self.inc = storage.inc
         self.registered = False
-        put = storage.put
-        self.missed_heartbeats = put(HEARTBEATER_MISSED_HEARTBEAT, storage.get_int(HEARTBEATER_MISSED_HEARTBEAT))
-        self.ha_restarts = put(HEARTBEATER_HA_RESTARTS, storage.get_int(HEARTBEATER_HA_RESTARTS))
-        self.system_restarts = put(HEARTBEATER_SYSTEM_RESTARTS, storage.get_int(HEARTBEATER_SYSTEM_RESTARTS))
-        self.put = put
-        self.get = storage.get
+        # initial state is loaded with a single query
+        state = storage.snapshot()
+        self.missed_heartbeats = state.get_int(HEARTBEATER_MISSED_HEARTBEAT)
+        self.ha_restarts = state.get_int(HEARTBEATER_HA_RESTARTS)
+        self.system_restarts = state.get_int(HEARTBEATER_SYSTEM_RESTARTS)
+        self.state = state
+        self.put = storage.put
+        self.sync = storage.sync
+        self.flush = storage.flush
+        self.history = history
+        self.record = history.record if history else discard
+        self.board = board
+        self.last_arrival = None
         self.now = datetime.now
         self.last_message = None
         self.last_known_message = None
         self.interval = config["heartbeat.interval"]
         self.topic = config["heartbeat.topic"]
+        self.subscribed = False
         self.delay = config["heartbeat.delay"]
-        self.states_queue = []
+        # states are coalesced and published on every loop
+        self.publisher = Publisher(mqtt_client, config, "heartbeater")
+        self.publish_state = self.publisher.publish_state
+        # discovery configs are only published when changed
+        self.discovery = Discovery(mqtt_client, storage, config, "heartbeater")
+        # ticks tell manager this process is not stuck
+        self.watchdog = Watchdog(board, "heartbeater", self.counters)
         mqtt_client.set_manager(self)
         self.mqtt_client = mqtt_client
+        # loop runs until monitor is stopped
+        self.running = False
         self.logger = Logger()
 
     def __enter__(self):
@@ -80,10 +100,18 @@ class Heartbeater(object):
 
         self.logger.info("stopping heartbeater[pid=%s]" % getpid())
         try:
-            self.mqtt_client.publish_state(HEARTBEATER_STATUS, STATUS_NOT_RUNNING)
+            self.publish_state(HEARTBEATER_STATUS, STATUS_NOT_RUNNING)
+            self.publisher.flush(True)
         except Exception as ex:
             self.logger.error("failed to publish heartbeater status: %s" % ex)
 
+        try:
+            self.publisher.close()
+        except Exception as ex:
+            self.logger.error("failed to spool undelivered states: %s" % ex)
+
+        self.logger.info("published %s states, %s publishes saved" % (self.publisher.published, self.publisher.saved))
+
     # noinspection PyUnusedLocal
     def on_connect(self, client, userdata, flags, rc):
         """
@@ -95,15 +123,21 @@ class Heartbeater(object):
         :param rc: rc code
         """
 
-        self.logger.info("subscribing topic %s" % self.topic)
-        client.subscribe(self.topic)
+        # heartbeats are queued by broker while disconnected when
+        # session is persistent, subscription is kept by session
+        if self.subscribed and flags.get("session present"):
+            self.logger.info("resuming session with topic %s" % self.topic)
+        else:
+            self.logger.info("subscribing topic %s" % self.topic)
+            client.subscribe(self.topic, 1)
+            self.subscribed = True
         # first time we are connected we register metrics and
         # send initial values
         if not self.registered:
             self.logger.info("registering metrics")
             try:
-                publish_state = self.mqtt_client.publish_state
-                register = self.mqtt_client.register
+                publish_state = self.publish_state
+                register = self.discovery.register
                 # register all metrics
                 register(HEARTBEATER_STATUS, HEARTBEATER_STATUS_ICON)
                 register(HEARTBEATER_MISSED_HEARTBEAT, HEARTBEATER_MISSED_HEARTBEAT_ICON)
@@ -112,18 +146,35 @@ class Heartbeater(object):
                 register(HEARTBEATER_LAST_HEARTBEAT, HEARTBEATER_LAST_HEARTBEAT_ICON)
                 register(HEARTBEATER_LAST_HA_RESTART, HEARTBEATER_LAST_HA_RESTART_ICON)
                 register(HEARTBEATER_LAST_SYSTEM_RESTART, HEARTBEATER_LAST_SYSTEM_RESTART_ICON)
+                register(HEARTBEATER_LOOP_LATENCY, HEARTBEATER_LOOP_LATENCY_ICON)
                 # sends initial values
                 publish_state(HEARTBEATER_STATUS, STATUS_RUNNING)
                 publish_state(HEARTBEATER_MISSED_HEARTBEAT, self.missed_heartbeats)
                 publish_state(HEARTBEATER_HA_RESTARTS, self.ha_restarts)
                 publish_state(HEARTBEATER_SYSTEM_RESTARTS, self.system_restarts)
-                publish_state(HEARTBEATER_LAST_HEARTBEAT, self.get(HEARTBEATER_LAST_HEARTBEAT))
-                publish_state(HEARTBEATER_LAST_HA_RESTART, self.get(HEARTBEATER_LAST_HA_RESTART))
-                publish_state(HEARTBEATER_LAST_SYSTEM_RESTART, self.get(HEARTBEATER_LAST_SYSTEM_RESTART))
+                state = self.state
+                publish_state(HEARTBEATER_LAST_HEARTBEAT, state.get(HEARTBEATER_LAST_HEARTBEAT))
+                publish_state(HEARTBEATER_LAST_HA_RESTART, state.get(HEARTBEATER_LAST_HA_RESTART))
+                publish_state(HEARTBEATER_LAST_SYSTEM_RESTART, state.get(HEARTBEATER_LAST_SYSTEM_RESTART))
+                self.publisher.flush()
+                self.logger.info("%s discovery configs unchanged" % self.discovery.skipped)
                 self.registered = True
+                # initial state is no longer needed
+                self.state = None
             except Exception as ex:
                 self.logger.error("failed to register initial metrics: %s" % ex)
 
+    # noinspection PyUnusedLocal
+    def on_disconnect(self, client, userdata, rc):
+        """
+        spools undelivered states until broker is back
+        :param client: mqtt client
+        :param userdata: userdata dict
+        :param rc: rc code
+        """
+
+        self.publisher.flush()
+
     # noinspection PyUnusedLocal
     def on_message(self, client, userdata, message):
         """
@@ -134,9 +185,15 @@ class Heartbeater(object):
         """
 
         self.last_message = self.now()
+        self.heartbeats += 1
+        # time between heartbeats
+        if self.last_arrival:
+            self.record(HEARTBEATER_LAST_HEARTBEAT, (self.last_message - self.last_arrival).total_seconds())
+
+        self.last_arrival = self.last_message
         last_message_fmt = strftime(TIME_FORMAT)
         self.logger.debug("last heartbeat from ha at %s", last_message_fmt)
-        self.states_queue.append((HEARTBEATER_LAST_HEARTBEAT, self.put(HEARTBEATER_LAST_HEARTBEAT, last_message_fmt)))
+        self.publish_state(HEARTBEATER_LAST_HEARTBEAT, self.put(HEARTBEATER_LAST_HEARTBEAT, last_message_fmt))
 
     def wait_ha_connection(self):
         """
@@ -148,13 +205,15 @@ class Heartbeater(object):
         now = self.now
         limit = now() + timedelta(seconds=300)
         self.logger.info("waiting for ha heartbeat")
-        while running and not self.last_message and now() < limit:
+        self.tick()
+        while self.running and not self.last_message and now() < limit:
             try:
-                self.mqtt_client.loop()
+                self.mqtt_client.process_events(1)
+                self.tick()
+                self.persist()
             except Exception as ex:
                 self.logger.warning(ex)
-
-            sleep(1)
+                sleep(1)
 
         if self.last_message:
             self.logger.info("ha is reachable")
@@ -174,8 +233,9 @@ class Heartbeater(object):
             if self.misses < 3:
                 self.misses += 1
                 self.last_message += timedelta(seconds=self.interval)
-                self.missed_heartbeats = self.inc(HEARTBEATER_MISSED_HEARTBEAT, self.missed_heartbeats)
-                self.states_queue.append((HEARTBEATER_MISSED_HEARTBEAT, self.missed_heartbeats))
+                self.missed_heartbeats = self.inc(HEARTBEATER_MISSED_HEARTBEAT) or self.missed_heartbeats
+                self.publish_state(HEARTBEATER_MISSED_HEARTBEAT, self.missed_heartbeats)
+                self.record(HEARTBEATER_MISSED_HEARTBEAT)
                 self.logger.warning("tolerating missed heartbeat (%s of 3)" % self.misses)
             elif self.attempts < 3:
                 self.attempts += 1
@@ -184,20 +244,27 @@ class Heartbeater(object):
                 self.logger.warning(
                     "restarting ha service (%s of 3) with command %s" % (self.attempts, " ".join(self.ha_command)))
                 if exec_command(self.ha_command):
-                    append = self.states_queue.append
-                    self.ha_restarts = self.inc(HEARTBEATER_HA_RESTARTS, self.ha_restarts)
-                    append((HEARTBEATER_HA_RESTARTS, self.ha_restarts))
-                    append(
-                        (HEARTBEATER_LAST_HA_RESTART, self.put(HEARTBEATER_LAST_HA_RESTART, strftime(TIME_FORMAT))))
+                    publish_state = self.publish_state
+                    self.ha_restarts = self.inc(HEARTBEATER_HA_RESTARTS) or self.ha_restarts
+                    publish_state(HEARTBEATER_HA_RESTARTS, self.ha_restarts)
+                    self.record(HEARTBEATER_HA_RESTARTS)
+                    publish_state(
+                        HEARTBEATER_LAST_HA_RESTART, self.put(HEARTBEATER_LAST_HA_RESTART, strftime(TIME_FORMAT)))
                     self.wait_ha_connection()
             else:
                 self.logger.warning("heartbeat still failing after 3 restarts")
                 self.logger.warning("rebooting")
-                append = self.states_queue.append
-                self.system_restarts = self.inc(HEARTBEATER_SYSTEM_RESTARTS, self.system_restarts)
-                append((HEARTBEATER_SYSTEM_RESTARTS, self.system_restarts))
-                append(
-                    (HEARTBEATER_LAST_SYSTEM_RESTART, self.put(HEARTBEATER_LAST_SYSTEM_RESTART, strftime(TIME_FORMAT))))
+                publish_state = self.publish_state
+                self.system_restarts = self.inc(HEARTBEATER_SYSTEM_RESTARTS) or self.system_restarts
+                publish_state(HEARTBEATER_SYSTEM_RESTARTS, self.system_restarts)
+                self.record(HEARTBEATER_SYSTEM_RESTARTS)
+                publish_state(
+                    HEARTBEATER_LAST_SYSTEM_RESTART, self.put(HEARTBEATER_LAST_SYSTEM_RESTART, strftime(TIME_FORMAT)))
+                # pending writes must reach disk before rebooting
+                self.flush()
+                if self.history:
+                    self.history.flush()
+
                 exec_command(self.sys_command)
 
             self.last_known_message = self.last_message
@@ -207,38 +274,114 @@ class Heartbeater(object):
             self.misses = 0
             self.attempts = 0
 
+    def counters(self):
+        """
+        return live counters published to board
+        :return: dict of counter names and values
+        """
+
+        return {
+            "heartbeats": self.heartbeats,
+            "misses": self.misses,
+            "attempts": self.attempts,
+            HEARTBEATER_MISSED_HEARTBEAT: self.missed_heartbeats,
+            HEARTBEATER_HA_RESTARTS: self.ha_restarts,
+            HEARTBEATER_SYSTEM_RESTARTS: self.system_restarts,
+            "published": self.publisher.published,
+            "saved": self.publisher.saved
+        }
+
+    def on_wait(self):
+        """
+        ticks while waiting for broker, values changed meanwhile are
+        stored as they would be on loop
+        """
+
+        self.tick()
+        self.persist()
+
+    def persist(self):
+        """
+        stores pending values and history events
+        """
+
+        self.sync()
+        if self.history:
+            self.history.sync()
+
+    def tick(self):
+        """
+        ticks watchdog, longest time between ticks is published
+        periodically
+        """
+
+        watchdog = self.watchdog
+        watchdog.tick()
+        latency = watchdog.report()
+        if latency is not None:
+            self.publish_state(HEARTBEATER_LOOP_LATENCY, latency)
+
     def loop(self):
         """
-        sleeps 1 second until next validation
+        waits for network events until next validation
         sends metrics if any to send
         """
 
-        publish_state = self.mqtt_client.publish_state
         try:
-            for states in self.states_queue:
-                publish_state(states[0], states[1])
-
-            self.states_queue = []
+            self.publisher.flush()
+            self.discovery.flush()
         except Exception as ex:
             self.logger.warning("unable to update metrics: %s" % ex)
 
-        sleep(1)
+        self.tick()
+
+        self.persist()
+
+        self.mqtt_client.process_events(self.publisher.next_flush(self.timeout()))
+
+    def timeout(self):
+        """
+        return seconds until heartbeat threshold is reached
+        :return: seconds to wait for network events
+        """
+
+        if not self.last_message:
+            return 1
+
+        elapsed = (self.now() - self.last_message).total_seconds()
+
+        return max(self.interval + self.delay - elapsed, 0) + 0.01
+
+    def stop(self):
+        """
+        ends loop, safe to call from signal handlers and other threads
+        """
+
+        self.running = False
+        # wakes up loop blocked on network events
+        self.mqtt_client.interrupt()
 
 
-def start():
+def start(mqtt_client=None, bind=None):
     """
     starts this manager and calls it's routine
     loop which monitors heartbeat messages
+    :param mqtt_client: mqtt client, by default a new connection
+    :param bind: called with function stopping this monitor, by default
+    stopped by process signals
     """
 
     config = load_config()
-    with Storage() as storage, MqttClient("keeperheartbeater", config) as mqtt_client, \
-            Heartbeater(config, storage, mqtt_client) as heartbeater:
+    with create_storage(config) as storage, History(storage, config) as history, Board() as board, \
+            mqtt_client or MqttClient("keeperheartbeater", config) as mqtt_client, \
+            Heartbeater(config, storage, mqtt_client, history, board) as heartbeater:
         del config
+        heartbeater.running = True
+        (bind or bind_signals)(heartbeater.stop)
         try:
             loop(heartbeater, mqtt_client)
         except Exception as ex:
-            if running:
+            if heartbeater.running:
                 raise ex
 
 
@@ -249,11 +392,9 @@ def loop(heartbeater, mqtt_client):
     :param mqtt_client: mqtt client
     """
 
-    global running
-    running = True
     heartbeater.wait_ha_connection()
-    while running:
-        if mqtt_client.connection_status() != 2 and running:
+    while heartbeater.running:
+        if mqtt_client.connection_status() != 2 and heartbeater.running:
             mqtt_client.wait_connection()
             heartbeater.wait_ha_connection()
             continue
@@ -262,16 +403,18 @@ def loop(heartbeater, mqtt_client):
         heartbeater.loop()
 
 
-# noinspection PyUnusedLocal
-def handle_signal(signum=None, frame=None):
+def bind_signals(stop):
     """
-    interrupts main loop
-    :param signum:
-    :param frame:
+    stops monitor when process is signaled
+    :param stop: function stopping monitor
     """
 
-    global running
-    running = False
+    # noinspection PyUnusedLocal
+    def handle_signal(signum=None, frame=None):
+        stop()
+
+    signal(SIGTERM, handle_signal)
+    signal(SIGINT, handle_signal)
 
 
 def main():
@@ -279,8 +422,6 @@ def main():
     main method which starts the manager
     """
 
-    signal(SIGTERM, handle_signal)
-    signal(SIGINT, handle_signal)
     try:
         start()
     except KeyboardInterrupt:
@@ -6,22 +6,30 @@
     :license: MIT, see LICENSE for more details.
 """
 
+from collections import deque
+from contextlib import nullcontext
 from importlib import import_module
-from multiprocessing import Process
-from os import kill, getpid
+from multiprocessing import get_context, get_start_method
+from multiprocessing.connection import wait
+from os import getpid, pipe, read, write, close, set_blocking
+from time import time
 from setproctitle import setproctitle
-from threading import Event
-from time import sleep
 
-from core import Logger, STATUS_RUNNING, STATUS_NOT_RUNNING
-from kio import Storage
+from core import Logger, Backoff, load_config, STATUS_RUNNING, STATUS_NOT_RUNNING
+from kio import create_storage, Board
+from network import Multiplexer
+from runtime.worker import Worker
 
 running = False
-wait_loop = Event()
+# pipe written by signal handler to wake up loop
+wakeup = None
+CHECK_INTERVAL = 30
 MODULES = {
     "heartbeater": "runtime.heartbeater",
     "connector": "runtime.connector"
 }
+# modules imported once by fork server, processes are forked already importing them
+PRELOAD = ["core", "kio", "network", "runtime.watchdog", "runtime.manager"] + list(MODULES.values())
 
 
 class Manager(object):
@@ -29,13 +37,51 @@ class Manager(object):
     Manager responsible for deploying other managers
     """
 
-    def __init__(self, storage):
+    def __init__(self, storage, board, config=None, multiplexer=None):
         """
         initializes manager
+        :param storage: storage access
+        :param board: board shared with launched processes
+        :param config: keeper configuration dict, loaded when not given
+        :param multiplexer: shared mqtt connection, processes are launched
+        as threads when given
         """
 
+        if config is None:
+            config = load_config()
+
         self.running_processes = {}
-        self.put = storage.put
+        # threads asked to end which are still running, replaced by a new thread
+        self.lingering = []
+        # seconds a process may go without ticking before being relaunched
+        timeout = config.get("watchdog.timeout", 300)
+        timeouts = config.get("watchdog.timeouts") or {}
+        self.deadlines = {name: timeouts.get(name, timeout) for name in MODULES}
+        # processes are checked at least once per deadline
+        self.check_interval = min([CHECK_INTERVAL] + [deadline for deadline in self.deadlines.values() if deadline])
+        self.launched_at = {}
+        # processes launched too often within window are quarantined
+        # and relaunches are delayed by backoff
+        self.restart_budget = config.get("process.restart.budget", 5)
+        self.restart_window = config.get("process.restart.window", 600)
+        delay = config.get("process.restart.delay", 1)
+        max_delay = config.get("process.restart.max.delay", 300)
+        self.backoffs = {name: Backoff(delay, max_delay) for name in MODULES}
+        self.launch_times = {name: deque() for name in MODULES}
+        self.relaunch_at = {}
+        self.restarts = {name: 0 for name in MODULES}
+        self.ready_times = {}
+        self.quarantines = 0
+        self.multiplexer = multiplexer
+        self.context = None if multiplexer else launch_context(config.get("process.launch.mode", "fork"))
+        self.put_many = storage.put_many
+        self.sync = storage.sync
+        self.board = board
+        # statuses already stored, storage is only written on changes
+        self.stored = {}
+        self.checks = 0
+        self.launches = 0
+        self.hangs = 0
         self.logger = Logger()
 
     def __enter__(self):
@@ -45,13 +91,13 @@ class Manager(object):
         """
 
         self.logger.info("starting manager[pid=%s]" % getpid())
-        put = self.put
-        for process in MODULES.items():
-            name, module = process
-            metric = "%sStatus" % name
-            put(metric, "Launching")
-            self.running_processes[name] = self.start_process(name, module)
-            put(metric, "Launched")
+        board = self.board
+        board.clear()
+        board.set_status("manager", STATUS_RUNNING)
+        for name, module in MODULES.items():
+            self.launch(name, module)
+
+        self.store()
 
         return self
 
@@ -65,62 +111,95 @@ class Manager(object):
         """
 
         self.logger.info("stopping manager[pid=%s]" % getpid())
-        running_processes = self.running_processes.items()
-        while 1:
-            finished = True
-            for name, process in running_processes:
-                if process.exitcode is None:
-                    finished = False
-                    break
-
-            sleep(1)
-            if finished:
-                return
-
-    def launcher(self, process, name):
-        """
-        used by process to start a new manager by
-        calling its main methods
-        :param process: process implementation
-        :param name: process name
-        """
-
-        try:
-            mod = import_module(process)
-            setproctitle("keeper:" + name)
-            mod.main()
-        except Exception as ex:
-            self.logger.warning("process %s[%s] failed: %s" % (name, process, ex))
-            pass
+        self.board.set_status("manager", STATUS_NOT_RUNNING)
+        # threads and processes forked by fork server are not
+        # signaled when only manager is stopped
+        for name, process in self.running_processes.items():
+            self.close_process(name, process)
+
+        # threads not ending are left behind, they are daemon threads
+        for process in self.lingering:
+            process.join(3)
 
     def start_process(self, name, module):
         """
         start a new process with a manager
-        this will retry 3 times until it fails
         :param name: manager name
         :param module: manager module
         :return: process where manager is running
         """
 
-        attempts = 0
-        while 1:
-            try:
-                self.logger.info("launching process %s[module=%s]" % (name, module))
-                process = Process(name=name, target=self.launcher, args=(module, name))
-                process.start()
-                self.logger.info("launched process %s[pid=%s]" % (name, process.pid))
-
-                return process
-            except Exception as ex:
-                if attempts >= 3:
-                    self.logger.error(
-                        "max of 3 launching attempts was reached when  launching process %s[module=%s]: %s" % (
-                            name, module, ex))
-                    raise ex
-
-                self.logger.warning("error launching process %s[module=%s]: %s" % (name, module, ex))
-                attempts += 1
-                self.logger.warning("reattempting launch of %s (%s of 3)" % (name, attempts))
+        self.logger.info("launching process %s[module=%s]" % (name, module))
+        if self.multiplexer:
+            process = Worker(name, thread_launcher, (module, self.multiplexer))
+        else:
+            process = self.context.Process(name=name, target=launcher, args=(module, name))
+
+        process.start()
+        self.logger.info("launched process %s[pid=%s]" % (name, process.pid))
+
+        return process
+
+    def launch(self, name, module):
+        """
+        launches a process, failed launches are retried after
+        backoff like ended processes
+        :param name: process name
+        :param module: process module
+        """
+
+        board = self.board
+        board.set_status(name, "Launching", 0)
+        now = time()
+        if name in self.launched_at:
+            self.restarts[name] += 1
+
+        self.launched_at[name] = now
+        self.launch_times[name].append(now)
+        self.ready_times.pop(name, None)
+        self.launches += 1
+        try:
+            process = self.start_process(name, module)
+        except Exception as ex:
+            self.logger.error("error launching process %s[module=%s]: %s" % (name, module, ex))
+            board.set_status(name, STATUS_NOT_RUNNING, 0)
+            self.schedule(name)
+            return
+
+        self.running_processes[name] = process
+        board.set_status(name, "Launched", process.pid)
+
+    def schedule(self, name):
+        """
+        schedules relaunch of an ended process. processes launched
+        restart budget times within window are quarantined until window
+        allows it, processes running for longer than maximum delay are
+        relaunched right away and others after backoff
+        :param name: process name
+        """
+
+        now = time()
+        launch_times = self.launch_times[name]
+        window = self.restart_window
+        while launch_times and now - launch_times[0] > window:
+            launch_times.popleft()
+
+        backoff = self.backoffs[name]
+        if self.restart_budget and len(launch_times) >= self.restart_budget:
+            delay = launch_times[0] + window - now
+            self.quarantines += 1
+            self.board.set_status(name, "Quarantined", 0)
+            self.logger.warning("process %s was launched %s times in %s seconds, quarantined for %.0f seconds" % (
+                name, len(launch_times), window, delay))
+        elif now - self.launched_at.get(name, 0) > backoff.cap:
+            # process was running for long, it is relaunched right away
+            backoff.reset()
+            delay = 0
+        else:
+            delay = backoff.next()
+            self.logger.info("relaunching process %s in %.1f seconds" % (name, delay))
+
+        self.relaunch_at[name] = now + delay
 
     def close_process(self, name, process):
         """
@@ -136,38 +215,154 @@ class Manager(object):
             process.join(3)
             if process.exitcode is None:
                 self.logger.info("stopping %s[pid=%s] with SIGKILL" % (name, process.pid))
-                kill(process.pid, 9)
+                process.kill()
         except Exception:
             try:
                 self.logger.info("stopping %s[pid=%s] with SIGKILL" % (name, process.pid))
-                kill(process.pid, 9)
+                process.kill()
             except Exception:
                 self.logger.info("unable to stop %s[pid=%s]" % (name, process.pid))
 
+    def wait_processes(self, timeout, interrupt=None):
+        """
+        blocks until a process ends, interrupt is readable or
+        timeout elapses
+        :param timeout: maximum seconds to wait
+        :param interrupt: file descriptor waking up wait, optional
+        :return: True when a process ended
+        """
+
+        sentinels = [process.sentinel for process in self.running_processes.values()]
+        ready = wait(sentinels + ([interrupt] if interrupt is not None else []), timeout)
+        if interrupt in ready:
+            try:
+                while read(interrupt, 64):
+                    pass
+            except OSError:
+                pass
+
+        return any(sentinel in ready for sentinel in sentinels)
+
     def check_processes(self):
         """
         check if all processes are running and
         launches those who are not
         """
 
-        put = self.put
+        board = self.board
+        self.checks += 1
+        self.close_lingering()
         for process in MODULES.items():
             name, module = process
-            metric = "%sStatus" % name
             process = self.running_processes.get(name)
             if process and is_running(process):
-                put(metric, STATUS_RUNNING)
-                continue
+                if not self.is_hung(name):
+                    self.check_ready(name)
+                    board.set_status(name, STATUS_RUNNING, process.pid)
+                    continue
+
+                self.hangs += 1
+            elif process:
+                self.logger.info("process %s is not running" % name)
 
-            put(metric, STATUS_NOT_RUNNING)
-            self.logger.info("process %s is not running" % name)
             if process:
+                board.set_status(name, STATUS_NOT_RUNNING, 0)
                 self.close_process(name, process)
+                del self.running_processes[name]
+                # threads can not be killed, a new thread is launched
+                # while it is left to end by itself
+                if is_running(process):
+                    self.lingering.append(process)
+                else:
+                    process.close()
 
-            put(metric, "Launching")
-            process = self.start_process(name, module)
-            put(metric, "Launched")
-            self.running_processes[name] = process
+                self.schedule(name)
+
+            if time() >= self.relaunch_at.get(name, 0):
+                self.launch(name, module)
+
+        self.store()
+
+    def close_lingering(self):
+        """
+        releases threads left behind once they end
+        """
+
+        for process in [process for process in self.lingering if not is_running(process)]:
+            self.logger.info("thread %s ended" % process.name)
+            self.lingering.remove(process)
+            process.close()
+
+    def check_ready(self, name):
+        """
+        tracks time taken by a launched process to tick for the
+        first time
+        :param name: process name
+        """
+
+        if name in self.ready_times:
+            return
+
+        # board holds first tick in milliseconds
+        ready = self.board.counters(name)[1].get("ready", 0)
+        launched_at = int(self.launched_at.get(name, 0) * 1000)
+        if ready >= launched_at:
+            self.ready_times[name] = (ready - launched_at) / 1000
+            self.logger.info("process %s ready in %.2f seconds" % (name, self.ready_times[name]))
+
+    def next_check(self):
+        """
+        return seconds until processes must be checked again
+        :return: seconds to wait
+        """
+
+        now = time()
+        pending = [at - now for name, at in self.relaunch_at.items() if name not in self.running_processes]
+
+        return max(min([self.check_interval] + pending), 0)
+
+    def is_hung(self, name):
+        """
+        check whether a process stopped ticking for longer than its
+        deadline, ticks are counters updates on board
+        :param name: process name
+        :return: True when process is hung
+        """
+
+        deadline = self.deadlines.get(name)
+        if not deadline:
+            return False
+
+        updated, counters = self.board.counters(name)
+        self.logger.debug("process %s updated at %s: %s", name, updated, counters)
+        # processes have until deadline after launch to tick
+        last_tick = max(updated, self.launched_at.get(name, 0))
+        stalled = time() - last_tick
+        if stalled <= deadline:
+            return False
+
+        self.logger.warning("process %s did not tick for %.0f seconds" % (name, stalled))
+
+        return True
+
+    def store(self):
+        """
+        publishes manager counters and stores process statuses
+        that changed since last call
+        """
+
+        board = self.board
+        board.update("manager", {"checks": self.checks, "launches": self.launches, "hangs": self.hangs,
+                                 "quarantines": self.quarantines})
+        statuses = {"%sStatus" % name: board.status(name)[0] for name in MODULES}
+        statuses.update(("%sRestarts" % name, restarts) for name, restarts in self.restarts.items())
+        statuses.update(("%sReadyTime" % name, round(ready, 2)) for name, ready in self.ready_times.items())
+        changed = {key: status for key, status in statuses.items() if self.stored.get(key) != status}
+        if changed:
+            self.put_many(changed)
+            self.stored.update(changed)
+
+        self.sync()
 
 
 def start():
@@ -176,7 +371,13 @@ def start():
     loop which launches other managers
     """
 
-    with Storage() as storage, Manager(storage) as manager:
+    config = load_config()
+    # threads share a single mqtt connection
+    threads = config.get("process.launch.mode") == "thread"
+    with create_storage(config) as storage, Board() as board, \
+            Multiplexer("keeper", config) if threads else nullcontext() as multiplexer, \
+            Manager(storage, board, config, multiplexer) as manager:
+        del config
         try:
             loop(manager)
         except Exception as ex:
@@ -186,15 +387,77 @@ def start():
 
 def loop(manager):
     """
-    continuously check launched processes
+    continuously check launched processes, ended processes
+    are relaunched as soon as they end
     :param manager: manager
     """
 
-    global running
+    global running, wakeup
     running = True
-    while running:
-        wait_loop.wait(30)
-        manager.check_processes()
+    interrupt, wakeup = pipe()
+    set_blocking(interrupt, False)
+    set_blocking(wakeup, False)
+    try:
+        while running:
+            manager.wait_processes(manager.next_check(), interrupt)
+            if running:
+                manager.check_processes()
+    finally:
+        write_end, wakeup = wakeup, None
+        close(interrupt)
+        close(write_end)
+
+
+def launcher(process, name):
+    """
+    used by process to start a new manager by
+    calling its main methods, defined at module level so it can
+    be sent to fork server
+    :param process: process implementation
+    :param name: process name
+    """
+
+    try:
+        mod = import_module(process)
+        setproctitle("keeper:" + name)
+        mod.main()
+    except Exception as ex:
+        Logger().warning("process %s[%s] failed: %s" % (name, process, ex))
+
+
+def thread_launcher(process, multiplexer, bind):
+    """
+    used by worker thread to start a manager using a new channel of
+    shared mqtt connection
+    :param process: process implementation
+    :param multiplexer: shared mqtt connection
+    :param bind: worker method receiving function stopping manager
+    """
+
+    mod = import_module(process)
+    with multiplexer.channel() as channel:
+        mod.start(channel, bind)
+
+
+def launch_context(mode):
+    """
+    return multiprocessing context used to launch processes. fork
+    server processes are forked from a process that already
+    imported keeper modules
+    :param mode: fork, forkserver or spawn
+    :return: multiprocessing context
+    """
+
+    try:
+        context = get_context(mode)
+    except ValueError:
+        Logger().warning("launch mode %s is not available, using %s" % (mode, get_start_method()))
+        return get_context()
+
+    if mode == "forkserver":
+        context.set_forkserver_preload(PRELOAD)
+
+    return context
 
 
 def is_running(process):
@@ -205,12 +468,7 @@ def is_running(process):
     """
 
     try:
-        if process.exitcode is not None:
-            return False
-
-        kill(process.pid, 0)
-
-        return True
+        return process.is_alive()
     except Exception:
         return False
 
@@ -225,4 +483,9 @@ def handle_signal(signum=None, frame=None):
 
     global running
     running = False
-    wait_loop.set()
+    # wakes up loop blocked on process sentinels
+    if wakeup is not None:
+        try:
+            write(wakeup, b"\0")
+        except OSError:
+            pass
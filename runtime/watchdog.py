@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    Watchdog ticks sent by monitors to manager through board,
+    monitors that stop ticking are relaunched by manager
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from time import time
+
+
+class Watchdog(object):
+    """
+    Monitor side of manager watchdog. Each tick writes monitor
+    counters to board along with time between ticks and time of
+    first tick
+    """
+
+    # seconds between latency reports
+    REPORT_INTERVAL = 60
+
+    def __init__(self, board, name, counters):
+        """
+        initializes watchdog
+        :param board: board shared with manager, optional
+        :param name: monitor name
+        :param counters: function returning monitor counters
+        """
+
+        self.board = board
+        self.name = name
+        self.counters = counters
+        self.last_tick = time()
+        self.reported_at = self.last_tick
+        # last and longest time between ticks since last report
+        self.latency = 0
+        self.max_latency = 0
+        # first tick, once process is ready
+        self.ready_at = None
+
+    def tick(self):
+        """
+        informs manager monitor is alive
+        """
+
+        now = time()
+        self.latency = now - self.last_tick
+        self.max_latency = max(self.max_latency, self.latency)
+        self.last_tick = now
+        if self.ready_at is None:
+            self.ready_at = now
+
+        if self.board:
+            counters = self.counters()
+            counters["latency"] = self.latency * 1000
+            counters["ready"] = self.ready_at * 1000
+            self.board.update(self.name, counters)
+
+    def report(self):
+        """
+        return longest time between ticks once report interval elapses
+        :return: seconds or None when report is not due
+        """
+
+        if self.last_tick - self.reported_at < Watchdog.REPORT_INTERVAL:
+            return None
+
+        latency = self.max_latency
+        self.max_latency = 0
+        self.reported_at = self.last_tick
+
+        return round(latency, 1)
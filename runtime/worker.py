@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+    Worker running a monitor as a thread of manager process
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import getpid, pipe, write, close
+from threading import Thread
+from core import Logger
+
+
+class Worker(object):
+    """
+    Thread providing the process methods used by manager. Sentinel
+    becomes readable once thread ends
+    """
+
+    def __init__(self, name, target, args):
+        """
+        initializes worker
+        :param name: thread name
+        :param target: function executed by thread, receives bind method
+        after its arguments
+        :param args: function arguments
+        """
+
+        self.name = name
+        self.pid = getpid()
+        self.exitcode = None
+        # function asking thread to end, bound by thread once it can be stopped
+        self.stop = None
+        self.stopping = False
+        self.logger = Logger()
+        self.sentinel, self.done = pipe()
+        self.thread = Thread(target=self.run, name=name, args=(target, args + (self.bind,)))
+        self.thread.daemon = True
+
+    def start(self):
+        """
+        starts thread
+        """
+
+        self.thread.start()
+
+    def run(self, target, args):
+        """
+        executes target, sentinel is written when it ends
+        :param target: function executed by thread
+        :param args: function arguments
+        """
+
+        try:
+            target(*args)
+            self.exitcode = 0
+        except BaseException as ex:
+            self.exitcode = 1
+            self.logger.warning("thread %s failed: %s" % (self.name, ex))
+        finally:
+            write(self.done, b"\0")
+
+    def is_alive(self):
+        """
+        check whether thread is running
+        :return: True if running
+        """
+
+        return self.thread.is_alive()
+
+    def join(self, timeout=None):
+        """
+        waits for thread to end
+        :param timeout: maximum seconds to wait, default forever
+        """
+
+        self.thread.join(timeout)
+
+    def bind(self, stop):
+        """
+        sets function asking thread to end, called right away when
+        thread was already asked to end
+        :param stop: function asking thread to end
+        """
+
+        self.stop = stop
+        if self.stopping:
+            stop()
+
+    def terminate(self):
+        """
+        asks thread to end, once it is bound
+        """
+
+        self.stopping = True
+        stop = self.stop
+        if stop:
+            stop()
+
+    def kill(self):
+        """
+        threads can not be killed, a thread not ending keeps running
+        """
+
+        self.logger.warning("thread %s is not ending" % self.name)
+
+    def close(self):
+        """
+        releases sentinel, called once thread ended
+        """
+
+        close(self.sentinel)
+        close(self.done)
@@ -5,7 +5,18 @@
     :license: MIT, see LICENSE for more details.
 """
 
+from .async_mqtt import TestAsyncMqtt
+from .backoff import TestBackoff
+from .backends import TestBaseStorage, TestSqliteBackend, TestSqliteWriteBehindBackend, TestMemoryBackend, \
+    TestLogBackend
+from .board import TestBoard
 from .connector import TestConnector
+from .discovery import TestDiscovery
 from .heartbeater import TestHeartbeater
+from .history import TestHistory
 from .mqtt import TestMqtt
-from .storage import TestStorage
\ No newline at end of file
+from .multiplexer import TestMultiplexer
+from .publisher import TestPublisher
+from .storage import TestStorage
+from .transfer import TestTransfer
+from .watchdog import TestWatchdog
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    Test asyncio mqtt
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from asyncio import new_event_loop, TimeoutError as WaitTimeout
+from json import loads
+from os import environ, getcwd, mkdir
+from os.path import join
+from shutil import rmtree, copy
+from time import time
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "async_mqtt")
+from network import AsyncMqttClient
+from core import common, STATE_TOPIC, CONFIG_TOPIC, AVAILABILITY_TOPIC
+
+
+class TestAsyncMqtt(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+        self.loop = new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_connect(self):
+        config = common.load_config()
+
+        async def connect():
+            async with AsyncMqttClient("keeperasynctest", config) as mqtt_client:
+                self.assertFalse(mqtt_client.is_connected())
+                await mqtt_client.connect(5)
+                self.assertTrue(mqtt_client.is_connected())
+                sock = mqtt_client.client.socket()
+
+            self.assertEqual(sock.fileno(), -1)
+
+        self.loop.run_until_complete(connect())
+
+    def test_not_connected(self):
+        config = common.load_config()
+        config["mqtt.broker"] = "1.1.1.1"
+
+        async def connect():
+            async with AsyncMqttClient("keeperasynctest", config) as mqtt_client:
+                await mqtt_client.connect(1)
+
+        self.assertRaises((WaitTimeout, OSError), self.loop.run_until_complete, connect())
+
+    def test_publish(self):
+        config = common.load_config()
+
+        metric = "kpAsyncTest%d" % (time() * 1000)
+
+        async def publish():
+            async with AsyncMqttClient("keeperasynctest", config) as mqtt_client, \
+                    AsyncMqttClient("keeperasynctest2", config) as receiver:
+                await mqtt_client.connect(5)
+                await receiver.connect(5)
+                await receiver.subscribe(STATE_TOPIC % metric)
+                await receiver.subscribe(CONFIG_TOPIC % metric)
+                start = time()
+                await mqtt_client.register(metric, "mdi:test")
+                await mqtt_client.publish_state(metric, 1)
+                messages = []
+                async for message in receiver:
+                    messages.append(message)
+                    if len(messages) == 2:
+                        break
+
+                self.assertLess(time() - start, 1)
+                config_message, state_message = sorted(messages, key=lambda item: item.topic)
+                self.assertEqual(config_message.topic, CONFIG_TOPIC % metric)
+                payload = loads(config_message.payload.decode("utf-8"))
+                self.assertEqual(payload["state_topic"], STATE_TOPIC % metric)
+                self.assertEqual(payload["icon"], "mdi:test")
+                self.assertEqual(payload["availability_topic"], AVAILABILITY_TOPIC % "keeperasynctest")
+                self.assertEqual(state_message.payload, b"1")
+                self.assertFalse(state_message.retain)
+                self.assertEqual(await receiver.next_message(0.2), None)
+
+        self.loop.run_until_complete(publish())
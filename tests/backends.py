@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+    Conformance and throughput tests shared by storage backends
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from multiprocessing import Process
+from os import environ, getcwd, mkdir
+from os.path import join
+from shutil import rmtree, copy
+from time import time
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "backends")
+from kio import create_storage, BaseStorage
+
+
+class BackendTests(object):
+    """
+    Tests run against every backend
+    """
+
+    config = {}
+    # whether values survive reopening storage
+    persistent = True
+    # whether processes share stored values
+    shared = True
+
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_put(self):
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.put("a", "a"), "a")
+            self.assertEqual(storage.put("b", 1), 1)
+            self.assertEqual(storage.put("c", 1.1), 1.1)
+            self.assertEqual(storage.get("a"), "a")
+            self.assertEqual(storage.get("b"), "1")
+            self.assertEqual(storage.get_int("b"), 1)
+            self.assertEqual(storage.get_float("c"), 1.1)
+            self.assertEqual(storage.get("d"), None)
+            self.assertEqual(storage.get_int("d"), 0)
+            storage.put("a", "b")
+            self.assertEqual(storage.get("a"), "b")
+
+    def test_reopen(self):
+        if not self.persistent:
+            return
+
+        with create_storage(self.config) as storage:
+            storage.put("a", "a")
+            storage.inc("b")
+
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.get("a"), "a")
+            self.assertEqual(storage.get_int("b"), 1)
+
+    def test_inc(self):
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.inc("a"), 1)
+            self.assertEqual(storage.inc("a", 0, 2), 3)
+            self.assertEqual(storage.inc("b", 5), 6)
+            self.assertEqual(storage.inc("c", 0, 0.5), 0.5)
+            self.assertEqual(storage.get_int("a"), 3)
+
+    def test_many(self):
+        with create_storage(self.config) as storage:
+            storage.put_many({"a": 1, "b": "b"})
+            self.assertEqual(storage.get_many(("a", "b", "c")), {"a": "1", "b": "b", "c": None})
+            self.assertEqual(storage.inc_many({"a": 2, "c": 1}), {"a": 3, "c": 1})
+            self.assertEqual(storage.get_many(("a", "c")), {"a": "3", "c": "1"})
+
+    def test_snapshot(self):
+        with create_storage(self.config) as storage:
+            storage.put_many({"a": 1, "b": "b"})
+            snapshot = storage.snapshot()
+            self.assertEqual(snapshot.get_int("a"), 1)
+            self.assertEqual(snapshot.get("b"), "b")
+            self.assertEqual(snapshot.get("c"), None)
+
+    def test_shared(self):
+        if not self.shared:
+            return
+
+        processes = [Process(target=increment, args=(self.config,)) for i in range(3)]
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        with create_storage(self.config) as storage:
+            storage.sync()
+            self.assertEqual(storage.get_int("a"), 150)
+
+    def test_throughput(self):
+        count = 2000
+        with create_storage(self.config) as storage:
+            start = time()
+            for i in range(count):
+                storage.inc("k%s" % (i % 10))
+                storage.sync()
+
+            elapsed = time() - start
+            self.assertEqual(sum(storage.get_int("k%s" % i) for i in range(10)), count)
+            self.assertLess(elapsed, 60)
+
+
+def increment(config):
+    with create_storage(config) as storage:
+        for i in range(50):
+            storage.inc("a")
+            storage.sync()
+
+
+class TestBaseStorage(TestCase):
+    def test_abstract(self):
+        class PartialStorage(BaseStorage):
+            def put_many(self, values):
+                return values
+
+        self.assertRaises(TypeError, BaseStorage)
+        self.assertRaises(TypeError, PartialStorage)
+
+
+class TestSqliteBackend(BackendTests, TestCase):
+    config = {"storage.backend": "sqlite"}
+
+
+class TestSqliteWriteBehindBackend(BackendTests, TestCase):
+    config = {"storage.backend": "sqlite", "storage.write.behind": True, "storage.cache": True,
+              "storage.profile": "fast"}
+
+
+class TestMemoryBackend(BackendTests, TestCase):
+    config = {"storage.backend": "memory"}
+    persistent = False
+    shared = False
+
+
+class TestLogBackend(BackendTests, TestCase):
+    config = {"storage.backend": "log", "storage.log.compact": 10}
+
+    def test_compact(self):
+        with create_storage(self.config) as storage:
+            for i in range(100):
+                storage.put("a", i)
+                storage.sync()
+
+            self.assertLessEqual(storage.records, storage.COMPACT_RATIO * 10)
+
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.get_int("a"), 99)
+
+    def test_recover(self):
+        with create_storage(self.config) as storage:
+            storage.put("a", 1)
+            log_path = storage.log_path
+
+        # process ended while appending a record
+        with open(log_path, "ab") as log:
+            log.write(b'["b", "2"]\n["c", ')
+
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.get_int("a"), 1)
+            self.assertEqual(storage.get_int("b"), 2)
+            storage.put("c", 3)
+
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.get_int("c"), 3)
+
+        with open(log_path, "ab") as log:
+            log.write(b'["d", \n')
+
+        with create_storage(self.config) as storage:
+            self.assertEqual(storage.get_int("a"), 1)
+            self.assertEqual(storage.get_int("c"), 3)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+    Test backoff
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import environ, getcwd
+from os.path import join
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "backoff")
+from core import Backoff
+
+
+class TestBackoff(TestCase):
+    def test_delays(self):
+        backoff = Backoff(1, 60)
+        previous = 1
+        for i in range(50):
+            delay = backoff.next()
+            self.assertGreaterEqual(delay, 1)
+            self.assertLessEqual(delay, min(60, previous * 3))
+            previous = delay
+
+        self.assertEqual(backoff.attempts, 50)
+
+    def test_cap(self):
+        backoff = Backoff(10, 5)
+        self.assertEqual(backoff.next(), 10)
+
+    def test_jitter(self):
+        delays = set()
+        for i in range(20):
+            backoff = Backoff(1, 60)
+            backoff.next()
+            delays.add(backoff.next())
+
+        self.assertGreater(len(delays), 1)
+
+    def test_reset(self):
+        backoff = Backoff(1, 60)
+        backoff.next()
+        backoff.next()
+        backoff.reset()
+        self.assertEqual(backoff.last_attempts, 2)
+        self.assertEqual(backoff.attempts, 0)
+        self.assertEqual(backoff.elapsed(), 0)
+        self.assertLessEqual(backoff.next(), 3)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+    Test board
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from multiprocessing import Process, Event
+from os import environ, getcwd, mkdir, remove, getpid
+from os.path import join
+from shutil import rmtree, copy
+from time import time
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "board")
+from kio import Board
+from kio.board import STATUS_RECORD, SEQUENCE
+from core import STATUS_RUNNING, STATUS_NOT_RUNNING, HEARTBEATER_MISSED_HEARTBEAT
+
+
+class TestBoard(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        try:
+            remove(Board().path)
+        except OSError:
+            pass
+
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_status(self):
+        with Board() as board:
+            board.clear()
+            self.assertEqual(board.status("heartbeater"), (None, 0))
+            board.set_status("heartbeater", "Launched", 10)
+            board.set_status("connector", STATUS_RUNNING)
+            self.assertEqual(board.status("heartbeater"), ("Launched", 10))
+            self.assertEqual(board.status("connector"), (STATUS_RUNNING, getpid()))
+            board.set_status("heartbeater", STATUS_NOT_RUNNING, 0)
+            self.assertEqual(board.status("heartbeater"), (STATUS_NOT_RUNNING, 0))
+            self.assertRaises(ValueError, board.set_status, "heartbeater", "unknown")
+            board.clear()
+            self.assertEqual(board.status("connector"), (None, 0))
+
+    def test_counters(self):
+        with Board() as board:
+            board.clear()
+            self.assertEqual(board.counters("heartbeater")[0], 0)
+            start = time()
+            board.update("heartbeater", {"heartbeats": 2, HEARTBEATER_MISSED_HEARTBEAT: 1, "unknown": 3})
+            updated, counters = board.counters("heartbeater")
+            self.assertGreaterEqual(updated, start)
+            self.assertEqual(counters["heartbeats"], 2)
+            self.assertEqual(counters[HEARTBEATER_MISSED_HEARTBEAT], 1)
+            self.assertEqual(counters["misses"], 0)
+            self.assertNotIn("unknown", counters)
+            self.assertEqual(board.counters("connector")[1]["attempts"], 0)
+
+    def test_shared(self):
+        with Board() as board:
+            board.clear()
+            process = Process(target=update, args=(1000, None))
+            process.start()
+            process.join()
+            self.assertEqual(board.counters("connector")[1]["attempts"], 999)
+
+        with Board() as board:
+            self.assertEqual(board.counters("connector")[1]["attempts"], 999)
+
+    def test_consistent_read(self):
+        with Board() as board:
+            board.clear()
+            started = Event()
+            process = Process(target=update, args=(20000, started))
+            process.start()
+            started.wait(10)
+            while process.is_alive():
+                counters = board.counters("connector")[1]
+                self.assertEqual(len(set(counters.values())), 1)
+
+            process.join()
+
+    def test_torn_write(self):
+        with Board() as board:
+            board.clear()
+            board.update("connector", {"attempts": 1})
+            self.assertEqual(board.counters("connector")[1]["attempts"], 1)
+            offset = board.offsets["connector"] + STATUS_RECORD.size
+            # writer died mid write, sequence was left odd over a partial record
+            sequence = SEQUENCE.unpack_from(board.buffer, offset)[0] + 1
+            SEQUENCE.pack_into(board.buffer, offset, sequence)
+            self.assertEqual(board.counters("connector")[1]["attempts"], 1)
+            with Board() as other:
+                self.assertEqual(other.counters("connector")[1]["attempts"], 0)
+
+            # next write keeps sequence odd while in progress
+            board.update("connector", {"attempts": 2})
+            self.assertEqual(SEQUENCE.unpack_from(board.buffer, offset)[0], sequence + 3)
+            self.assertEqual(board.counters("connector")[1]["attempts"], 2)
+
+
+def update(count, started):
+    with Board() as board:
+        if started:
+            started.set()
+
+        names = board.counter_names["connector"]
+        for i in range(count):
+            board.update("connector", {name: i for name in names})
@@ -12,7 +12,7 @@ from shutil import rmtree, copy
 from unittest import TestCase
 
 environ["KEEPER_HOME"] = join(getcwd(), "connector")
-from kio import Storage
+from kio import Storage, History
 from network import MqttClient
 from runtime.connector import Connector
 
@@ -53,6 +53,19 @@ class TestConnector(TestCase):
             self.assertEqual(storage.get_int(constants.CONNECTOR_FAILED_CONNECTIONS), 4)
             self.assertEqual(storage.get_int(constants.CONNECTOR_MQTT_RESTARTS), 1)
 
+    def test_on_not_connected_stored(self):
+        config = common.load_config()
+        config["storage.write.behind"] = True
+        with Storage(config) as storage, History(storage, config) as history, \
+                MqttClient("keeperconnectortest", config) as mc, Connector(config, storage, mc, history) as connector:
+            # values changed while broker is down are stored before next loop
+            connector.on_not_connect()
+            self.assertFalse(storage.pending)
+            self.assertFalse(history.pending)
+            with Storage({}) as reader, History(reader, {}) as other:
+                self.assertEqual(reader.get_int(constants.CONNECTOR_FAILED_CONNECTIONS), 1)
+                self.assertEqual(len(other.range(constants.CONNECTOR_FAILED_CONNECTIONS, 0, resolution="raw")), 1)
+
     def test_stable(self):
         config = common.load_config()
         with Storage() as storage, MqttClient("keeperconnectortest", config) as mc, Connector(config, storage,
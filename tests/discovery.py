@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+    Test discovery
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from json import loads
+from os import environ, getcwd, mkdir
+from os.path import join
+from shutil import rmtree, copy
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "discovery")
+from kio import Storage
+from network import Discovery
+from core import DISCOVERY_FINGERPRINT, STATE_TOPIC, AVAILABILITY_TOPIC
+
+
+class TestDiscovery(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_unchanged(self):
+        client = Client()
+        with Storage() as storage:
+            Discovery(client, storage, {}).register("kpTest", "mdi:test")
+            # worker restart
+            discovery = Discovery(client, storage, {})
+            discovery.register("kpTest", "mdi:test")
+            discovery.register("kpOther", "mdi:test")
+            self.assertEqual(client.registered, [("kpTest", "mdi:test"), ("kpOther", "mdi:test")])
+            self.assertEqual(discovery.skipped, 1)
+            self.assertEqual(discovery.registered, 1)
+
+    def test_changed(self):
+        client = Client()
+        with Storage() as storage:
+            Discovery(client, storage, {}).register("kpTest", "mdi:test")
+            Discovery(client, storage, {}).register("kpTest", "mdi:other")
+            self.assertEqual(client.registered, [("kpTest", "mdi:test"), ("kpTest", "mdi:other")])
+
+    def test_refresh(self):
+        client = Client()
+        with Storage() as storage:
+            Discovery(client, storage, {}).register("kpTest", "mdi:test")
+            fingerprint, published = storage.get(DISCOVERY_FINGERPRINT % "kpTest").split(" ")
+            storage.put(DISCOVERY_FINGERPRINT % "kpTest", "%s %d" % (fingerprint, int(published) - 60))
+            Discovery(client, storage, {"mqtt.discovery.refresh": 120}).register("kpTest", "mdi:test")
+            self.assertEqual(len(client.registered), 1)
+            Discovery(client, storage, {"mqtt.discovery.refresh": 30}).register("kpTest", "mdi:test")
+            self.assertEqual(len(client.registered), 2)
+
+    def test_document(self):
+        client = Client()
+        with Storage() as storage:
+            Discovery(client, storage, {}, "test").register("kpTest", "mdi:test")
+            self.assertEqual(loads(client.payload)["state_topic"], STATE_TOPIC % "kpTest")
+            # sensors read state from json document
+            Discovery(client, storage, {"mqtt.state.json": True}, "test").register("kpTest", "mdi:test")
+            config = loads(client.payload)
+            self.assertEqual(len(client.registered), 2)
+            self.assertEqual(config["state_topic"], STATE_TOPIC % "keepertest")
+            self.assertEqual(config["json_attributes_topic"], STATE_TOPIC % "keepertest")
+            self.assertEqual(config["value_template"], "{{ value_json.kpTest }}")
+            self.assertEqual(config["icon"], "mdi:test")
+
+    def test_acknowledge(self):
+        client = Client()
+        client.delivery = Delivery
+        with Storage() as storage:
+            discovery = Discovery(client, storage, {})
+            discovery.register("kpTest", "mdi:test")
+            discovery.register("kpOther", "mdi:test")
+            self.assertIsNone(storage.get(DISCOVERY_FINGERPRINT % "kpTest"))
+            # worker restarted before broker acknowledged config
+            Discovery(client, storage, {}).register("kpTest", "mdi:test")
+            self.assertEqual(len(client.registered), 3)
+            discovery.pending[DISCOVERY_FINGERPRINT % "kpTest"][1].published = True
+            discovery.pending[DISCOVERY_FINGERPRINT % "kpOther"][1].rc = 4
+            discovery.flush()
+            self.assertIsNotNone(storage.get(DISCOVERY_FINGERPRINT % "kpTest"))
+            self.assertIsNone(storage.get(DISCOVERY_FINGERPRINT % "kpOther"))
+            self.assertEqual(discovery.pending, {})
+
+    def test_availability(self):
+        client = Client()
+        client.availability_topic = AVAILABILITY_TOPIC % "keepertest"
+        with Storage() as storage:
+            Discovery(client, storage, {}).register("kpTest", "mdi:test")
+            config = loads(client.payload)
+            self.assertEqual(config["availability_topic"], AVAILABILITY_TOPIC % "keepertest")
+            self.assertEqual(config["state_topic"], STATE_TOPIC % "kpTest")
+
+
+class Client(object):
+    def __init__(self):
+        self.registered = []
+        self.payload = None
+        self.delivery = None
+
+    # noinspection PyUnusedLocal
+    def register(self, metric, icon, payload=None):
+        self.registered.append((metric, icon))
+        self.payload = payload
+
+        return self.delivery() if self.delivery else None
+
+
+class Delivery(object):
+    def __init__(self):
+        self.published = False
+        self.rc = 0
+
+    def is_published(self):
+        if self.rc == 4:
+            raise RuntimeError("client is not connected")
+
+        return self.published
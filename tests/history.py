@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    Test history
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import environ, getcwd, mkdir
+from os.path import join
+from shutil import rmtree, copy
+from time import time
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "history")
+from kio import Storage, History
+
+
+class TestHistory(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_record(self):
+        now = int(time())
+        with Storage({}) as storage, History(storage, {}) as history:
+            history.record("a", 30, now - 10)
+            history.record("a", 40, now - 5)
+            history.record("b")
+            self.assertEqual(history.range("a", now - 60), [])
+            history.flush()
+            self.assertEqual(history.range("a", now - 60), [(now - 10, 1, 30, 30, 30), (now - 5, 1, 40, 40, 40)])
+            self.assertEqual(len(history.range("b", now - 60)), 1)
+
+        with Storage({}) as storage, History(storage, {}) as history:
+            self.assertEqual(len(history.range("a", now - 60, now - 6)), 1)
+
+    def test_exit(self):
+        with Storage({}) as storage, History(storage, {}) as history:
+            history.record("a")
+
+        with Storage({}) as storage, History(storage, {}) as history:
+            self.assertEqual(len(history.range("a", 0, resolution="raw")), 1)
+
+    def test_rollup(self):
+        now = 1000 * 3600
+        with Storage({}) as storage, History(storage, {"history.rollup.delay": 0}) as history:
+            history.record("a", 10, now - 3600)
+            history.record("a", 20, now - 3590)
+            history.record("a", 30, now - 3500)
+            history.record("a", 50, now + 30)
+            history.flush()
+            history.compact(now)
+            self.assertEqual(history.range("a", 0, now, "minute"),
+                             [(now - 3600, 2, 30, 10, 20), (now - 3540, 1, 30, 30, 30)])
+            self.assertEqual(history.range("a", 0, now, "hour"), [(now - 3600, 3, 60, 10, 30)])
+            # incomplete minutes are rolled on next compaction
+            history.compact(now + 60)
+            self.assertEqual(len(history.range("a", 0, now + 60, "minute")), 3)
+            self.assertEqual(history.range("a", 0, now + 60, "hour"), [(now - 3600, 3, 60, 10, 30)])
+            history.compact(now + 3600)
+            self.assertEqual(history.range("a", 0, now + 3600, "hour"),
+                             [(now - 3600, 3, 60, 10, 30), (now, 1, 50, 50, 50)])
+
+    def test_rollup_delay(self):
+        now = 1000 * 3600
+        with Storage({}) as storage, History(storage, {"history.rollup.delay": 120}) as history, \
+                History(storage, {"history.rollup.delay": 120}) as writer:
+            history.record("a", 10, now - 200)
+            history.flush()
+            history.compact(now)
+            self.assertEqual(history.range("a", 0, now, "minute"), [(now - 240, 1, 10, 10, 10)])
+            # events flushed late by other writers are still rolled up
+            writer.record("a", 20, now - 90)
+            writer.record("a", 30, now - 30)
+            history.compact(now + 30)
+            writer.flush()
+            history.compact(now + 120)
+            self.assertEqual(history.range("a", 0, now, "minute"),
+                             [(now - 240, 1, 10, 10, 10), (now - 120, 1, 20, 20, 20), (now - 60, 1, 30, 30, 30)])
+
+    def test_retention(self):
+        now = int(time()) // 60 * 60
+        config = {"history.retention.raw": 1, "history.max.rows": 2, "history.rollup.delay": 0}
+        with Storage({}) as storage, History(storage, config) as history:
+            history.record("a", 1, now - 2 * 86400)
+            history.record("a", 2, now - 3)
+            history.record("a", 3, now - 2)
+            history.record("a", 4, now - 1)
+            history.flush()
+            history.compact(now)
+            self.assertEqual([row[2] for row in history.range("a", 0, now, "raw")], [3, 4])
+            self.assertEqual(len(history.range("a", 0, now, "minute")), 2)
@@ -10,10 +10,13 @@ from os.path import join
 
 environ["KEEPER_HOME"] = join(getcwd(), "mqtt")
 from shutil import rmtree, copy
+from socket import SHUT_RDWR
+from threading import Timer
+from time import time
 from unittest import TestCase
 from network import MqttClient
 
-from core import common
+from core import common, AVAILABILITY_TOPIC
 
 
 class TestMqtt(TestCase):
@@ -55,3 +58,104 @@ class TestMqtt(TestCase):
             self.assertEqual(mqtt_client.connection_status(), 2)
 
         self.assertEqual(mqtt_client.connection_status(), 0)
+
+    def test_event_loop(self):
+        config = common.load_config()
+        config["mqtt.event.loop"] = True
+        manager = Receiver()
+        with MqttClient("keepermqtttest", config) as subscriber, MqttClient("keepermqtttest2", config) as publisher:
+            subscriber.set_manager(manager)
+            subscriber.reconnect()
+            publisher.reconnect()
+            subscriber.client.subscribe("keeper/test/event")
+            subscriber.process_events(1)
+            start = time()
+            publisher.client.publish("keeper/test/event", "1")
+            publisher.process_events(0)
+            while not manager.messages and time() - start < 5:
+                subscriber.process_events(5)
+
+            self.assertEqual(manager.messages, [b"1"])
+            self.assertLess(time() - start, 1)
+
+    def test_interrupt(self):
+        config = common.load_config()
+        config["mqtt.event.loop"] = True
+        with MqttClient("keepermqtttest", config) as mqtt_client:
+            mqtt_client.reconnect()
+            Timer(0.2, mqtt_client.interrupt).start()
+            start = time()
+            mqtt_client.process_events(5)
+            self.assertLess(time() - start, 2)
+            self.assertEqual(mqtt_client.connection_status(), 2)
+
+    def test_poll_loop(self):
+        config = common.load_config()
+        config["mqtt.event.loop"] = False
+        with MqttClient("keepermqtttest", config) as mqtt_client:
+            mqtt_client.reconnect()
+            mqtt_client.process_events(0)
+            self.assertEqual(mqtt_client.connection_status(), 2)
+
+    def test_availability(self):
+        config = common.load_config()
+        config["mqtt.event.loop"] = True
+        client_id = "keepermqtttest%d" % (time() * 1000)
+        topic = AVAILABILITY_TOPIC % client_id
+        manager = Receiver()
+        with MqttClient("keepermqtttest2", config) as subscriber:
+            subscriber.set_manager(manager)
+            subscriber.reconnect()
+            subscriber.client.subscribe(topic, 1)
+            with MqttClient(client_id, config) as mqtt_client:
+                mqtt_client.reconnect()
+                start = time()
+                while manager.messages != [b"online"] and time() - start < 5:
+                    subscriber.process_events(1)
+
+                self.assertEqual(manager.messages, [b"online"])
+                # connection drops without disconnecting
+                mqtt_client.client.socket().shutdown(SHUT_RDWR)
+                mqtt_client.connected = False
+                start = time()
+                while len(manager.messages) < 2 and time() - start < 5:
+                    subscriber.process_events(1)
+
+                self.assertEqual(manager.messages, [b"online", b"offline"])
+
+            subscriber.client.publish(topic, None, 1, True)
+            subscriber.process_events(0)
+
+    def test_persistent_session(self):
+        config = common.load_config()
+        config["mqtt.event.loop"] = True
+        config["mqtt.persistent.session"] = True
+        topic = "keeper/test/session%d" % (time() * 1000)
+        manager = Receiver()
+        with MqttClient("keepermqtttest2", config) as publisher:
+            publisher.reconnect()
+            with MqttClient("keepermqttsessiontest", config) as mqtt_client:
+                mqtt_client.set_manager(manager)
+                mqtt_client.reconnect()
+                mqtt_client.client.subscribe(topic, 1)
+                mqtt_client.process_events(0.5)
+                mqtt_client.client.socket().shutdown(SHUT_RDWR)
+                mqtt_client.process_events(0.5)
+                # message sent while disconnected is queued by broker
+                publisher.client.publish(topic, "1", 1)
+                publisher.process_events(0.5)
+                mqtt_client.reconnect()
+                start = time()
+                while not manager.messages and time() - start < 5:
+                    mqtt_client.process_events(1)
+
+                self.assertEqual(manager.messages, [b"1"])
+
+
+class Receiver(object):
+    def __init__(self):
+        self.messages = []
+
+    # noinspection PyUnusedLocal
+    def on_message(self, client, userdata, message):
+        self.messages.append(message.payload)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    Test mqtt multiplexer
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import environ, getcwd, mkdir
+from os.path import join
+from shutil import rmtree, copy
+from socket import SHUT_RDWR
+from threading import current_thread
+from time import time
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "multiplexer")
+from network import Multiplexer, MqttClient
+from core import common, STATE_TOPIC
+
+
+class TestMultiplexer(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_routing(self):
+        config = common.load_config()
+        first = Monitor("keeper/test/first")
+        second = Monitor("keeper/test/+")
+        with Multiplexer("keepermultiplexertest", config) as multiplexer, \
+                MqttClient("keepermultiplexertest2", config) as publisher:
+            first_channel = multiplexer.channel()
+            first_channel.set_manager(first)
+            publisher.reconnect()
+            first_channel.wait_connection()
+            # channels added later are notified of existing connection
+            second_channel = multiplexer.channel()
+            second_channel.set_manager(second)
+            self.assertEqual(second_channel.reconnect(), 2)
+            self.assertEqual(first.connects, 1)
+            self.assertEqual(second.connects, 1)
+            self.assertEqual(first.threads, {current_thread().name})
+            # waits for subscriptions
+            first_channel.process_events(0.5)
+            publisher.client.publish("keeper/test/first", "1")
+            publisher.client.publish("keeper/test/second", "2")
+            publisher.process_events(0)
+            start = time()
+            while len(second.messages) < 2 and time() - start < 5:
+                second_channel.process_events(5)
+
+            first_channel.process_events(0.2)
+            self.assertEqual(first.messages, [b"1"])
+            self.assertEqual(second.messages, [b"1", b"2"])
+            self.assertEqual(multiplexer.connections, 1)
+
+    def test_publish(self):
+        config = common.load_config()
+        metric = "kpMultiplexerTest%d" % (time() * 1000)
+        receiver = Monitor(STATE_TOPIC % metric)
+        with MqttClient("keepermultiplexertest2", config) as subscriber:
+            subscriber.set_manager(receiver)
+            subscriber.reconnect()
+            with Multiplexer("keepermultiplexertest", config) as multiplexer:
+                channel = multiplexer.channel()
+                channel.publish_state(metric, 1)
+                channel.wait_connection()
+
+            start = time()
+            while not receiver.messages and time() - start < 5:
+                subscriber.process_events(1)
+
+            self.assertEqual(receiver.messages, [b"1"])
+
+    def test_reconnect(self):
+        config = common.load_config()
+        monitors = [Monitor("keeper/test/first"), Monitor("keeper/test/second")]
+        with Multiplexer("keepermultiplexertest", config) as multiplexer:
+            channels = [multiplexer.channel() for monitor in monitors]
+            for channel, monitor in zip(channels, monitors):
+                channel.set_manager(monitor)
+                channel.wait_connection()
+
+            # drops shared connection
+            multiplexer.call(multiplexer.mqtt_client.client.socket().shutdown, SHUT_RDWR)
+            start = time()
+            while multiplexer.connections < 2 and time() - start < 10:
+                channels[0].process_events(1)
+
+            for channel in channels:
+                channel.wait_connection()
+
+            self.assertEqual(multiplexer.connections, 2)
+            self.assertEqual([monitor.connects for monitor in monitors], [2, 2])
+            self.assertEqual([monitor.disconnects for monitor in monitors], [1, 1])
+
+    def test_reconnect_unreachable(self):
+        config = common.load_config()
+        config["mqtt.broker"] = "1.1.1.1"
+        monitor = Monitor("keeper/test/first")
+        with Multiplexer("keepermultiplexertest", config) as multiplexer:
+            with multiplexer.channel() as channel:
+                channel.set_manager(monitor)
+                # monitor ticks on every attempt while broker is unreachable
+                for attempt in range(3):
+                    self.assertNotEqual(channel.reconnect(), 2)
+
+                self.assertEqual(monitor.waits, 3)
+
+    def test_close(self):
+        config = common.load_config()
+        config["mqtt.broker"] = "1.1.1.1"
+        monitor = Monitor("keeper/test/first")
+        with Multiplexer("keepermultiplexertest", config) as multiplexer:
+            with multiplexer.channel() as channel:
+                channel.set_manager(monitor)
+                # monitor is called while waiting for connection
+                channel.wait_connection(1.5)
+                self.assertEqual(channel.connection_status(), 0)
+                self.assertGreater(monitor.waits, 0)
+                # waits for connection are interrupted when closing
+                channel.interrupt()
+                start = time()
+                channel.wait_connection()
+                self.assertLess(time() - start, 1)
+
+            start = time()
+            while multiplexer.channels and time() - start < 5:
+                channel.process_events(0.1)
+
+            self.assertEqual(multiplexer.channels, [])
+
+
+class Monitor(object):
+    def __init__(self, topic):
+        self.topic = topic
+        self.connects = 0
+        self.disconnects = 0
+        self.messages = []
+        self.threads = set()
+        self.waits = 0
+
+    # noinspection PyUnusedLocal
+    def on_connect(self, client, userdata, flags, rc):
+        self.connects += 1
+        self.threads.add(current_thread().name)
+        client.subscribe(self.topic)
+
+    # noinspection PyUnusedLocal
+    def on_disconnect(self, client, userdata, rc):
+        self.disconnects += 1
+
+    # noinspection PyUnusedLocal
+    def on_message(self, client, userdata, message):
+        self.messages.append(message.payload)
+
+    def on_wait(self):
+        self.waits += 1
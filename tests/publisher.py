@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+    Test publisher
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import environ, getcwd, mkdir
+from os.path import join
+from shutil import rmtree, copy
+from time import time
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "publisher")
+from network import Publisher, Outbox, MqttClient
+from core import common, STATE_TOPIC
+
+
+class TestPublisher(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_coalesce(self):
+        client = Client()
+        publisher = Publisher(client, {})
+        publisher.publish_state("kpTest", 1)
+        publisher.publish_state("kpTest", 2)
+        publisher.publish_state("kpOther", 1)
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", 2), ("kpOther", 1)])
+        self.assertEqual(publisher.published, 2)
+        self.assertEqual(publisher.saved, 1)
+
+    def test_unchanged(self):
+        client = Client()
+        publisher = Publisher(client, {})
+        publisher.publish_state("kpTest", 1)
+        publisher.flush()
+        # same value while first message is in flight
+        publisher.publish_state("kpTest", "1")
+        publisher.flush()
+        client.acknowledge()
+        publisher.publish_state("kpTest", 1)
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", 1)])
+        publisher.publish_state("kpTest", 2)
+        publisher.flush()
+        # value in flight is what broker will hold
+        publisher.publish_state("kpTest", 1)
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", 1), ("kpTest", 2), ("kpTest", 1)])
+        self.assertEqual(publisher.saved, 2)
+
+    def test_interval(self):
+        client = Client()
+        publisher = Publisher(client, {"mqtt.publish.intervals": {"kpTest": 60}})
+        publisher.publish_state("kpTest", 1)
+        publisher.publish_state("kpOther", 1)
+        publisher.flush()
+        publisher.publish_state("kpTest", 2)
+        publisher.publish_state("kpOther", 2)
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", 1), ("kpOther", 1), ("kpOther", 2)])
+        self.assertEqual(list(publisher.pending), ["kpTest"])
+        self.assertGreater(publisher.next_flush(120), 59)
+        publisher.published_at["kpTest"] -= 60
+        self.assertEqual(publisher.next_flush(120), 0)
+        publisher.flush()
+        self.assertEqual(client.published[-1], ("kpTest", 2))
+
+    def test_failure(self):
+        client = Client()
+        client.fail = True
+        publisher = Publisher(client, {})
+        publisher.publish_state("kpTest", 1)
+        self.assertRaises(ConnectionError, publisher.flush)
+        client.fail = False
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", 1)])
+
+    def test_document(self):
+        client = Client()
+        publisher = Publisher(client, {"mqtt.state.json": True}, "test")
+        publisher.publish_state("kpTest", 1)
+        publisher.publish_state("kpOther", None)
+        publisher.flush()
+        publisher.publish_state("kpTest", 2)
+        publisher.flush()
+        publisher.publish_state("kpTest", 2)
+        publisher.flush()
+        self.assertEqual(client.published, [("keepertest", '{"kpOther": null, "kpTest": 1}'),
+                                            ("keepertest", '{"kpOther": null, "kpTest": 2}')])
+        self.assertEqual(publisher.published, 2)
+        self.assertEqual(publisher.saved, 2)
+
+    def test_force(self):
+        client = Client()
+        publisher = Publisher(client, {"mqtt.publish.interval": 60})
+        publisher.publish_state("kpTest", 1)
+        publisher.flush()
+        publisher.publish_state("kpTest", 2)
+        publisher.flush()
+        publisher.flush(True)
+        self.assertEqual(client.published, [("kpTest", 1), ("kpTest", 2)])
+
+    def test_disconnected(self):
+        client = Client()
+        client.connected = False
+        publisher = Publisher(client, {}, "test")
+        publisher.publish_state("kpTest", 1)
+        publisher.flush()
+        self.assertEqual(client.published, [])
+        self.assertEqual(publisher.next_flush(30), 30)
+        client.connected = True
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", 1)])
+
+    def test_restart(self):
+        client = Client()
+        publisher = Publisher(client, {}, "test")
+        publisher.publish_state("kpTest", 1)
+        publisher.flush()
+        client.connected = False
+        publisher.publish_state("kpOther", 2)
+        publisher.flush()
+        # unacknowledged and queued states survive restart
+        client = Client()
+        publisher = Publisher(client, {}, "test")
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest", "1"), ("kpOther", 2)])
+        client.acknowledge()
+        publisher.flush()
+        self.assertEqual(list(Publisher(client, {}, "test").pending), [])
+
+    def test_inflight(self):
+        client = Client()
+        publisher = Publisher(client, {"mqtt.outbox.inflight": 2})
+        for i in range(5):
+            publisher.publish_state("kpTest%d" % i, i)
+
+        publisher.flush()
+        self.assertEqual(client.published, [("kpTest0", 0), ("kpTest1", 1)])
+        client.acknowledge()
+        publisher.flush()
+        self.assertEqual(client.published[2:], [("kpTest2", 2), ("kpTest3", 3)])
+
+    def test_capacity(self):
+        outbox = Outbox(2)
+        outbox.put("kpTest", 1)
+        outbox.put("kpOther", 1)
+        self.assertTrue(outbox.put("kpTest", 2))
+        outbox.put("kpLast", 1)
+        self.assertEqual(list(outbox.items()), [("kpOther", 1), ("kpLast", 1)])
+        self.assertEqual(outbox.dropped, 1)
+
+    def test_acknowledge(self):
+        config = common.load_config()
+        metric = "kpPublisherTest%d" % (time() * 1000)
+        with MqttClient("keeperpublishertest", config) as mqtt_client:
+            mqtt_client.reconnect()
+            publisher = Publisher(mqtt_client, config)
+            publisher.publish_state(metric, 1)
+            publisher.flush()
+            start = time()
+            while publisher.sent and time() - start < 5:
+                mqtt_client.process_events(0.1)
+                publisher.flush()
+
+            self.assertEqual(publisher.acknowledged, {metric: "1"})
+            mqtt_client.client.publish(STATE_TOPIC % metric, None, 1, True)
+            mqtt_client.process_events(0)
+
+
+class Client(object):
+    def __init__(self):
+        self.published = []
+        self.deliveries = []
+        self.fail = False
+        self.connected = True
+
+    def publish_state(self, metric, state):
+        if self.fail:
+            raise ConnectionError("not connected")
+
+        self.published.append((metric, state))
+        delivery = Delivery()
+        self.deliveries.append(delivery)
+
+        return delivery
+
+    def acknowledge(self):
+        for delivery in self.deliveries:
+            delivery.published = True
+
+
+class Delivery(object):
+    def __init__(self):
+        self.published = False
+
+    def is_published(self):
+        return self.published
@@ -5,6 +5,7 @@
     :license: MIT, see LICENSE for more details.
 """
 
+from multiprocessing import Process
 from os import environ, getcwd, mkdir
 from os.path import join
 from shutil import rmtree, copy
@@ -83,3 +84,204 @@ class TestStorage(TestCase):
     def test_get_not_exists(self):
         with Storage() as storage:
             self.assertEqual(storage.get("c"), None)
+
+    def test_write_behind(self):
+        config = {"storage.write.behind": True, "storage.flush.interval": 0}
+        with Storage(config) as storage, Storage({}) as reader:
+            storage.put("a", "a")
+            self.assertEqual(storage.inc("b", 1), 2)
+            self.assertEqual(storage.get("a"), "a")
+            self.assertEqual(storage.get_int("b"), 2)
+            self.assertEqual(reader.get("a"), None)
+            storage.sync()
+            self.assertEqual(reader.get("a"), "a")
+            self.assertEqual(reader.get_int("b"), 2)
+            storage.put("a", "b")
+
+        with Storage() as storage:
+            self.assertEqual(storage.get("a"), "b")
+
+    def test_write_behind_interval(self):
+        config = {"storage.write.behind": True, "storage.flush.interval": 60}
+        with Storage(config) as storage, Storage({}) as reader:
+            storage.put("a", "a")
+            storage.sync()
+            self.assertEqual(reader.get("a"), None)
+            storage.flush()
+            self.assertEqual(reader.get("a"), "a")
+
+    def test_concurrent_writers(self):
+        processes = [Process(target=write_keys, args=("p%s" % i,)) for i in range(3)]
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        with Storage() as storage:
+            for i in range(3):
+                for j in range(20):
+                    self.assertEqual(storage.get_int("p%s%s" % (i, j)), j)
+
+    def test_inc_stored(self):
+        with Storage({}) as storage:
+            storage.put("a", 5)
+            self.assertEqual(storage.inc("a"), 6)
+            self.assertEqual(storage.inc("a", 0, 2), 8)
+            self.assertEqual(storage.get_int("a"), 8)
+
+    def test_inc_write_behind(self):
+        with Storage({"storage.write.behind": True}) as storage:
+            storage.put("a", 5)
+            self.assertEqual(storage.inc("a"), 6)
+            self.assertEqual(storage.inc("b"), 1)
+
+        with Storage({}) as storage:
+            self.assertEqual(storage.get_int("a"), 6)
+            self.assertEqual(storage.get_int("b"), 1)
+
+        # increments are added to values stored by other processes on flush
+        with Storage({"storage.write.behind": True}) as storage, Storage({}) as writer:
+            self.assertEqual(storage.inc("a"), 7)
+            self.assertEqual(storage.inc_many({"a": 2, "c": 1}), {"a": 9, "c": 1})
+            writer.inc("a", 0, 10)
+            writer.put("c", 5)
+            storage.flush()
+            self.assertEqual(writer.get_int("a"), 19)
+            self.assertEqual(writer.get_int("c"), 6)
+            storage.put("a", 1)
+            self.assertEqual(storage.inc("a"), 2)
+            storage.flush()
+            self.assertEqual(writer.get_int("a"), 2)
+
+    def test_inc_without_returning(self):
+        # sqlite older than 3.35 reads incremented values back
+        for config in ({}, {"storage.write.behind": True}):
+            with Storage(config) as storage, Storage({}) as writer:
+                storage.returning = False
+                writer.put("a", 5)
+                self.assertEqual(storage.inc("a"), 6)
+                self.assertEqual(storage.inc_many({"a": 2, "b": 1}), {"a": 8, "b": 1})
+                writer.inc("a", 0, 10)
+                storage.flush()
+                self.assertEqual(writer.get_int("a"), 18)
+                self.assertEqual(writer.get_int("b"), 1)
+
+            with Storage() as storage:
+                storage.put_many({"a": 0, "b": 0})
+
+    def test_inc_failed(self):
+        with Storage({}) as storage:
+            storage.conn.execute("create trigger fail before update on keystore begin "
+                                 "select raise(abort, 'failed'); end")
+            storage.put("a", 1)
+            self.assertIsNone(storage.inc("a"))
+            self.assertEqual(storage.inc_many({"a": 1}), {})
+            storage.conn.execute("drop trigger fail")
+
+    def test_many(self):
+        for config in ({}, {"storage.write.behind": True}):
+            with Storage(config) as storage:
+                storage.put_many({"a": 1, "b": "b", "c": 1.5})
+                self.assertEqual(storage.get_many(("a", "b", "c")), {"a": "1", "b": "b", "c": "1.5"})
+                self.assertEqual(storage.inc_many({"a": 2, "d": 1}), {"a": 3, "d": 1})
+                self.assertEqual(storage.get_int("a"), 3)
+                self.assertEqual(storage.get_int("d"), 1)
+                self.assertEqual(storage.get_many(("d", "e")), {"d": "1", "e": None})
+
+            with Storage() as storage:
+                storage.put_many({"a": 0, "d": 0})
+
+    def test_snapshot(self):
+        with Storage({"storage.write.behind": True}) as storage:
+            storage.put_many({"a": 1, "b": 1.5})
+            storage.flush()
+            storage.put("c", "c")
+            snapshot = storage.snapshot()
+            self.assertEqual(snapshot.get_int("a"), 1)
+            self.assertEqual(snapshot.get_float("b"), 1.5)
+            self.assertEqual(snapshot.get("c"), "c")
+            self.assertEqual(snapshot.get_int("d"), 0)
+
+    def test_cache(self):
+        with Storage({"storage.cache": True}) as storage, Storage({}) as writer:
+            writer.put_many({"a": 1, "b": 1.5})
+            self.assertEqual(storage.get_int("a"), 1)
+            self.assertEqual(storage.get_float("b"), 1.5)
+            self.assertEqual(storage.get("c"), None)
+            writer.put_many({"a": 2, "c": "c"})
+            self.assertEqual(storage.get_int("a"), 1)
+            self.assertEqual(storage.get("c"), None)
+            storage.sync()
+            self.assertEqual(storage.get_int("a"), 2)
+            self.assertEqual(storage.get_many(("a", "c")), {"a": "2", "c": "c"})
+            storage.put("a", 3)
+            self.assertEqual(storage.inc("b"), 2.5)
+            self.assertEqual(storage.get_int("a"), 3)
+            self.assertEqual(storage.get_float("b"), 2.5)
+            self.assertEqual(writer.get_int("a"), 3)
+
+    def test_locked(self):
+        with Storage({"storage.busy.timeout": 100}) as storage:
+            storage.put("a", 1)
+            locker = storage.connect()
+            locker.execute("begin immediate")
+            try:
+                # lock failures are logged and rolled back like failed statements
+                self.assertEqual(storage.put("a", 2), 2)
+                self.assertIsNone(storage.inc("a"))
+                self.assertEqual(storage.rollbacks, 2)
+            finally:
+                locker.rollback()
+                locker.close()
+
+            self.assertEqual(storage.get_int("a"), 1)
+            self.assertEqual(storage.inc("a"), 2)
+
+    def test_flush_locked(self):
+        config = {"storage.write.behind": True, "storage.busy.timeout": 100}
+        with Storage(config) as storage:
+            storage.put("a", 1)
+            storage.inc("b")
+            storage.flush()
+            storage.put("a", 2)
+            storage.inc("b")
+            locker = storage.connect()
+            locker.execute("begin immediate")
+            try:
+                # failed flush keeps pending writes and increments
+                storage.flush()
+                storage.inc("b")
+                self.assertEqual(storage.pending["a"], "2")
+                self.assertEqual(storage.get_int("b"), 3)
+            finally:
+                locker.rollback()
+                locker.close()
+
+            storage.flush()
+            self.assertFalse(storage.pending)
+            with Storage({}) as reader:
+                self.assertEqual(reader.get_int("a"), 2)
+                self.assertEqual(reader.get_int("b"), 3)
+
+    def test_profiles(self):
+        for profile, synchronous, autocheckpoint in (("safe", 2, 1000), ("balanced", 1, 1000), ("fast", 1, 10000),
+                                                     ("unknown", 2, 1000)):
+            with Storage({"storage.profile": profile}) as storage:
+                self.assertEqual(storage.conn.execute("pragma synchronous").fetchone()[0], synchronous)
+                self.assertEqual(storage.conn.execute("pragma wal_autocheckpoint").fetchone()[0], autocheckpoint)
+
+    def test_checkpoint(self):
+        with Storage({"storage.profile": "fast"}) as storage:
+            storage.put("a", 1)
+            storage.sync()
+            self.assertEqual(storage.checkpointed_at, 0)
+            storage.written_at -= 300
+            storage.sync()
+            self.assertNotEqual(storage.checkpointed_at, 0)
+
+
+def write_keys(prefix):
+    with Storage({}) as storage:
+        for i in range(20):
+            storage.put("%s%s" % (prefix, i), i)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+    Test export and import
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from io import StringIO
+from os import environ, getcwd, mkdir, remove
+from os.path import join
+from shutil import rmtree, copy
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "transfer")
+from kio import Storage, MemoryStorage, History, export_storage, import_storage, open_stream
+
+
+class TestTransfer(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_round_trip(self):
+        path = join(environ["KEEPER_HOME"], "export.gz")
+        with Storage({}) as storage, History(storage, {}) as history:
+            storage.put_many({"k%s" % i: i for i in range(25)})
+            for i in range(30):
+                history.record("a", i, 1000 + i * 60)
+
+            history.flush()
+            history.compact(7200)
+            expected = history.range("a", 0, 4000, "minute")
+            with open_stream(path, "w") as stream:
+                result = export_storage(storage, stream, 7)
+
+        self.assertEqual(result, {"keystore": 25, "history": 30, "history_minute": 30, "history_hour": 1,
+                                  "history_rollup": 2})
+        remove(Storage({}).storage_path)
+        with Storage({}) as storage, History(storage, {}) as history:
+            with open_stream(path, "r") as stream:
+                self.assertEqual(import_storage(storage, stream, 4), result)
+
+            self.assertEqual(storage.get_int("k24"), 24)
+            self.assertEqual(len(storage.snapshot()), 25)
+            self.assertEqual(history.range("a", 0, 4000, "minute"), expected)
+            self.assertEqual(len(history.range("a", 0, 4000, "raw")), 30)
+
+    def test_import_twice(self):
+        path = join(environ["KEEPER_HOME"], "export.gz")
+        with Storage({}) as storage, History(storage, {}) as history:
+            for i in range(10):
+                history.record("a", i, 1000 + i)
+
+            history.flush()
+            with open_stream(path, "w") as stream:
+                export_storage(storage, stream, 3)
+
+            history.record("a", 20, 2000)
+            history.flush()
+            # events already stored are not duplicated
+            for i in range(2):
+                with open_stream(path, "r") as stream:
+                    import_storage(storage, stream, 4)
+
+            self.assertEqual([row[2] for row in history.range("a", 0, 4000, "raw")], list(range(10)) + [20])
+
+    def test_memory(self):
+        stream = StringIO()
+        with Storage({}) as storage, History(storage, {}) as history:
+            storage.put("a", 1)
+            history.record("a")
+            history.flush()
+            export_storage(storage, stream)
+
+        stream.seek(0)
+        with MemoryStorage() as storage:
+            self.assertEqual(import_storage(storage, stream), {"keystore": 1})
+            self.assertEqual(storage.get_int("a"), 1)
+            stream = StringIO()
+            export_storage(storage, stream)
+
+        stream.seek(0)
+        with Storage({}) as storage:
+            storage.put("a", 2)
+            storage.put("b", 2)
+            self.assertEqual(import_storage(storage, stream), {"keystore": 1})
+            self.assertEqual(storage.get_int("a"), 1)
+            self.assertEqual(storage.get_int("b"), 2)
+
+    def test_write_behind(self):
+        stream = StringIO()
+        with Storage({"storage.write.behind": True}) as storage:
+            storage.put("a", 1)
+            export_storage(storage, stream)
+
+        stream.seek(0)
+        with MemoryStorage() as storage:
+            import_storage(storage, stream)
+            self.assertEqual(storage.get_int("a"), 1)
+
+    def test_format(self):
+        with MemoryStorage() as storage:
+            self.assertRaises(ValueError, import_storage, storage, StringIO(""))
+            self.assertRaises(ValueError, import_storage, storage, StringIO('{"format": "other"}\n'))
+            self.assertRaises(ValueError, import_storage, storage,
+                              StringIO('{"format": "keeper-export", "version": 2}\n'))
+            stream = StringIO('{"format": "keeper-export", "version": 1}\n{"table": "other", "columns": []}\n'
+                              '["a"]\n{"table": "keystore", "columns": ["key", "value"]}\n["a", "1"]\n')
+            self.assertEqual(import_storage(storage, stream), {"keystore": 1})
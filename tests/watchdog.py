@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+    Test watchdog
+    :copyright: © 2018 by Nuno Gonçalves
+    :license: MIT, see LICENSE for more details.
+"""
+
+from os import environ, getcwd, mkdir, remove
+from os.path import join
+from shutil import rmtree, copy
+from multiprocessing.connection import wait
+from threading import Event
+from time import time, sleep
+from unittest import TestCase
+
+environ["KEEPER_HOME"] = join(getcwd(), "watchdog")
+from kio import Board
+from runtime.manager import Manager
+from runtime.watchdog import Watchdog
+from runtime.worker import Worker
+
+
+class Storage(object):
+    def put_many(self, values):
+        pass
+
+    def sync(self):
+        pass
+
+
+class FailedProcess(object):
+    pid = 1
+
+
+class TestWatchdog(TestCase):
+    def setUp(self):
+        mkdir(environ["KEEPER_HOME"])
+        config_path = join(environ["KEEPER_HOME"], "config")
+        mkdir(config_path)
+        copy(join(environ["KEEPER_HOME"], "..", "..", "config", "keeper.json"), config_path)
+
+    def tearDown(self):
+        try:
+            remove(Board().path)
+        except OSError:
+            pass
+
+        rmtree(environ["KEEPER_HOME"])
+
+    def test_tick(self):
+        with Board() as board:
+            board.clear()
+            watchdog = Watchdog(board, "heartbeater", lambda: {"heartbeats": 3})
+            start = time()
+            sleep(0.05)
+            watchdog.tick()
+            updated, counters = board.counters("heartbeater")
+            self.assertGreaterEqual(updated, start)
+            self.assertEqual(counters["heartbeats"], 3)
+            self.assertGreaterEqual(counters["latency"], 50)
+            ready = counters["ready"]
+            self.assertGreaterEqual(ready, int(start * 1000))
+            watchdog.tick()
+            self.assertEqual(board.counters("heartbeater")[1]["ready"], ready)
+            # board is optional
+            Watchdog(None, "heartbeater", dict).tick()
+
+    def test_report(self):
+        watchdog = Watchdog(None, "connector", dict)
+        watchdog.tick()
+        self.assertIsNone(watchdog.report())
+        watchdog.last_tick -= 5
+        watchdog.tick()
+        self.assertGreaterEqual(watchdog.max_latency, 5)
+        watchdog.reported_at -= Watchdog.REPORT_INTERVAL
+        self.assertGreaterEqual(watchdog.report(), 5)
+        self.assertEqual(watchdog.max_latency, 0)
+        self.assertIsNone(watchdog.report())
+
+    def test_hung(self):
+        with Board() as board:
+            board.clear()
+            manager = Manager(Storage(), board, {"watchdog.timeout": 10, "watchdog.timeouts": {"connector": 0}})
+            # processes have until deadline after launch to tick
+            manager.launched_at["heartbeater"] = time()
+            self.assertFalse(manager.is_hung("heartbeater"))
+            manager.launched_at["heartbeater"] = time() - 20
+            self.assertTrue(manager.is_hung("heartbeater"))
+            board.update("heartbeater", {})
+            self.assertFalse(manager.is_hung("heartbeater"))
+            # deadline of 0 disables watchdog
+            manager.launched_at["connector"] = time() - 20
+            self.assertFalse(manager.is_hung("connector"))
+
+    def test_restart_budget(self):
+        with Board() as board:
+            board.clear()
+            manager = Manager(Storage(), board, {
+                "process.restart.budget": 3, "process.restart.window": 60, "process.restart.delay": 1,
+                "process.restart.max.delay": 10})
+            manager.start_process = lambda name, module: FailedProcess()
+            manager.launch("heartbeater", "runtime.heartbeater")
+            self.assertEqual(board.status("heartbeater")[0], "Launched")
+            # process ended right away, relaunch is delayed
+            manager.schedule("heartbeater")
+            self.assertGreaterEqual(manager.relaunch_at["heartbeater"] - time(), 0.9)
+            manager.launch("heartbeater", "runtime.heartbeater")
+            manager.schedule("heartbeater")
+            manager.launch("heartbeater", "runtime.heartbeater")
+            self.assertEqual(manager.restarts["heartbeater"], 2)
+            # budget of 3 launches per window is exhausted
+            manager.schedule("heartbeater")
+            self.assertEqual(board.status("heartbeater")[0], "Quarantined")
+            self.assertGreater(manager.relaunch_at["heartbeater"] - time(), 55)
+            self.assertEqual(manager.quarantines, 1)
+            # launches left the window and process ran for long
+            manager.launch_times["heartbeater"].clear()
+            manager.launched_at["heartbeater"] -= 20
+            manager.schedule("heartbeater")
+            self.assertLessEqual(manager.relaunch_at["heartbeater"], time())
+            self.assertEqual(manager.backoffs["heartbeater"].attempts, 0)
+
+    def test_ready(self):
+        with Board() as board:
+            board.clear()
+            manager = Manager(Storage(), board, {})
+            manager.launched_at["connector"] = time()
+            manager.check_ready("connector")
+            self.assertNotIn("connector", manager.ready_times)
+            Watchdog(board, "connector", dict).tick()
+            manager.check_ready("connector")
+            self.assertLess(manager.ready_times["connector"], 1)
+
+    def test_hung_thread(self):
+        with Board() as board:
+            board.clear()
+            manager = Manager(Storage(), board, {"watchdog.timeout": 10, "watchdog.timeouts": {"connector": 0}})
+            released = Event()
+            workers = []
+
+            def start_process(name, module):
+                worker = Worker(name, lambda bind: released.wait(10), ())
+                worker.start()
+                workers.append(worker)
+                return worker
+
+            manager.start_process = start_process
+            manager.launch("heartbeater", "runtime.heartbeater")
+            manager.launch("connector", "runtime.connector")
+            manager.launched_at["heartbeater"] -= 20
+            manager.check_processes()
+            # stuck thread is left behind and replaced once relaunch delay elapses
+            self.assertEqual(manager.hangs, 1)
+            self.assertEqual(manager.lingering, [workers[0]])
+            self.assertNotIn("heartbeater", manager.running_processes)
+            manager.relaunch_at["heartbeater"] = 0
+            manager.check_processes()
+            self.assertEqual(manager.hangs, 1)
+            self.assertIs(manager.running_processes["heartbeater"], workers[2])
+            released.set()
+            workers[0].join(5)
+            manager.check_processes()
+            self.assertEqual(manager.lingering, [])
+
+    def test_worker(self):
+        stopped = Event()
+
+        def run(bind):
+            bind(stopped.set)
+            stopped.wait(5)
+
+        worker = Worker("heartbeater", run, ())
+        worker.start()
+        self.assertTrue(worker.is_alive())
+        self.assertEqual(wait([worker.sentinel], 0.1), [])
+        worker.terminate()
+        self.assertEqual(wait([worker.sentinel], 5), [worker.sentinel])
+        worker.join(1)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(worker.exitcode, 0)
+        worker.close()
+        # thread asked to end before binding is stopped once it binds
+        stopped.clear()
+        worker = Worker("heartbeater", run, ())
+        worker.terminate()
+        worker.start()
+        worker.join(1)
+        self.assertFalse(worker.is_alive())
+        worker.close()